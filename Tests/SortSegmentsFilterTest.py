@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# The SortSegments filter must keep every segment of a layer and its nearest
+# neighbour search must stay fast - even if all segments start in the same
+# column (the end of each segment is far away from the grid of start points).
+
+import sys
+sys.path.insert(0,'.')
+
+import time
+
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_SAFETY
+from pycam.Toolpath.Filters import SortSegments
+
+
+NUM_OF_SEGMENTS = 200
+MAX_DURATION = 0.5
+
+
+def get_segments(moves):
+    segments = []
+    for move_type, args in moves:
+        if move_type == MOVE_SAFETY:
+            segments.append([])
+        else:
+            segments[-1].append(args)
+    return sorted([tuple(segment) for segment in segments if segment])
+
+
+if __name__ == "__main__":
+    # parallel passes starting at x=0
+    moves = []
+    for index in range(NUM_OF_SEGMENTS):
+        moves.append((MOVE_SAFETY, None))
+        moves.append((MOVE_STRAIGHT, (0.0, float(index), 1.0)))
+        moves.append((MOVE_STRAIGHT, (100.0, float(index), 1.0)))
+    start_time = time.time()
+    result = list(moves | SortSegments(0.0))
+    duration = time.time() - start_time
+    success = True
+    if get_segments(result) != get_segments(moves):
+        print "The sorted layer does not contain every segment exactly once"
+        success = False
+    if duration > MAX_DURATION:
+        print "Sorting %d segments took too long: %f seconds" \
+                % (NUM_OF_SEGMENTS, duration)
+        success = False
+    if success:
+        print "OK"
+    else:
+        sys.exit(1)
+
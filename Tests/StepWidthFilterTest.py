@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# The StepWidth filter must return the same moves for a list of moves and for
+# a MoveStore (including positions exactly halfway between two steps).
+
+import sys
+sys.path.insert(0,'.')
+
+import random
+
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_SAFETY
+from pycam.Toolpath.MoveStore import MoveStore
+from pycam.Toolpath.Filters import StepWidth
+
+
+def compare(moves, step_width):
+    step_filter = StepWidth(step_width, step_width, step_width)
+    from_list = list(moves | step_filter)
+    from_store = list(MoveStore(moves) | step_filter)
+    if from_list != from_store:
+        print "Mismatch for step width %s:" % step_width
+        print "  list:  %s" % from_list
+        print "  store: %s" % from_store
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    success = True
+    # halves (positive and negative)
+    halves = [(MOVE_STRAIGHT, (x, 0.0, 0.0))
+            for x in (0.25, 0.5, 2.5, 3.0, -0.25, -0.5, -2.5, -3.0)]
+    success &= compare(halves, 0.5)
+    success &= compare(halves, 1.0)
+    random.seed(0)
+    for step_width in (0.001, 0.1, 0.5):
+        moves = [(MOVE_SAFETY, None)]
+        for index in range(10000):
+            move_type = random.choice((MOVE_STRAIGHT, MOVE_STRAIGHT,
+                    MOVE_STRAIGHT_RAPID))
+            position = tuple([step_width * random.randint(-40, 40) / 4.0
+                    for axis in range(3)])
+            moves.append((move_type, position))
+        success &= compare(moves, step_width)
+    if success:
+        print "OK"
+    else:
+        sys.exit(1)
+
@@ -21,6 +21,8 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import pycam.Exporters.GCode
+import pycam.Toolpath.Filters
+from pycam.Utils.threading import run_in_parallel
 from pycam.Toolpath import CORNER_STYLE_EXACT_PATH, CORNER_STYLE_EXACT_STOP, \
         CORNER_STYLE_OPTIMIZE_SPEED, CORNER_STYLE_OPTIMIZE_TOLERANCE
 
@@ -29,9 +31,53 @@ DEFAULT_HEADER = (("G40", "disable tool radius compensation"),
                 ("G49", "disable tool length compensation"),
                 ("G80", "cancel modal motion"),
                 ("G54", "select coordinate system 1"),
+                ("G17", "select xy plane (for arcs)"),
                 ("G90", "disable incremental moves"))
 
 DEFAULT_DIGITS = 6
+# used for all axes without a configured step width
+DEFAULT_AXIS_FORMATS = ["%%.%df" % DEFAULT_DIGITS] * 9
+
+def _format_straight_moves((formats, last_rapid, position, moves)):
+    """ render a batch of straight moves
+
+    This is a global function - thus it can be used by worker processes.
+    The modal state (motion mode and the rendered coordinates of the previous
+    position) is kept in local variables during the batch.
+    """
+    format_x, format_y, format_z = formats
+    if position is None:
+        last_x = last_y = last_z = None
+    else:
+        last_x = format_x % position[0]
+        last_y = format_y % position[1]
+        last_z = format_z % position[2]
+    lines = []
+    for is_rapid, position in moves:
+        if is_rapid != last_rapid:
+            components = ["G0" if is_rapid else "G1"]
+            last_rapid = is_rapid
+        else:
+            # improve gcode style
+            components = [" "]
+        # skip axes without a visible change (see "step_width")
+        text = format_x % position[0]
+        if text != last_x:
+            components.append("X" + text)
+            last_x = text
+        text = format_y % position[1]
+        if text != last_y:
+            components.append("Y" + text)
+            last_y = text
+        text = format_z % position[2]
+        if text != last_z:
+            components.append("Z" + text)
+            last_z = text
+        if len(components) > 1 or components[0] != " ":
+            lines.append(" ".join(components))
+    if lines:
+        lines.append("")
+    return os.linesep.join(lines)
 
 def _render_number(number):
     if int(number) == number:
@@ -59,32 +105,78 @@ class LinuxCNC(pycam.Exporters.GCode.BaseGenerator):
         self.add_command("; %s" % comment)
 
     def add_command(self, command, comment=None):
-        self.destination.write(command)
         if comment:
-            self.destination.write("\t")
-            self.add_comment(comment)
+            self.write("%s\t; %s%s" % (command, comment, os.linesep))
         else:
-            self.destination.write(os.linesep)
+            self.write(command + os.linesep)
 
     def add_move(self, coordinates, is_rapid=False):
-        components = []
+        self.add_straight_moves(((is_rapid, coordinates), ))
+
+    def add_straight_moves(self, moves):
+        self.add_straight_batches([moves])
+
+    def add_straight_batches(self, batches):
+        formats = tuple(self._get_axis_formats()[:3])
         # the cached value may be:
         #   True: the last move was G0
         #   False: the last move was G1
         #   None: some non-move happened before
-        if self._get_cache("rapid_move", None) != is_rapid:
-            components.append("G0" if is_rapid else "G1")
+        last_rapid = self._get_cache("rapid_move", None)
+        position = self._get_cache("position", None)
+        args = []
+        for moves in batches:
+            if not moves:
+                continue
+            args.append((formats, last_rapid, position, moves))
+            # the modal state at the end of this batch
+            last_rapid, position = moves[-1]
+        if self._parallel and (len(args) > 1):
+            # the order of the results is preserved
+            texts = run_in_parallel(_format_straight_moves, args)
         else:
-            # improve gcode style
-            components.append(" ")
-        axes = [axis for axis in "XYZABCUVW"]
-        previous = self._get_cache("position", [None] * len(coordinates))
-        for (axis, value, last) in zip(axes, coordinates, previous):
-            if (last is None) or (last != value):
-                components.append("%s%.6f" % (axis, value))
-        command = " ".join(components)
-        if command.strip():
-            self.add_command(command)
+            texts = [_format_straight_moves(item) for item in args]
+        for text in texts:
+            if text:
+                self.write(text)
+        self._cache["position"] = position
+        self._cache["rapid_move"] = last_rapid
+
+    def add_arc(self, coordinates, center, clockwise):
+        # the offsets of the center (I/J) are relative to the start position
+        start = self._get_cache("position", None)
+        if start is None:
+            # no known start position -> the arc is undefined
+            self.add_move(coordinates)
+            return
+        components = ["G2" if clockwise else "G3"]
+        formats = self._get_axis_formats()
+        for (axis, value, last, format_string) in zip("XYZ", coordinates,
+                start, formats):
+            text = format_string % value
+            if format_string % last != text:
+                components.append(axis + text)
+        # the controller only knows the rounded start position
+        start_x = float(formats[0] % start[0])
+        start_y = float(formats[1] % start[1])
+        components.append("I" + formats[0] % (center[0] - start_x))
+        components.append("J" + formats[1] % (center[1] - start_y))
+        self.add_command(" ".join(components))
+
+    def _get_axis_formats(self):
+        return self._get_cache("axis_formats", DEFAULT_AXIS_FORMATS)
+
+    def command_step_width(self, step_widths):
+        # render the coordinates with the precision of the machine
+        self._cache["axis_formats"] = [
+                pycam.Toolpath.Filters.get_number_format(step_width)
+                for step_width in step_widths]
+
+    def command_unit(self, unit):
+        if unit == "mm":
+            self.add_command("G21", "metric")
+        else:
+            self.add_command("G20", "imperial")
 
     def command_feedrate(self, feedrate):
         self.add_command("F%s" % _render_number(feedrate), "set feedrate")
@@ -21,22 +21,49 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import decimal
+import gzip
 import os
 
 import pycam.Utils.log
 import pycam.Toolpath.Filters
-from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, \
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_ARC, \
         MACHINE_SETTING, COMMENT
+from pycam.Toolpath.MoveStore import MoveStore
 
 _log = pycam.Utils.log.get_logger()
 
+# the output is collected until it exceeds this number of characters
+WRITE_BUFFER_SIZE = 2 ** 20
+# the maximum number of straight moves passed to "add_straight_moves" at once
+MOVE_BATCH_SIZE = 4096
+# the number of batches of straight moves formatted in parallel
+PARALLEL_BATCHES = 16
+
+
+def open_destination(filename):
+    """ open a file for writing GCode - the output is compressed for
+    filenames ending with ".gz"
+    """
+    if filename.lower().endswith(".gz"):
+        return gzip.open(filename, "wb")
+    else:
+        return open(filename, "w")
+
 
 class BaseGenerator(object):
 
-    def __init__(self, destination):
+    def __init__(self, destination, parallel=False):
+        """ create a GCode generator
+
+        @value destination: a filename or an open stream
+        @type destination: basestring | file
+        @value parallel: format batches of straight moves in parallel (see
+            pycam.Utils.threading)
+        @type parallel: bool
+        """
         if isinstance(destination, basestring):
             # open the file
-            self.destination = file(destination,"w")
+            self.destination = open_destination(destination)
             self._close_stream_on_exit = True
         else:
             # assume that "destination" is something like a StringIO instance
@@ -46,6 +73,10 @@ class BaseGenerator(object):
             self._close_stream_on_exit = False
         self._filters = []
         self._cache = {}
+        self._buffer = []
+        self._buffer_size = 0
+        self._parallel = parallel
+        self._straight_batches = []
         self.add_header()
 
     def _get_cache(self, key, default_value):
@@ -55,6 +86,19 @@ class BaseGenerator(object):
         self._filters.extend(filters)
         self._filters.sort()
 
+    def write(self, text):
+        """ add text to the output buffer (written in large chunks) """
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        if self._buffer_size >= WRITE_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.destination.write("".join(self._buffer))
+            self._buffer = []
+            self._buffer_size = 0
+
     def add_comment(self, comment):
         raise NotImplementedError("someone forgot to implement 'add_comment'")
 
@@ -64,11 +108,40 @@ class BaseGenerator(object):
     def add_move(self, coordinates, is_rapid=False):
         raise NotImplementedError("someone forgot to implement 'add_move'")
 
+    def add_straight_moves(self, moves):
+        """ add a sequence of straight moves
+
+        Generators may override this method for formatting a batch of moves
+        at once.
+        @value moves: (is_rapid, position) tuples
+        @type moves: list
+        """
+        for is_rapid, position in moves:
+            self.add_move(position, is_rapid)
+            self._cache["position"] = position
+            self._cache["rapid_move"] = is_rapid
+
+    def add_straight_batches(self, batches):
+        """ add a sequence of batches of straight moves
+
+        The modal state at the start of each batch is defined by the last move
+        of the previous batch. Thus generators may format the batches
+        independently (e.g. in parallel).
+        @value batches: lists of moves (see "add_straight_moves")
+        @type batches: list
+        """
+        for moves in batches:
+            self.add_straight_moves(moves)
+
+    def add_arc(self, coordinates, center, clockwise):
+        raise NotImplementedError("someone forgot to implement 'add_arc'")
+
     def add_footer(self):
         raise NotImplementedError("someone forgot to implement 'add_footer'")
 
     def finish(self):
         self.add_footer()
+        self.flush()
         if self._close_stream_on_exit:
             self.destination.close()
 
@@ -77,14 +150,61 @@ class BaseGenerator(object):
         all_filters = list(self._filters)
         if filters:
             all_filters.extend(filters)
-        filtered_moves = pycam.Toolpath.Filters.get_filtered_moves(moves,
+        # the moves are filtered while being written (constant memory)
+        filtered_moves = pycam.Toolpath.Filters.iter_filtered_moves(moves,
                 all_filters)
-        for move_type, args in filtered_moves:
+        if isinstance(filtered_moves, MoveStore):
+            self._add_move_store(filtered_moves)
+        else:
+            self._add_move_items(filtered_moves)
+
+    def _add_move_store(self, store):
+        # pass the columns of straight moves without creating move tuples
+        position_mask = store.get_position_mask()
+        for start in xrange(0, len(store), MOVE_BATCH_SIZE):
+            end = start + MOVE_BATCH_SIZE
+            chunk = store[start:end]
+            if position_mask[start:end].all():
+                rapid = (chunk.get_move_types() == MOVE_STRAIGHT_RAPID).tolist()
+                positions = [tuple(position)
+                        for position in chunk.get_positions().tolist()]
+                self._queue_straight_batch(zip(rapid, positions))
+            else:
+                self._flush_straight_batches()
+                self._add_move_items(chunk)
+        self._flush_straight_batches()
+
+    def _queue_straight_batch(self, batch):
+        self._straight_batches.append(batch)
+        if not self._parallel or \
+                (len(self._straight_batches) >= PARALLEL_BATCHES):
+            self._flush_straight_batches()
+
+    def _flush_straight_batches(self):
+        if self._straight_batches:
+            self.add_straight_batches(self._straight_batches)
+            self._straight_batches = []
+
+    def _add_move_items(self, moves):
+        # collect consecutive straight moves in batches
+        batch = []
+        for move_type, args in moves:
             if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
-                is_rapid = move_type == MOVE_STRAIGHT_RAPID
-                self.add_move(args, is_rapid)
-                self._cache["position"] = args
-                self._cache["rapid_move"] = is_rapid
+                batch.append((move_type == MOVE_STRAIGHT_RAPID, args))
+                if len(batch) >= MOVE_BATCH_SIZE:
+                    self._queue_straight_batch(batch)
+                    batch = []
+                continue
+            if batch:
+                self._queue_straight_batch(batch)
+                batch = []
+            self._flush_straight_batches()
+            if move_type == MOVE_ARC:
+                destination, center, clockwise = args
+                self.add_arc(destination, center, clockwise)
+                self._cache["position"] = destination
+                # the next straight move needs to switch the motion mode
+                self._cache["rapid_move"] = None
             elif move_type == COMMENT:
                 self.add_comment(args)
             elif move_type == MACHINE_SETTING:
@@ -101,4 +221,7 @@ class BaseGenerator(object):
             else:
                 _log.warn(("A non-basic toolpath item (%d -> %s) remained in the " + \
                         "queue -> ignore") % (move_type, args))
+        if batch:
+            self._queue_straight_batch(batch)
+        self._flush_straight_batches()
 
@@ -332,6 +332,7 @@ class GCodeGenerator(object):
                     + "finished GCodeGenerator instance: %s" % str(command))
         if isinstance(command, basestring):
             command = [command]
-        for line in command:
-            self.destination.write(line + os.linesep)
+        # a single write call for all lines
+        self.destination.write("".join([line + os.linesep
+                for line in command]))
 
@@ -22,43 +22,99 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from pycam import VERSION
-from pycam.Geometry.PointUtils import pnormalized
 import datetime
+import struct
 import os
 
+import numpy
+
+
+# the number of triangles converted at once
+CHUNK_SIZE = 10000
+# the length of the header of binary STL files
+BINARY_HEADER_SIZE = 80
+# 50 bytes per facet: normal, three vertices and the "attribute byte count"
+BINARY_FACET_DTYPE = numpy.dtype([("normal", "<f4", (3, )),
+        ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+ASCII_FACET_LINES = ("facet normal %f %f %f", "  outer loop",
+        "    vertex %f %f %f", "    vertex %f %f %f", "    vertex %f %f %f",
+        "  endloop", "endfacet")
+
+
 class STLExporter(object):
 
     def __init__(self, model, name="model", created_by="pycam", linesep=None,
-            **kwargs):
+            binary=False, **kwargs):
         self.model = model
         self.name = name
         self.created_by = created_by
+        self.binary = binary
         if linesep is None:
             self.linesep = os.linesep
         else:
             self.linesep = linesep
 
     def __str__(self):
-        return self.linesep.join(self.get_output_lines)
+        if self.binary:
+            chunks = self._get_binary_chunks()
+        else:
+            chunks = self._get_ascii_chunks()
+        return "".join(chunks)
 
     def write(self, stream):
-        for line in self.get_output_lines():
-            stream.write(line)
-            stream.write(self.linesep)
+        """ write the model to the stream
 
-    def get_output_lines(self):
+        The stream needs to be opened in binary mode for binary STL output.
+        """
+        if self.binary:
+            chunks = self._get_binary_chunks()
+        else:
+            chunks = self._get_ascii_chunks()
+        for chunk in chunks:
+            stream.write(chunk)
+
+    def _get_description(self):
         date = datetime.date.today().isoformat()
-        yield """solid "%s"; Produced by %s (v%s), %s""" \
+        return """"%s"; Produced by %s (v%s), %s""" \
                 % (self.name, self.created_by, VERSION, date)
-        for triangle in self.model.triangles():
-            norm = pnormalized(triangle.normal)
-            yield "facet normal %f %f %f" % (norm[0], norm[1], norm[2])
-            yield "  outer loop"
+
+    def _get_facet_arrays(self):
+        """ return the normals and vertices of all triangles as arrays
+
+        Every item is an array of shape (N, 4, 3): the normalized normal
+        followed by the three vertices of each triangle.
+        """
+        triangles = self.model.triangles()
+        for start in xrange(0, len(triangles), CHUNK_SIZE):
             # Triangle vertices are stored in clockwise order - thus we need
             # to reverse the order (STL expects counter-clockwise orientation).
-            for point in (triangle.p1, triangle.p3, triangle.p2):
-                yield "    vertex %f %f %f" % (point[0], point[1], point[2])
-            yield "  endloop"
-            yield "endfacet"
-        yield "endsolid"
+            facets = numpy.array([(t.normal[:3], t.p1[:3], t.p3[:3],
+                        t.p2[:3])
+                    for t in triangles[start:start + CHUNK_SIZE]],
+                    dtype=numpy.float64).reshape(-1, 4, 3)
+            normals = facets[:, 0]
+            lengths = numpy.sqrt((normals * normals).sum(axis=1))
+            # keep degenerated normals (length zero) unchanged
+            lengths[lengths == 0] = 1.0
+            normals /= lengths[:, numpy.newaxis]
+            yield facets
+
+    def _get_ascii_chunks(self):
+        yield "solid %s%s" % (self._get_description(), self.linesep)
+        facet_template = self.linesep.join(ASCII_FACET_LINES) + self.linesep
+        for facets in self._get_facet_arrays():
+            # a single formatting operation for the complete chunk
+            values = tuple(facets.ravel().tolist())
+            yield (facet_template * len(facets)) % values
+        yield "endsolid%s" % self.linesep
+
+    def _get_binary_chunks(self):
+        header = self._get_description()[:BINARY_HEADER_SIZE]
+        yield header.ljust(BINARY_HEADER_SIZE)
+        yield struct.pack("<I", len(self.model.triangles()))
+        for facets in self._get_facet_arrays():
+            records = numpy.zeros(len(facets), dtype=BINARY_FACET_DTYPE)
+            records["normal"] = facets[:, 0]
+            records["vertices"] = facets[:, 1:]
+            yield records.tostring()
 
@@ -28,6 +28,7 @@ import pycam.Geometry.Matrix
 import pycam.Geometry
 import pycam.Utils.log
 import pycam.Utils
+import collections
 import math
 import re
 import os
@@ -47,6 +48,91 @@ def _unescape_control_characters(text):
             lambda hex_in: unichr(int(hex_in.groups()[0], 16)), text)
 
 
+class _PointTree(object):
+    """ kd-tree of indexed points supporting the removal of points
+
+    Used for walking through a set of points (nearest remaining neighbour).
+    """
+
+    __slots__ = ["_root", "_leaves", "_removed"]
+
+    BUCKET_SIZE = 8
+
+    def __init__(self, points):
+        self._removed = [False] * len(points)
+        self._leaves = [None] * len(points)
+        self._root = self._build(list(enumerate(points)), None)
+
+    def _build(self, items, parent):
+        node = _PointTreeNode(parent, len(items))
+        if len(items) > self.BUCKET_SIZE:
+            spreads = [max([point[axis] for index, point in items])
+                    - min([point[axis] for index, point in items])
+                    for axis in range(3)]
+            cutdim = spreads.index(max(spreads))
+            if spreads[cutdim] > 0:
+                items.sort(key=lambda item: item[1][cutdim])
+                median = len(items) / 2
+                node.cutdim = cutdim
+                node.cutval = items[median][1][cutdim]
+                node.lo = self._build(items[:median], node)
+                node.hi = self._build(items[median:], node)
+                return node
+        # all points are equal or the number of points is small
+        node.items = items
+        for index, point in items:
+            self._leaves[index] = node
+        return node
+
+    def remove(self, index):
+        if not self._removed[index]:
+            self._removed[index] = True
+            node = self._leaves[index]
+            while node:
+                node.count -= 1
+                node = node.parent
+
+    def nearest(self, point):
+        """ return the distance and the index of the closest remaining point
+
+        The lowest index wins in case of equal distances.
+        @returns: (distance, index) or (None, None) if no point is left
+        """
+        best = [(None, None)]
+        self._nearest(self._root, point, best)
+        return best[0]
+
+    def _nearest(self, node, point, best):
+        if node.count == 0:
+            return
+        if node.items is None:
+            diff = point[node.cutdim] - node.cutval
+            if diff <= 0:
+                near, far = node.lo, node.hi
+            else:
+                near, far = node.hi, node.lo
+            self._nearest(near, point, best)
+            # the points of the other half are at least "diff" away
+            if (best[0][0] is None) or (abs(diff) <= best[0][0]):
+                self._nearest(far, point, best)
+        else:
+            for index, other in node.items:
+                if not self._removed[index]:
+                    candidate = (pdist(point, other), index)
+                    if (best[0][0] is None) or (candidate < best[0]):
+                        best[0] = candidate
+
+
+class _PointTreeNode(object):
+
+    __slots__ = ["parent", "count", "items", "cutdim", "cutval", "lo", "hi"]
+
+    def __init__(self, parent, count):
+        self.parent = parent
+        self.count = count
+        self.items = None
+
+
 class DXFParser(object):
 
     # see http://www.autodesk.com/techpubs/autocad/acad2000/dxf/group_code_value_types_dxf_01.htm
@@ -86,6 +172,19 @@ class DXFParser(object):
         "CURVE_TYPE": 75,
     }
 
+    # the type of the value belonging to a key
+    FLOAT_KEYS = frozenset([KEYS[key] for key in ("P1_X", "P1_Y", "P1_Z",
+            "P2_X", "P2_Y", "P2_Z", "RADIUS", "ANGLE_START", "ANGLE_END",
+            "TEXT_HEIGHT", "TEXT_WIDTH_FINAL", "TEXT_ROTATION",
+            "TEXT_SKEW_ANGLE", "VERTEX_BULGE")])
+    INT_KEYS = frozenset([KEYS[key] for key in ("COLOR", "TEXT_MIRROR_FLAGS",
+            "TEXT_ALIGN_HORIZONTAL", "TEXT_ALIGN_VERTICAL", "MTEXT_ALIGNMENT",
+            "CURVE_TYPE", "VERTEX_FLAGS")])
+    TEXT_KEYS = frozenset([KEYS[key] for key in ("DEFAULT", "TEXT_MORE")])
+
+    # the input is read in blocks of this size
+    BLOCK_SIZE = 2 ** 20
+
     IGNORE_KEYS = ("DICTIONARY", "VPORT", "LTYPE", "STYLE", "APPID", "DIMSTYLE",
             "BLOCK_RECORD", "BLOCK", "ENDBLK", "ACDBDICTIONARYWDFLT", "POINT",
             "ACDBPLACEHOLDER", "LAYOUT", "MLINESTYLE", "DICTIONARYVAR", "CLASS",
@@ -94,6 +193,7 @@ class DXFParser(object):
     def __init__(self, inputstream, color_as_height=False, fonts_cache=None,
             callback=None):
         self.inputstream = inputstream
+        self._input_lines = self._iter_input_lines()
         self.line_number = 0
         self.lines = []
         self.triangles = []
@@ -117,51 +217,75 @@ class DXFParser(object):
         return {"lines": self.lines, "triangles": self.triangles}
 
     def optimize_line_order(self):
+        """ connect adjacent lines to groups and order these groups
+
+        Lines are chained via hash maps of their start and end points. The
+        groups are ordered by walking from each group to the closest of the
+        remaining ones (based on a kd-tree of their start and end points).
+        """
+        # The chaining follows the order of the lines: the first remaining
+        # line that continues (or precedes) the current group is attached.
+        # Thus we keep the indices of lines starting or ending at each point
+        # in ascending order. Used lines are skipped lazily.
+        starts = {}
+        ends = {}
+        for index, line in enumerate(self.lines):
+            starts.setdefault(line.p1, collections.deque()).append(index)
+            ends.setdefault(line.p2, collections.deque()).append(index)
+        used = [False] * len(self.lines)
+        def get_first_unused(indices):
+            while indices and used[indices[0]]:
+                indices.popleft()
+            if indices:
+                return indices[0]
+            else:
+                return None
         groups = []
-        current_group = []
-        groups.append(current_group)
-        remaining_lines = self.lines[:]
-        while remaining_lines:
+        next_index = 0
+        while next_index < len(self.lines):
             if self.callback and self.callback():
                 return
-            if not current_group:
-                current_group.append(remaining_lines.pop(0))
-            else:
-                first_line = current_group[0]
-                last_line = current_group[-1]
-                for line in remaining_lines:
-                    if last_line.p2 == line.p1:
-                        current_group.append(line)
-                        remaining_lines.remove(line)
-                        break
-                    if first_line.p1 == line.p2:
-                        current_group.insert(0, line)
-                        remaining_lines.remove(line)
-                        break
+            current_group = collections.deque([next_index])
+            used[next_index] = True
+            while True:
+                following = get_first_unused(
+                        starts.get(self.lines[current_group[-1]].p2, ()))
+                preceding = get_first_unused(
+                        ends.get(self.lines[current_group[0]].p1, ()))
+                if (following is None) and (preceding is None):
+                    break
+                elif (preceding is None) or \
+                        ((not following is None) and (following <= preceding)):
+                    current_group.append(following)
+                    used[following] = True
                 else:
-                    current_group = []
-                    groups.append(current_group)
-        def get_distance_between_groups(group1, group2):
-            forward = pdist(group1[-1].p2, group2[0].p1)
-            backward = pdist(group2[-1].p2, group1[0].p1)
-            return min(forward, backward)
-        remaining_groups = groups[:]
+                    current_group.appendleft(preceding)
+                    used[preceding] = True
+            groups.append([self.lines[index] for index in current_group])
+            while (next_index < len(self.lines)) and used[next_index]:
+                next_index += 1
+        if not groups:
+            return
+        # Walk from each group to the closest remaining group. A group is
+        # close if its start is close to the end of the current group or if
+        # its end is close to the start of the current group.
+        start_tree = _PointTree([group[0].p1 for group in groups])
+        end_tree = _PointTree([group[-1].p2 for group in groups])
+        current_index = 0
         ordered_groups = []
-        while remaining_groups:
-            if not ordered_groups:
-                ordered_groups.append(remaining_groups.pop(0))
-            else:
-                current_group = ordered_groups[-1]
-                closest_distance = None
-                for cmp_group in remaining_groups:
-                    cmp_distance = get_distance_between_groups(current_group,
-                            cmp_group)
-                    if (closest_distance is None) \
-                            or (cmp_distance < closest_distance):
-                        closest_distance = cmp_distance
-                        closest_group = cmp_group
-                ordered_groups.append(closest_group)
-                remaining_groups.remove(closest_group)
+        while True:
+            if self.callback and self.callback():
+                return
+            current_group = groups[current_index]
+            ordered_groups.append(current_group)
+            start_tree.remove(current_index)
+            end_tree.remove(current_index)
+            if len(ordered_groups) == len(groups):
+                break
+            # the first group (in the original order) wins in case of equal
+            # distances
+            current_index = min(start_tree.nearest(current_group[-1].p2),
+                    end_tree.nearest(current_group[0].p1))[1]
         result = []
         for group in ordered_groups:
             result.extend(group)
@@ -170,14 +294,36 @@ class DXFParser(object):
     def _push_on_stack(self, key, value):
         self._input_stack.append((key, value))
 
+    def _iter_input_lines(self):
+        """ read the input in large blocks and split these into lines
+
+        An empty string is returned forever after the end of the input.
+        """
+        rest = ""
+        while True:
+            try:
+                block = self.inputstream.read(self.BLOCK_SIZE)
+            except IOError, err_msg:
+                log.warn("DXFImporter: Failed to read input after line " \
+                        + "%d: %s" % (self.line_number, err_msg))
+                block = ""
+            if not block:
+                break
+            lines = (rest + block).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                # overlong lines are invalid - see MAX_CHARS_PER_LINE
+                yield line[:self.MAX_CHARS_PER_LINE].strip()
+        if rest:
+            yield rest[:self.MAX_CHARS_PER_LINE].strip()
+        while True:
+            yield ""
+
     def _read_key_value(self):
         if self._input_stack:
             return self._input_stack.pop()
-        try:
-            line1 = self.inputstream.readline(self.MAX_CHARS_PER_LINE).strip()
-            line2 = self.inputstream.readline(self.MAX_CHARS_PER_LINE).strip()
-        except IOError:
-            return None, None
+        line1 = self._input_lines.next()
+        line2 = self._input_lines.next()
         if not line1 and not line2:
             return None, None
         try:
@@ -186,10 +332,7 @@ class DXFParser(object):
             log.warn("DXFImporter: Invalid key in line " \
                     + "%d (int expected): %s" % (self.line_number, line1))
             return None, None
-        if line1 in [self.KEYS[key] for key in ("P1_X", "P1_Y", "P1_Z",
-                "P2_X", "P2_Y", "P2_Z", "RADIUS", "ANGLE_START", "ANGLE_END",
-                "TEXT_HEIGHT", "TEXT_WIDTH_FINAL", "TEXT_ROTATION",
-                "TEXT_SKEW_ANGLE", "VERTEX_BULGE")]:
+        if line1 in self.FLOAT_KEYS:
             try:
                 line2 = float(line2)
             except ValueError:
@@ -197,9 +340,7 @@ class DXFParser(object):
                         + "%d (float expected): %s" % (self.line_number, line2))
                 line1 = None
                 line2 = None
-        elif line1 in [self.KEYS[key] for key in ("COLOR", "TEXT_MIRROR_FLAGS",
-                "TEXT_ALIGN_HORIZONTAL", "TEXT_ALIGN_VERTICAL",
-                "MTEXT_ALIGNMENT", "CURVE_TYPE", "VERTEX_FLAGS")]:
+        elif line1 in self.INT_KEYS:
             try:
                 line2 = int(line2)
             except ValueError:
@@ -207,7 +348,7 @@ class DXFParser(object):
                         + "%d (int expected): %s" % (self.line_number, line2))
                 line1 = None
                 line2 = None
-        elif line1 in [self.KEYS[key] for key in ("DEFAULT", "TEXT_MORE")]:
+        elif line1 in self.TEXT_KEYS:
             # check the string for invalid characters
             try:
                 text = unicode(line2)
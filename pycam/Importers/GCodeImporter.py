@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+""" Streaming import of GCode files (e.g. for simulating existing toolpaths)
+
+The file is read in blocks. Every line is turned into basic toolpath moves
+(see pycam.Toolpath) right away. The moves are packed into a MoveStore - thus
+even huge files do not require a python object for every single move.
+
+Supported commands:
+  motion: G0, G1, G2, G3 (with I/J or R), G80
+  modal state: G20/G21 (unit), G90/G91 (absolute/relative positions)
+  machine settings: F (feedrate), S (spindle speed), T (tool), M3/M4/M5
+      (spindle), G4 (delay)
+All other commands are ignored. Moves are skipped until the position of all
+three axes is known (e.g. the first rapid move to the safety height).
+"""
+
+import gzip
+import math
+import re
+import StringIO
+import sys
+
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_ARC, \
+        MACHINE_SETTING
+import pycam.Utils.log
+import pycam.Utils
+
+log = pycam.Utils.log.get_logger()
+
+
+BLOCK_SIZE = 2 ** 20
+# used only for lines that can't be split into words by whitespace
+WORD_REGEX = re.compile(r"([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))")
+COMMENT_REGEX = re.compile(r"\([^)]*\)")
+MOTION_TYPES = {0: MOVE_STRAIGHT_RAPID, 1: MOVE_STRAIGHT, 2: MOVE_ARC,
+        3: MOVE_ARC}
+
+
+def _iter_lines(infile, callback=None):
+    """ read a file in blocks and split it into lines
+
+    The callback is called after every block. The iteration stops if it
+    returns True (e.g. "cancel" was requested).
+    """
+    rest = ""
+    while True:
+        block = infile.read(BLOCK_SIZE)
+        if not block:
+            break
+        lines = (rest + block).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line
+        if callback and callback():
+            log.warn("GCodeImporter: parsing cancelled")
+            return
+    if rest:
+        yield rest
+
+def _get_arc_center(start, end, clockwise, offset_i, offset_j, radius):
+    """ return the x/y center of an arc (based on I/J or R) """
+    if radius is None:
+        return (start[0] + (offset_i or 0.0), start[1] + (offset_j or 0.0))
+    # see "radius format arc" in the LinuxCNC documentation
+    delta_x = end[0] - start[0]
+    delta_y = end[1] - start[1]
+    chord = math.hypot(delta_x, delta_y)
+    if chord == 0:
+        return None
+    height = math.sqrt(max(0.0, radius ** 2 - (chord / 2.0) ** 2)) / chord
+    # a negative radius describes the arc spanning more than 180 degrees
+    if clockwise == (radius > 0):
+        height = -height
+    return (start[0] + delta_x / 2.0 - delta_y * height,
+            start[1] + delta_y / 2.0 + delta_x * height)
+
+def iter_gcode_moves(infile, callback=None):
+    """ parse GCode and return the basic moves (see pycam.Toolpath)
+
+    @value infile: the GCode input
+    @type infile: file-like object
+    @value callback: is called regularly during parsing - a return value of
+        True stops the parser
+    @type callback: function
+    @returns: the moves as (move_type, args) tuples
+    @rtype: iterator
+    """
+    # the current position (None: unknown)
+    pos_x = pos_y = pos_z = None
+    motion = None
+    absolute = True
+    for line in _iter_lines(infile, callback=callback):
+        if ";" in line:
+            line = line[:line.index(";")]
+        if "(" in line:
+            line = COMMENT_REGEX.sub(" ", line)
+        words = line.upper().split()
+        if not words:
+            continue
+        try:
+            # most lines consist of words separated by whitespace
+            values = map(float, [word[1:] for word in words])
+        except ValueError:
+            # e.g. "G1X2.0Y3.0" or "X 2.0"
+            words = []
+            values = []
+            for letter, number in WORD_REGEX.findall(line.upper()):
+                words.append(letter)
+                values.append(float(number))
+        new_x = new_y = new_z = None
+        offset_i = offset_j = radius = parameter = None
+        dwell = False
+        for word, value in zip(words, values):
+            letter = word[0]
+            if letter == "X":
+                new_x = value
+            elif letter == "Y":
+                new_y = value
+            elif letter == "Z":
+                new_z = value
+            elif letter == "G":
+                if value in MOTION_TYPES:
+                    motion = int(value)
+                elif value == 4:
+                    dwell = True
+                elif value == 80:
+                    motion = None
+                elif value in (90, 91):
+                    absolute = (value == 90)
+                elif value in (20, 21):
+                    yield (MACHINE_SETTING,
+                            ("unit", "mm" if value == 21 else "inch"))
+            elif letter == "I":
+                offset_i = value
+            elif letter == "J":
+                offset_j = value
+            elif letter == "R":
+                radius = value
+            elif letter == "P":
+                # only used for G4 - e.g. "G64 P0.05" is not a delay
+                parameter = value
+            elif letter == "F":
+                yield (MACHINE_SETTING, ("feedrate", value))
+            elif letter == "S":
+                yield (MACHINE_SETTING, ("spindle_speed", value))
+            elif letter == "T":
+                yield (MACHINE_SETTING, ("select_tool", int(value)))
+            elif letter == "M":
+                if value in (3, 4):
+                    yield (MACHINE_SETTING, ("spindle_enabled", True))
+                elif value == 5:
+                    yield (MACHINE_SETTING, ("spindle_enabled", False))
+        if dwell:
+            yield (MACHINE_SETTING, ("delay", parameter or 0))
+        if (motion is None) or \
+                ((new_x is None) and (new_y is None) and (new_z is None)):
+            continue
+        start = (pos_x, pos_y, pos_z)
+        if absolute:
+            if not new_x is None:
+                pos_x = new_x
+            if not new_y is None:
+                pos_y = new_y
+            if not new_z is None:
+                pos_z = new_z
+        else:
+            # unknown axes remain unknown
+            if not (new_x is None or pos_x is None):
+                pos_x += new_x
+            if not (new_y is None or pos_y is None):
+                pos_y += new_y
+            if not (new_z is None or pos_z is None):
+                pos_z += new_z
+        if (pos_x is None) or (pos_y is None) or (pos_z is None):
+            continue
+        position = (pos_x, pos_y, pos_z)
+        move_type = MOTION_TYPES[motion]
+        if move_type != MOVE_ARC:
+            yield (move_type, position)
+            continue
+        clockwise = (motion == 2)
+        if None in start:
+            center = None
+        else:
+            center = _get_arc_center(start, position, clockwise, offset_i,
+                    offset_j, radius)
+        if center is None:
+            # the arc is undefined -> move straight to the destination
+            yield (MOVE_STRAIGHT, position)
+        else:
+            yield (MOVE_ARC, (position, center, clockwise))
+
+def import_toolpath(filename, callback=None):
+    """ read a GCode file (optionally compressed via gzip) into a toolpath
+
+    @value filename: the name or URI of the GCode file
+    @type filename: str
+    @value callback: see "iter_gcode_moves"
+    @type callback: function
+    @returns: the compact toolpath (see pycam.Toolpath.MoveStore) or None
+    @rtype: pycam.Toolpath.Toolpath
+    """
+    # late import due to dependency cycle
+    from pycam.Toolpath import Toolpath
+    from pycam.Toolpath.MoveStore import MoveStore
+    uri = pycam.Utils.URIHandler(filename)
+    try:
+        if uri.is_local():
+            if uri.get_local_path().lower().endswith(".gz"):
+                infile = gzip.open(uri.get_local_path(), "rb")
+            else:
+                infile = open(uri.get_local_path(), "r")
+        elif uri.get_path().lower().endswith(".gz"):
+            # gzip needs a seekable input
+            remote = uri.open()
+            infile = gzip.GzipFile(fileobj=StringIO.StringIO(remote.read()))
+            remote.close()
+        else:
+            infile = uri.open()
+    except IOError, err_msg:
+        log.error("GCodeImporter: Failed to read file (%s): %s" % \
+                (filename, err_msg))
+        return None
+    try:
+        moves = MoveStore(iter_gcode_moves(infile, callback=callback))
+    except IOError, err_msg:
+        log.error("GCodeImporter: Failed to read file (%s): %s" % \
+                (filename, err_msg))
+        return None
+    finally:
+        infile.close()
+    log.info("Imported GCode toolpath: %d moves" % len(moves))
+    return Toolpath(toolpath_path=moves)
+
+
+if __name__ == "__main__":
+    # for testing: output the statistics of the given file (first argument)
+    toolpath = import_toolpath(sys.argv[1])
+    distance, duration = toolpath.get_machine_move_distance_and_time()
+    print "Moves: %d" % len(toolpath.path)
+    print "Distance: %f" % distance
+    print "Machine time: %f minutes" % duration
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+""" On-disk cache of preprocessed models
+
+Importing a large model (parsing, merging vertices, validating normals) takes
+much longer than loading the resulting arrays. The arrays are stored in the
+configuration directory - keyed by a hash of the content of the imported file
+and the import parameters.
+
+Every cache file consists of a header, the name of the model and the arrays
+(each of them aligned to the size of its items). The arrays are mapped into
+memory when loading the file.
+The oldest files (by their last usage) are removed as soon as the size of the
+cache exceeds MAX_CACHE_SIZE.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy
+
+import pycam.Gui.Settings
+import pycam.Utils.log
+
+log = pycam.Utils.log.get_logger()
+
+
+CACHE_DIRNAME = "model_cache"
+CACHE_FILE_EXTENSION = ".cache"
+MAX_CACHE_SIZE = 512 * 2 ** 20
+# change the version whenever the format or the preprocessing changes
+FILE_MAGIC = "PYCAMMC1"
+# magic, number of arrays, length of the name
+HEADER_FORMAT = "<8sII"
+# dtype and shape of each array
+ARRAY_HEADER_FORMAT = "<2sII"
+ARRAY_DTYPES = {"f8": numpy.float64, "i4": numpy.int32, "i1": numpy.int8}
+HASH_BLOCK_SIZE = 2 ** 24
+
+
+def get_cache_dirname():
+    """ return the directory of the cache (or None if it is not available) """
+    config_dir = pycam.Gui.Settings.get_config_dirname()
+    if config_dir is None:
+        return None
+    cache_dir = os.path.join(config_dir, CACHE_DIRNAME)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            return None
+    return cache_dir
+
+def get_cache_key(data, *parameters):
+    """ calculate the key of a cache entry
+
+    @value data: the content of the imported file
+    @type data: str or mmap
+    @value parameters: all parameters affecting the result of the import
+    @returns: the hex digest of the content and the parameters
+    @rtype: str
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((FILE_MAGIC, ) + parameters))
+    for start in xrange(0, len(data), HASH_BLOCK_SIZE):
+        digest.update(data[start:start + HASH_BLOCK_SIZE])
+    return digest.hexdigest()
+
+def _get_cache_filename(key):
+    cache_dir = get_cache_dirname()
+    if cache_dir is None:
+        return None
+    return os.path.join(cache_dir, key + CACHE_FILE_EXTENSION)
+
+def load(key):
+    """ retrieve the name and the arrays of a cached model
+
+    The arrays are read-only (memory-mapped).
+    @value key: see "get_cache_key"
+    @type key: str
+    @returns: the name and the list of arrays - or None for a cache miss
+    @rtype: tuple(str, list)
+    """
+    filename = _get_cache_filename(key)
+    if (filename is None) or not os.path.isfile(filename):
+        return None
+    try:
+        cache_file = open(filename, "rb")
+        try:
+            data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            cache_file.close()
+        # the arrays keep a reference to the memory map
+        result = _unpack(data)
+        # the modification time is used for evicting the oldest entries
+        os.utime(filename, None)
+    except (IOError, OSError, mmap.error, struct.error, ValueError,
+            KeyError), err_msg:
+        log.info("ModelCache: removing invalid cache file '%s': %s" % \
+                (filename, err_msg))
+        _remove(filename)
+        return None
+    log.debug("ModelCache: loaded cached model from '%s'" % filename)
+    return result
+
+def _unpack(data):
+    magic, num_of_arrays, name_length = struct.unpack_from(HEADER_FORMAT,
+            data)
+    if magic != FILE_MAGIC:
+        raise ValueError("unknown file format")
+    offset = struct.calcsize(HEADER_FORMAT)
+    name = data[offset:offset + name_length]
+    offset += name_length
+    shapes = []
+    for index in range(num_of_arrays):
+        dtype_name, rows, columns = struct.unpack_from(ARRAY_HEADER_FORMAT,
+                data, offset)
+        shapes.append((ARRAY_DTYPES[dtype_name], rows, columns))
+        offset += struct.calcsize(ARRAY_HEADER_FORMAT)
+    arrays = []
+    for dtype, rows, columns in shapes:
+        offset = _get_aligned(offset, numpy.dtype(dtype).itemsize)
+        # columns = 0: one-dimensional array
+        array = numpy.frombuffer(data, dtype=dtype,
+                count=rows * max(1, columns), offset=offset)
+        if columns > 0:
+            array = array.reshape(rows, columns)
+        arrays.append(array)
+        offset += array.nbytes
+    return name, arrays
+
+def _get_aligned(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+def store(key, name, arrays):
+    """ add a model to the cache
+
+    @value key: see "get_cache_key"
+    @type key: str
+    @value name: the name of the model
+    @type name: str
+    @value arrays: all arrays describing the model (one- or two-dimensional)
+    @type arrays: list of numpy arrays
+    """
+    filename = _get_cache_filename(key)
+    if filename is None:
+        return
+    name = name or ""
+    chunks = [struct.pack(HEADER_FORMAT, FILE_MAGIC, len(arrays), len(name)),
+            name]
+    for array in arrays:
+        dtype_name = array.dtype.str[1:]
+        if array.ndim == 1:
+            rows, columns = len(array), 0
+        else:
+            rows, columns = array.shape
+        chunks.append(struct.pack(ARRAY_HEADER_FORMAT, dtype_name, rows,
+                columns))
+    offset = sum([len(chunk) for chunk in chunks])
+    for array in arrays:
+        padding = _get_aligned(offset, array.dtype.itemsize) - offset
+        chunks.append("\0" * padding)
+        chunks.append(numpy.ascontiguousarray(array).tostring())
+        offset += padding + array.nbytes
+    # write to a temporary file first - concurrent readers never see an
+    # incomplete cache file
+    try:
+        handle, temp_filename = tempfile.mkstemp(
+                dir=os.path.dirname(filename), suffix=".tmp")
+        temp_file = os.fdopen(handle, "wb")
+        try:
+            for chunk in chunks:
+                temp_file.write(chunk)
+        finally:
+            temp_file.close()
+        if os.path.exists(filename):
+            # another process stored the same model in the meantime
+            _remove(temp_filename)
+        else:
+            os.rename(temp_filename, filename)
+    except (IOError, OSError), err_msg:
+        log.info("ModelCache: failed to store the model: %s" % err_msg)
+        return
+    log.debug("ModelCache: stored model in '%s' (%d bytes)" % \
+            (filename, offset))
+    evict(MAX_CACHE_SIZE)
+
+def evict(max_size):
+    """ remove the least recently used cache files until the size of the
+    cache is below the given limit
+    """
+    cache_dir = get_cache_dirname()
+    if cache_dir is None:
+        return
+    entries = []
+    total_size = 0
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith(CACHE_FILE_EXTENSION):
+            continue
+        filename = os.path.join(cache_dir, filename)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, filename))
+        total_size += stat.st_size
+    entries.sort()
+    while entries and (total_size > max_size):
+        mtime, size, filename = entries.pop(0)
+        log.debug("ModelCache: removing old cache file '%s'" % filename)
+        _remove(filename)
+        total_size -= size
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
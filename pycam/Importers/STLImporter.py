@@ -23,269 +23,463 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 from pycam.Geometry.PointUtils import *
 from pycam.Geometry.Triangle import Triangle
-from pycam.Geometry.PointKdtree import PointKdtree
 from pycam.Geometry.utils import epsilon
 from pycam.Geometry.Model import Model
+from pycam.Exporters.STLExporter import BINARY_HEADER_SIZE, \
+        BINARY_FACET_DTYPE
+import pycam.Importers.ModelCache
 import pycam.Utils.log
 import pycam.Utils
 
 from struct import unpack 
-import StringIO
+import mmap
+import math
 import re
 
+import numpy
+
 log = pycam.Utils.log.get_logger()
 
+# the handling of the normal of each facet: calculated by the triangle, given
+# to the constructor of the triangle or set afterwards (without affecting the
+# plane of the triangle)
+NORMAL_CALCULATED, NORMAL_ARGUMENT, NORMAL_ATTRIBUTE = range(3)
+# the number of triangles created between two calls of the callback
+CALLBACK_INTERVAL = 1000
+# Vertices within the same cell of this grid are merged (this resembles the
+# tolerance of the PointKdtree).
+VERTEX_GRID_SIZE = math.sqrt(epsilon)
+# ascii files are split into lines in chunks of this size
+ASCII_CHUNK_SIZE = 2 ** 22
+# smaller files are not stored in the model cache
+CACHE_MIN_FILE_SIZE = 2 ** 20
+SOLID_REGEX = re.compile(r"\s*solid\s+(\w+)(\s|$)")
+
 
 vertices = 0
 edges = 0
-kdtree = None
-
-lastUniqueVertex = (None,None,None)
-def UniqueVertex(x, y, z):
-    global vertices,lastUniqueVertex
-    if kdtree:
-        p = kdtree.Point(x, y, z)
-        if p == lastUniqueVertex:
-            vertices += 1
-        return p
+
+
+def _get_unique_vertices(coords, merge_close_vertices=True):
+    """ find the distinct vertices of a model
+
+    @value coords: the x/y/z coordinates of all vertices
+    @type coords: numpy array of shape (N, 3)
+    @value merge_close_vertices: merge vertices within the same cell of a grid
+        (see VERTEX_GRID_SIZE) - otherwise only equal vertices are merged
+    @type merge_close_vertices: bool
+    @returns: the coordinates of the distinct vertices and the index of each
+        vertex within these
+    @rtype: tuple of two numpy arrays
+    """
+    if merge_close_vertices:
+        keys = numpy.rint(coords / VERTEX_GRID_SIZE).astype(numpy.int64)
     else:
-        vertices += 1
-        return (x, y, z)
+        keys = coords
+    keys = numpy.ascontiguousarray(keys)
+    # compare complete rows (x/y/z) as single opaque items
+    rows = keys.view(numpy.dtype((numpy.void,
+            keys.dtype.itemsize * keys.shape[1]))).ravel()
+    unused, first_indices, inverse = numpy.unique(rows, return_index=True,
+            return_inverse=True)
+    return coords[first_indices], inverse
+
+def _get_facet_corners(coords, merge_close_vertices=True):
+    """ return the distinct vertices and the corners of all facets
+
+    @value coords: the three vertices of each facet
+    @type coords: numpy array of shape (N * 3, 3)
+    @returns: the distinct vertices, the three vertex indices of each facet
+        and the cross product of the two edges starting at the first vertex
+        of each facet
+    @rtype: tuple of three numpy arrays
+    """
+    unique_coords, inverse = _get_unique_vertices(coords,
+            merge_close_vertices=merge_close_vertices)
+    # all corners refer to the coordinates of their unique vertex
+    corner_indices = inverse.reshape(-1, 3).astype(numpy.int32)
+    corners = unique_coords[corner_indices]
+    cross = numpy.cross(corners[:, 1] - corners[:, 0],
+            corners[:, 2] - corners[:, 0])
+    return unique_coords, corner_indices, cross
+
+def _get_oriented_mesh(unique_coords, corner_indices, normals, normal_modes,
+        dotcross):
+    """ put the corners of all facets in clockwise order and remove invalid
+    facets
+
+    @returns: the mesh (see "_create_triangles")
+    @rtype: tuple
+    """
+    invalid = numpy.flatnonzero(dotcross == 0)
+    for index in invalid:
+        # the three points are in a line - or two points are identical
+        # usually this is caused by points, that are too close together
+        # check the value of VERTEX_GRID_SIZE
+        p1, p2, p3 = [tuple(point)
+                for point in unique_coords[corner_indices[index]].tolist()]
+        log.warn("Skipping invalid triangle: %s / %s / %s " \
+                % (p1, p2, p3) + "(maybe the resolution of the model " \
+                + "is too high?)")
+    # Triangle expects the vertices in clockwise order
+    clockwise = dotcross > 0
+    corner_indices = corner_indices.copy()
+    corner_indices[clockwise] = corner_indices[clockwise][:, (0, 2, 1)]
+    if len(invalid) > 0:
+        valid = dotcross != 0
+        corner_indices = corner_indices[valid]
+        normals = normals[valid]
+        normal_modes = normal_modes[valid]
+    return (unique_coords, corner_indices, normals, normal_modes)
+
+def _get_binary_mesh(data, numfacets, use_kdtree=True, filename=None):
+    """ parse the facets of a binary STL file
+
+    All facets are parsed at once. The validation of the normals and the
+    detection of the vertex order happen for all facets at once, as well.
+    @value data: the content of the file
+    @type data: str or mmap
+    @returns: the mesh (see "_create_triangles")
+    @rtype: tuple
+    """
+    facets = numpy.frombuffer(data, dtype=BINARY_FACET_DTYPE,
+            count=numfacets, offset=BINARY_HEADER_SIZE + 4)
+    normals = facets["normal"].astype(numpy.float64)
+    coords = facets["vertices"].astype(numpy.float64).reshape(-1, 3)
+    unique_coords, corner_indices, cross = _get_facet_corners(coords,
+            merge_close_vertices=use_kdtree)
+    # facets without a normal: use the orientation of the vertices
+    no_normal = (normals == 0).all(axis=1)
+    dotcross = numpy.where(no_normal, cross[:, 2],
+            (normals * cross).sum(axis=1))
+    inconsistent = numpy.flatnonzero(dotcross < 0)
+    if len(inconsistent) > 0:
+        log.warn(("Inconsistent normal/vertices found in facet " + \
+                "definition %d of '%s'. Please validate the " + \
+                "STL file!") % (inconsistent[0] + 1, filename))
+    normal_modes = numpy.where(no_normal, NORMAL_CALCULATED,
+            NORMAL_ATTRIBUTE).astype(numpy.int8)
+    return _get_oriented_mesh(unique_coords, corner_indices, normals,
+            normal_modes, dotcross)
+
+def _create_triangles(model, mesh, callback=None):
+    """ add the triangles of a mesh to a model
+
+    @value mesh: the distinct vertices (shape (V, 3)), the vertex indices of
+        each facet in clockwise order (shape (N, 3)), the normal of each facet
+        (shape (N, 3)) and the handling of each normal (NORMAL_CALCULATED,
+        NORMAL_ARGUMENT or NORMAL_ATTRIBUTE)
+    @type mesh: tuple of numpy arrays
+    @returns: False if the operation was cancelled - otherwise True
+    """
+    global vertices
+    unique_coords, corner_indices, normals, normal_modes = mesh
+    vertices = len(unique_coords)
+    # a distinct vertex is represented by a single tuple
+    points = [tuple(point) for point in unique_coords.tolist()]
+    corner_indices = corner_indices.tolist()
+    normals = normals.tolist()
+    normal_modes = normal_modes.tolist()
+    numfacets = len(corner_indices)
+    for start in xrange(0, numfacets, CALLBACK_INTERVAL):
+        if callback and callback():
+            log.warn("STLImporter: load model operation cancelled")
+            return False
+        for index in xrange(start, min(numfacets, start + CALLBACK_INTERVAL)):
+            index1, index2, index3 = corner_indices[index]
+            p1, p2, p3 = points[index1], points[index2], points[index3]
+            mode = normal_modes[index]
+            if mode == NORMAL_ARGUMENT:
+                t = Triangle(p1, p2, p3, tuple(normals[index]) + ("v", ))
+            else:
+                t = Triangle(p1, p2, p3)
+                if mode == NORMAL_ATTRIBUTE:
+                    t.normal = tuple(normals[index]) + ("v", )
+            model.append(t)
+    return True
+
+def _iter_ascii_chunks(data):
+    """ split the content of a file into lists of lines """
+    rest = ""
+    for start in xrange(0, len(data), ASCII_CHUNK_SIZE):
+        lines = (rest + data[start:start + ASCII_CHUNK_SIZE]).split("\n")
+        rest = lines.pop()
+        yield lines
+    if rest:
+        yield [rest]
+
+def _parse_float(token):
+    try:
+        return float(token)
+    except ValueError:
+        return numpy.nan
+
+def _parse_floats(tokens):
+    """ convert a list of number strings into a numpy array
+
+    Invalid numbers (e.g. "0,5") are returned as NaN.
+    """
+    values = numpy.fromstring(" ".join(tokens), dtype=numpy.float64, sep=" ")
+    if len(values) != len(tokens):
+        # the fast parser stops at the first invalid number
+        values = numpy.array([_parse_float(token) for token in tokens],
+                dtype=numpy.float64)
+    return values
+
+def _get_ascii_mesh(data, use_kdtree=True, callback=None, filename=None):
+    """ parse the facets of an ascii STL file
+
+    Every line is dispatched based on its first word. The coordinates of all
+    vertices and normals are collected as strings and converted in chunks.
+    @value data: the content of the file
+    @type data: str or mmap
+    @returns: the name of the solid and the mesh (see "_create_triangles") -
+        or None if the operation was cancelled
+    @rtype: tuple
+    """
+    name = None
+    coord_chunks = []
+    normal_chunks = []
+    # the number strings of the complete facets in the current chunk
+    coord_tokens = []
+    normal_tokens = []
+    # the number of coordinate strings belonging to complete facets
+    complete_tokens = 0
+    has_normal = []
+    facet_lines = []
+    normal = None
+    facet_vertices = 0
+    current_line = 0
+    for lines in _iter_ascii_chunks(data):
+        if callback and callback():
+            log.warn("STLImporter: load model operation cancelled")
+            return None
+        for line in lines:
+            current_line += 1
+            tokens = line.split()
+            if not tokens:
+                continue
+            keyword = tokens[0]
+            if keyword == "vertex":
+                if len(tokens) < 4:
+                    continue
+                if facet_vertices < 3:
+                    coord_tokens.extend(tokens[1:4])
+                else:
+                    log.error("STLImporter: more then 3 points in facet " \
+                            + "(line %d)" % current_line)
+                facet_vertices += 1
+            elif keyword == "facet":
+                if (len(tokens) >= 5) and (tokens[1] == "normal"):
+                    normal = tokens[2:5]
+                else:
+                    normal = None
+            elif keyword == "endfacet":
+                if facet_vertices < 3:
+                    log.warn(("Invalid facet definition in line " \
+                            + "%d of '%s'. Please validate the STL file!") \
+                            % (current_line, filename))
+                    # drop the vertices of the incomplete facet
+                    del coord_tokens[complete_tokens:]
+                else:
+                    complete_tokens = len(coord_tokens)
+                    if normal is None:
+                        normal_tokens.extend(("0", "0", "0"))
+                        has_normal.append(False)
+                    else:
+                        normal_tokens.extend(normal)
+                        has_normal.append(True)
+                    facet_lines.append(current_line)
+                normal = None
+                facet_vertices = 0
+            elif keyword == "solid":
+                match = SOLID_REGEX.match(line)
+                if match:
+                    name = match.group(1)
+        # convert the numbers of all complete facets of this chunk
+        coord_chunks.append(_parse_floats(coord_tokens[:complete_tokens]))
+        normal_chunks.append(_parse_floats(normal_tokens))
+        coord_tokens = coord_tokens[complete_tokens:]
+        normal_tokens = []
+        complete_tokens = 0
+    if not facet_lines:
+        return name, _get_empty_mesh()
+    coords = numpy.concatenate(coord_chunks).reshape(-1, 3)
+    normals = numpy.concatenate(normal_chunks).reshape(-1, 3)
+    # a normal with invalid numbers is ignored
+    has_normal = numpy.array(has_normal) & \
+            ~numpy.isnan(normals).any(axis=1)
+    # facets with invalid vertex coordinates are skipped
+    valid = ~numpy.isnan(coords.reshape(-1, 9)).any(axis=1)
+    if not valid.all():
+        for index in numpy.flatnonzero(~valid):
+            log.warn(("Invalid facet definition in line " \
+                    + "%d of '%s'. Please validate the STL file!") \
+                    % (facet_lines[index], filename))
+        coords = coords.reshape(-1, 9)[valid].reshape(-1, 3)
+        normals = normals[valid]
+        has_normal = has_normal[valid]
+        facet_lines = numpy.array(facet_lines)[valid].tolist()
+        if not facet_lines:
+            return name, _get_empty_mesh()
+    unique_coords, corner_indices, cross = _get_facet_corners(coords,
+            merge_close_vertices=use_kdtree)
+    dotcross = (normals * cross).sum(axis=1)
+    # facets without a valid normal: calculate it based on the vertices
+    for index in numpy.flatnonzero(~has_normal):
+        p1, p2, p3 = [tuple(point)
+                for point in unique_coords[corner_indices[index]].tolist()]
+        n = pnormalized(pcross(psub(p2, p1), psub(p3, p1)))
+        if n is None:
+            # invalid triangle (zero-length vector)
+            dotcross[index] = 0
+        else:
+            normals[index] = n
+            dotcross[index] = pdot(n, pcross(psub(p2, p1), psub(p3, p1)))
+    # validate the normal
+    # The three vertices of a triangle in an STL file are supposed to be in
+    # counter-clockwise order. This should match the direction of the normal.
+    inconsistent = numpy.flatnonzero(dotcross < 0)
+    if len(inconsistent) > 0:
+        log.warn(("Inconsistent normal/vertices found in " + \
+                "line %d of '%s'. Please validate the STL " + \
+                "file!") % (facet_lines[inconsistent[0]], filename))
+    normal_modes = numpy.zeros(len(normals), dtype=numpy.int8)
+    normal_modes[:] = NORMAL_ARGUMENT
+    return name, _get_oriented_mesh(unique_coords, corner_indices, normals,
+            normal_modes, dotcross)
+
+def _get_empty_mesh():
+    return (numpy.zeros((0, 3), dtype=numpy.float64),
+            numpy.zeros((0, 3), dtype=numpy.int32),
+            numpy.zeros((0, 3), dtype=numpy.float64),
+            numpy.zeros(0, dtype=numpy.int8))
+
+def _get_header_lines(data):
+    """ return the first two lines (ignoring comments) or None """
+    header_lines = []
+    position = 0
+    while len(header_lines) < 2:
+        # a line is limited to 200 characters
+        end = data.find("\n", position, position + 200)
+        if end < 0:
+            end = min(len(data), position + 200)
+        else:
+            end += 1
+        line = data[position:end]
+        if len(line) == 0:
+            # empty line (not even a line-feed) -> EOF
+            return None
+        position = end
+        # ignore comment lines
+        # note: partial comments (starting within a line) are not handled
+        if not line.startswith(";"):
+            header_lines.append(line)
+    return header_lines
 
-def ImportModel(filename, use_kdtree=True, callback=None, **kwargs):
-    global vertices, edges, kdtree
+def ImportModel(filename, use_kdtree=True, callback=None, use_cache=True,
+        **kwargs):
+    global vertices, edges
     vertices = 0
     edges = 0
-    kdtree = None
-
-    normal_conflict_warning_seen = False
 
+    local_file = None
     if hasattr(filename, "read"):
-        # make sure that the input stream can seek and has ".len"
-        f = StringIO.StringIO(filename.read())
+        data = filename.read()
         # useful for later error messages
         filename = "input stream"
     else:
+        uri = pycam.Utils.URIHandler(filename)
         try:
-            url_file = pycam.Utils.URIHandler(filename).open()
-            # urllib.urlopen objects do not support "seek" - so we need to read
-            # the whole file at once. This is ugly - anyone with a better idea?
-            f = StringIO.StringIO(url_file.read())
-            # TODO: the above ".read" may be incomplete - this is ugly
-            # see http://patrakov.blogspot.com/2011/03/case-of-non-raised-exception.html
-            # and http://stackoverflow.com/questions/1824069/urllib2-not-retrieving-entire-http-response
-            url_file.close()
-        except IOError, err_msg:
+            if uri.is_local():
+                local_file = open(uri.get_local_path(), "rb")
+                try:
+                    # avoid a copy of the whole file
+                    data = mmap.mmap(local_file.fileno(), 0,
+                            access=mmap.ACCESS_READ)
+                except (mmap.error, ValueError):
+                    # e.g. an empty file
+                    data = local_file.read()
+            else:
+                url_file = uri.open()
+                data = url_file.read()
+                # TODO: the above ".read" may be incomplete - this is ugly
+                # see http://patrakov.blogspot.com/2011/03/case-of-non-raised-exception.html
+                # and http://stackoverflow.com/questions/1824069/urllib2-not-retrieving-entire-http-response
+                url_file.close()
+        except (IOError, mmap.error), err_msg:
             log.error("STLImporter: Failed to read file (%s): %s" \
                     % (filename, err_msg))
             return None
+    try:
+        return _import_model_data(data, filename, use_kdtree=use_kdtree,
+                callback=callback, use_cache=use_cache)
+    finally:
+        if local_file:
+            if isinstance(data, mmap.mmap):
+                data.close()
+            local_file.close()
+
+def _import_model_data(data, filename, use_kdtree=True, callback=None,
+        use_cache=True):
+    global vertices, edges
     # Read the first two lines of (potentially non-binary) input - they should
     # contain "solid" and "facet".
-    header_lines = []
-    while len(header_lines) < 2:
-        line = f.readline(200)
-        if len(line) == 0:
-            # empty line (not even a line-feed) -> EOF
-            log.error("STLImporter: No valid lines found in '%s'" % filename)
-            return None
-        # ignore comment lines
-        # note: partial comments (starting within a line) are not handled
-        if not line.startswith(";"):
-            header_lines.append(line)
+    header_lines = _get_header_lines(data)
+    if header_lines is None:
+        log.error("STLImporter: No valid lines found in '%s'" % filename)
+        return None
     header = "".join(header_lines)
     # read byte 80 to 83 - they contain the "numfacets" value in binary format
-    f.seek(80)
-    numfacets = unpack("<I", f.read(4))[0]
+    if len(data) >= BINARY_HEADER_SIZE + 4:
+        numfacets = unpack("<I", data[BINARY_HEADER_SIZE:
+                BINARY_HEADER_SIZE + 4])[0]
+    else:
+        numfacets = None
     binary = False
     log.debug("STL import info: %s / %s / %s / %s" % \
-            (f.len, numfacets, header.find("solid"), header.find("facet")))
+            (len(data), numfacets, header.find("solid"), header.find("facet")))
 
-    if f.len == (84 + 50*numfacets):
+    if (not numfacets is None) and \
+            (len(data) == (BINARY_HEADER_SIZE + 4 + 50 * numfacets)):
         binary = True
     elif header.find("solid") >= 0 and header.find("facet") >= 0:
         binary = False
-        f.seek(0)
     else:
         log.error("STLImporter: STL binary/ascii detection failed")
         return None
 
-    if use_kdtree:
-        kdtree = PointKdtree([], 3, 1, epsilon)
-    model = Model(use_kdtree)
-
-    t = None
-    p1 = None
-    p2 = None
-    p3 = None
-
-    if binary:
-        for i in range(1, numfacets + 1): 
-            if callback and callback():
-                log.warn("STLImporter: load model operation cancelled")
-                return None
-            a1 = unpack("<f", f.read(4))[0] 
-            a2 = unpack("<f", f.read(4))[0] 
-            a3 = unpack("<f", f.read(4))[0] 
-
-            n = (float(a1), float(a2), float(a3), 'v')
-            
-            v11 = unpack("<f", f.read(4))[0] 
-            v12 = unpack("<f", f.read(4))[0] 
-            v13 = unpack("<f", f.read(4))[0] 
-
-            p1 = UniqueVertex(float(v11), float(v12), float(v13))
-            
-            v21 = unpack("<f", f.read(4))[0] 
-            v22 = unpack("<f", f.read(4))[0] 
-            v23 = unpack("<f", f.read(4))[0] 
-
-            p2 = UniqueVertex(float(v21), float(v22), float(v23))
-            
-            v31 = unpack("<f", f.read(4))[0] 
-            v32 = unpack("<f", f.read(4))[0] 
-            v33 = unpack("<f", f.read(4))[0] 
-            
-            p3 = UniqueVertex(float(v31), float(v32), float(v33))
-
-            # not used
-            attribs = unpack("<H", f.read(2)) 
-            
-            dotcross = pdot(n, pcross(psub(p2, p1), psub(p3, p1)))
-            if a1 == a2 == a3 == 0:
-                dotcross = pcross(psub(p2, p1), psub(p3,p1))[2]
-                n = None
-
-            if dotcross > 0:
-                # Triangle expects the vertices in clockwise order
-                t = Triangle(p1, p3, p2)
-            elif dotcross < 0:
-                if not normal_conflict_warning_seen:
-                    log.warn(("Inconsistent normal/vertices found in facet " + \
-                            "definition %d of '%s'. Please validate the " + \
-                            "STL file!") % (i, filename))
-                    normal_conflict_warning_seen = True
-                t = Triangle(p1, p2, p3)
-            else:
-                # the three points are in a line - or two points are identical
-                # usually this is caused by points, that are too close together
-                # check the tolerance value in pycam/Geometry/PointKdtree.py
-                log.warn("Skipping invalid triangle: %s / %s / %s " \
-                        % (p1, p2, p3) + "(maybe the resolution of the model " \
-                        + "is too high?)")
-                continue
-            if n:
-                t.normal = n
-
-            model.append(t)
+    cache_key = None
+    cached = None
+    if use_cache and (len(data) >= CACHE_MIN_FILE_SIZE):
+        # the preprocessed mesh of large models is cached
+        cache_key = pycam.Importers.ModelCache.get_cache_key(data, "stl",
+                use_kdtree, VERTEX_GRID_SIZE)
+        cached = pycam.Importers.ModelCache.load(cache_key)
+    name = None
+    if cached:
+        name, mesh = cached[0], tuple(cached[1])
+    elif binary:
+        mesh = _get_binary_mesh(data, numfacets, use_kdtree=use_kdtree,
+                filename=filename)
     else:
-        solid = re.compile(r"\s*solid\s+(\w+)\s+.*")
-        endsolid = re.compile(r"\s*endsolid\s*")
-        facet = re.compile(r"\s*facet\s*")
-        normal = re.compile(r"\s*facet\s+normal" \
-                + r"\s+(?P<x>[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?)" \
-                + r"\s+(?P<y>[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?)" \
-                + r"\s+(?P<z>[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?)\s+")
-        endfacet = re.compile(r"\s*endfacet\s+")
-        loop = re.compile(r"\s*outer\s+loop\s+")
-        endloop = re.compile(r"\s*endloop\s+")
-        vertex = re.compile(r"\s*vertex" \
-                + r"\s+(?P<x>[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?)" \
-                + r"\s+(?P<y>[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?)" \
-                + r"\s+(?P<z>[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?)\s+")
-
-        current_line = 0
-
-        for line in f:
-            if callback and callback():
-                log.warn("STLImporter: load model operation cancelled")
-                return None
-            current_line += 1
-            m = solid.match(line)
-            if m:
-                model.name = m.group(1)
-                continue
-
-            m = facet.match(line)
-            if m:
-                m = normal.match(line)
-                if m:
-                    n = (float(m.group('x')), float(m.group('y')), float(m.group('z')), 'v')
-                else:
-                    n = None
-                continue
-            m = loop.match(line)
-            if m:
-                continue
-            m = vertex.match(line)
-            if m:
-                p = UniqueVertex(float(m.group('x')), float(m.group('y')),
-                        float(m.group('z')))
-                if p1 is None:
-                    p1 = p
-                elif p2 is None:
-                    p2 = p
-                elif p3 is None:
-                    p3 = p
-                else:
-                    log.error("STLImporter: more then 3 points in facet " \
-                            + "(line %d)" % current_line)
-                continue
-            m = endloop.match(line)
-            if m:
-                continue
-            m = endfacet.match(line)
-            if m:
-                if p1 is None or p2 is None or p3 is None:
-                    log.warn(("Invalid facet definition in line " \
-                            + "%d of '%s'. Please validate the STL file!") \
-                            % (current_line, filename))
-                    n, p1, p2, p3 = None, None, None, None
-                    continue
-                if not n:
-                    n = pnormalized(pcross(psub(p2, p1), psub(p3, p1)))
-
-                # validate the normal
-                # The three vertices of a triangle in an STL file are supposed
-                # to be in counter-clockwise order. This should match the
-                # direction of the normal.
-                if n is None:
-                    # invalid triangle (zero-length vector)
-                    dotcross = 0
-                else:
-                    # make sure the points are in ClockWise order
-                    dotcross = pdot(n, pcross(psub(p2,p1), psub(p3, p1)))
-                if dotcross > 0:
-                    # Triangle expects the vertices in clockwise order
-                    t = Triangle(p1, p3, p2, n)
-                elif dotcross < 0:
-                    if not normal_conflict_warning_seen:
-                        log.warn(("Inconsistent normal/vertices found in " + \
-                                "line %d of '%s'. Please validate the STL " + \
-                                "file!") % (current_line, filename))
-                        normal_conflict_warning_seen = True
-                    t = Triangle(p1, p2, p3, n)
-                else:
-                    # The three points are in a line - or two points are
-                    # identical. Usually this is caused by points, that are too
-                    # close together. Check the tolerance value in
-                    # pycam/Geometry/PointKdtree.py.
-                    log.warn("Skipping invalid triangle: %s / %s / %s " \
-                            % (p1, p2, p3) + "(maybe the resolution of the " \
-                            + "model is too high?)")
-                    n, p1, p2, p3 = (None, None, None, None)
-                    continue
-                n, p1, p2, p3 = (None, None, None, None)
-                model.append(t)
-                continue
-            m = endsolid.match(line)
-            if m:
-                continue
+        result = _get_ascii_mesh(data, use_kdtree=use_kdtree,
+                callback=callback, filename=filename)
+        if result is None:
+            return None
+        name, mesh = result
+    if cache_key and not cached:
+        pycam.Importers.ModelCache.store(cache_key, name, mesh)
+    model = Model(use_kdtree)
+    if name:
+        model.name = name
+    if not _create_triangles(model, mesh, callback=callback):
+        return None
 
     log.info("Imported STL model: %d vertices, %d edges, %d triangles" \
             % (vertices, edges, len(model.triangles())))
     vertices = 0
     edges = 0
-    kdtree = None
 
     if not model:
         # no valid items added to the model
@@ -21,7 +21,8 @@ You should have received a copy of the GNU General Public License
 along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-__all__ = ["STLImporter", "DXFImporter", "SVGImporter", "TestModel"]
+__all__ = ["STLImporter", "DXFImporter", "SVGImporter", "TestModel",
+        "GCodeImporter"]
 
 import pycam.Utils.log
 import pycam.Utils
@@ -48,6 +48,22 @@ class DropCutter(object):
 
     def GenerateToolPath(self, cutter, models, motion_grid, minz=None, maxz=None, draw_callback=None):
         path = []
+        for line_moves in self.iter_toolpath(cutter, models, motion_grid,
+                minz=minz, maxz=maxz, draw_callback=draw_callback):
+            path.extend(line_moves)
+            if draw_callback and draw_callback(toolpath=path):
+                # cancel requested
+                break
+        return path
+
+    def iter_toolpath(self, cutter, models, motion_grid, minz=None, maxz=None,
+            draw_callback=None):
+        """ calculate the toolpath line by line
+
+        The moves of each grid line are returned (as a list) as soon as the
+        line is finished. Thus the consumer (e.g. a GCode exporter) does not
+        need to keep the complete toolpath in memory.
+        """
         quit_requested = False
         model = pycam.Geometry.Model.get_combined_model(models)
 
@@ -75,25 +91,24 @@ class DropCutter(object):
             if draw_callback and draw_callback(text="DropCutter: processing " \
                         + "line %d/%d" % (current_line + 1, num_of_lines)):
                 # cancel requested
-                quit_requested = True
                 break
+            line_moves = []
             for point in points:
                 if point is None:
                     # exceeded maxz - the cutter has to skip this point
-                    path.append((MOVE_SAFETY, None))
+                    line_moves.append((MOVE_SAFETY, None))
                 else:
-                    path.append((MOVE_STRAIGHT, point))
+                    line_moves.append((MOVE_STRAIGHT, point))
                 # The progress counter may return True, if cancel was requested.
-                if draw_callback and draw_callback(tool_position=point,
-                        toolpath=path):
+                if draw_callback and draw_callback(tool_position=point):
                     quit_requested = True
                     break
             # add a move to safety height after each line of moves
-            path.append((MOVE_SAFETY, None))
+            line_moves.append((MOVE_SAFETY, None))
+            yield line_moves
             progress_counter.increment()
             # update progress
             current_line += 1
             if quit_requested:
                 break
-        return path
 
@@ -56,6 +56,22 @@ class PushCutter(object):
         self.waterlines = waterlines
 
     def GenerateToolPath(self, cutter, models, motion_grid, minz=None, maxz=None, draw_callback=None):
+        path = []
+        for line_moves in self.iter_toolpath(cutter, models, motion_grid,
+                minz=minz, maxz=maxz, draw_callback=draw_callback):
+            path.extend(line_moves)
+            if draw_callback and line_moves:
+                draw_callback(toolpath=path)
+        return path
+
+    def iter_toolpath(self, cutter, models, motion_grid, minz=None, maxz=None,
+            draw_callback=None):
+        """ calculate the toolpath line by line
+
+        The moves of each grid line are returned (as a list) as soon as the
+        line is finished. Waterlines can only be returned after all layers
+        are processed (in a single list).
+        """
         # Transfer the grid (a generator) into a list of lists and count the
         # items.
         grid = []
@@ -75,8 +91,6 @@ class PushCutter(object):
         current_layer = 0
         if self.waterlines:
             self.pa = pycam.PathProcessors.ContourCutter.ContourCutter()
-        else:
-            path = []
         for layer_grid in grid:
             # update the progress bar and check, if we should cancel the process
             if draw_callback and draw_callback(text="PushCutter: processing" \
@@ -86,13 +100,12 @@ class PushCutter(object):
 
             if self.waterlines:
                 self.pa.new_direction(0)
-            result = self.GenerateToolPathSlice(cutter, models, layer_grid,
-                    draw_callback, progress_counter)
+            for line_moves in self.iter_toolpath_slice(cutter, models,
+                    layer_grid, draw_callback, progress_counter):
+                yield line_moves
             if self.waterlines:
                 self.pa.end_direction()
                 self.pa.finish()
-            else:
-                path.extend(result)
 
             current_layer += 1
 
@@ -121,14 +134,22 @@ class PushCutter(object):
                         result.append((MOVE_STRAIGHT, p1))
                         result.append((MOVE_STRAIGHT, p2))
                         result.append((MOVE_SAFETY, None))
-            return result
-        else:
-            return path
+            yield result
 
     def GenerateToolPathSlice(self, cutter, models, layer_grid, draw_callback=None,
             progress_counter=None):
         path = []
+        for line_moves in self.iter_toolpath_slice(cutter, models, layer_grid,
+                draw_callback, progress_counter):
+            path.extend(line_moves)
+        if not self.waterlines:
+            return path
 
+    def iter_toolpath_slice(self, cutter, models, layer_grid,
+            draw_callback=None, progress_counter=None):
+        """ return the moves of every line of a layer (waterlines are
+        collected in the path processor instead)
+        """
         # settings for calculation of depth
         accuracy = 20
         max_depth = 20
@@ -158,22 +179,19 @@ class PushCutter(object):
                     for point in points:
                         self.pa.append(point)
                 else:
+                    line_moves = []
                     for index in range(len(points) / 2):
-                        path.append((MOVE_STRAIGHT, points[2 * index]))
-                        path.append((MOVE_STRAIGHT, points[2 * index + 1]))
-                        path.append((MOVE_SAFETY, None))
+                        line_moves.append((MOVE_STRAIGHT, points[2 * index]))
+                        line_moves.append((MOVE_STRAIGHT,
+                                points[2 * index + 1]))
+                        line_moves.append((MOVE_SAFETY, None))
+                    yield line_moves
+                if draw_callback:
+                    draw_callback(tool_position=points[-1])
                 if self.waterlines:
-                    if draw_callback:
-                        draw_callback(tool_position=points[-1])
                     self.pa.end_scanline()
-                else:
-                    if draw_callback:
-                        draw_callback(tool_position=points[-1], toolpath=path)
             # update the progress counter
             if progress_counter and progress_counter.increment():
                 # quit requested
                 break
 
-        if not self.waterlines:
-            return path
-
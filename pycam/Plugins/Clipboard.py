@@ -133,10 +133,13 @@ class Clipboard(pycam.Plugins.PluginBase):
             # merge only 3D _or_ 2D models (don't mix them)
             if same_type(merged_model, model.model):
                 merged_model += model.model
+        is_contour = isinstance(merged_model, pycam.Geometry.Model.ContourModel)
+        export_args = {"unit": self.core.get("unit")}
+        if not is_contour:
+            export_args["binary"] = bool(self.core.get("stl_export_binary"))
         # TODO: add "comment=get_meta_data()" here
-        merged_model.export(unit=self.core.get("unit")).write(text_buffer)
+        merged_model.export(**export_args).write(text_buffer)
         text_buffer.seek(0)
-        is_contour = isinstance(merged_model, pycam.Geometry.Model.ContourModel)
         # TODO: this should not be decided here
         if is_contour:
             targets = CLIPBOARD_TARGETS["svg"]
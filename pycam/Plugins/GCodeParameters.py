@@ -27,6 +27,10 @@ from pycam.Toolpath import CORNER_STYLE_EXACT_PATH, CORNER_STYLE_EXACT_STOP, \
         CORNER_STYLE_OPTIMIZE_SPEED, CORNER_STYLE_OPTIMIZE_TOLERANCE
 
 
+# time (in seconds) spent for improving the order of segments (per layer)
+SEGMENT_ORDER_IMPROVEMENT_TIME = 0.5
+
+
 class GCodeSafetyHeight(pycam.Plugins.PluginBase):
 
     DEPENDS = ["ToolpathProcessors"]
@@ -123,6 +127,104 @@ class GCodeStepWidth(pycam.Plugins.PluginBase):
         return [Filters.StepWidth(**kwargs)]
 
 
+class GCodeSimplification(pycam.Plugins.PluginBase):
+
+    DEPENDS = ["ToolpathProcessors"]
+    CATEGORIES = ["GCode"]
+
+    def setup(self):
+        self.control = pycam.Gui.ControlsGTK.InputNumber(digits=4, start=0.0,
+                increment=0.001, change_handler=lambda *args: \
+                    self.core.emit_event("visual-item-updated"))
+        self.core.get("register_parameter")("toolpath_processor",
+                "simplify_tolerance", self.control)
+        self.core.register_ui("gcode_general_parameters",
+                "Simplification tolerance", self.control.get_widget(),
+                weight=40)
+        self.core.register_chain("toolpath_filters", self.get_toolpath_filters)
+        return True
+
+    def teardown(self):
+        self.core.unregister_chain("toolpath_filters",
+                self.get_toolpath_filters)
+        self.core.unregister_ui("gcode_general_parameters",
+                self.control.get_widget())
+        self.core.get("unregister_parameter")("toolpath_processor",
+                "simplify_tolerance")
+
+    @Filters.toolpath_filter("settings", "simplify_tolerance")
+    def get_toolpath_filters(self, tolerance):
+        if tolerance > 0:
+            return [Filters.SimplifyToolpath(tolerance)]
+        else:
+            return []
+
+
+class GCodeArcFitting(pycam.Plugins.PluginBase):
+
+    DEPENDS = ["ToolpathProcessors"]
+    CATEGORIES = ["GCode"]
+
+    def setup(self):
+        self.control = pycam.Gui.ControlsGTK.InputNumber(digits=4, start=0.0,
+                increment=0.001, change_handler=lambda *args: \
+                    self.core.emit_event("visual-item-updated"))
+        self.core.get("register_parameter")("toolpath_processor",
+                "arc_tolerance", self.control)
+        self.core.register_ui("gcode_general_parameters",
+                "Arc fitting tolerance", self.control.get_widget(), weight=45)
+        self.core.register_chain("toolpath_filters", self.get_toolpath_filters)
+        return True
+
+    def teardown(self):
+        self.core.unregister_chain("toolpath_filters",
+                self.get_toolpath_filters)
+        self.core.unregister_ui("gcode_general_parameters",
+                self.control.get_widget())
+        self.core.get("unregister_parameter")("toolpath_processor",
+                "arc_tolerance")
+
+    @Filters.toolpath_filter("settings", "arc_tolerance")
+    def get_toolpath_filters(self, tolerance):
+        if tolerance > 0:
+            return [Filters.FitArcs(tolerance)]
+        else:
+            return []
+
+
+class GCodeSegmentOrder(pycam.Plugins.PluginBase):
+
+    DEPENDS = ["ToolpathProcessors"]
+    CATEGORIES = ["GCode"]
+
+    def setup(self):
+        self.control = pycam.Gui.ControlsGTK.InputCheckBox(
+                change_handler=lambda *args: \
+                    self.core.emit_event("visual-item-updated"))
+        self.core.get("register_parameter")("toolpath_processor",
+                "optimize_segment_order", self.control)
+        self.core.register_ui("gcode_general_parameters",
+                "Minimize moves at safety height", self.control.get_widget(),
+                weight=50)
+        self.core.register_chain("toolpath_filters", self.get_toolpath_filters)
+        return True
+
+    def teardown(self):
+        self.core.unregister_chain("toolpath_filters",
+                self.get_toolpath_filters)
+        self.core.unregister_ui("gcode_general_parameters",
+                self.control.get_widget())
+        self.core.get("unregister_parameter")("toolpath_processor",
+                "optimize_segment_order")
+
+    @Filters.toolpath_filter("settings", "optimize_segment_order")
+    def get_toolpath_filters(self, optimize_segment_order):
+        if optimize_segment_order:
+            return [Filters.SortSegments(SEGMENT_ORDER_IMPROVEMENT_TIME)]
+        else:
+            return []
+
+
 class GCodeSpindle(pycam.Plugins.PluginBase):
 
     DEPENDS = ["ToolpathProcessors"]
@@ -23,6 +23,7 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 import pycam.Plugins
 import pycam.Utils
+import pycam.Gui.ControlsGTK
 
 
 class ModelExport(pycam.Plugins.PluginBase):
@@ -103,10 +104,25 @@ class ModelExportTrimesh(pycam.Plugins.PluginBase):
     DEPENDS = ["ModelExport"]
 
     def setup(self):
+        if self.gui:
+            self._binary_control = pycam.Gui.ControlsGTK.InputCheckBox(
+                    start=False)
+            self.core.register_ui("preferences_general", "Binary STL export",
+                    self._binary_control.get_widget(), 60)
+            self.core.add_item("stl_export_binary",
+                    self._binary_control.get_value,
+                    self._binary_control.set_value)
+        self.register_state_item("settings/stl_export_binary",
+                lambda: self.core.get("stl_export_binary"),
+                lambda value: self.core.set("stl_export_binary", value))
         self.core.register_chain("model_export", self.export_trimesh, weight=30)
         return True
 
     def teardown(self):
+        self.clear_state_items()
+        if self.gui:
+            self.core.unregister_ui("preferences_general",
+                    self._binary_control.get_widget())
         self.core.unregister_chain("model_export", self.export_trimesh)
 
     def export_trimesh(self, models):
@@ -131,11 +147,14 @@ class ModelExportTrimesh(pycam.Plugins.PluginBase):
                 self.log.error("Unable to write file to a non-local " + \
                         "destination: %s" % uri)
                 continue
+            # binary STL files are much smaller and faster to write
+            binary = bool(self.core.get("stl_export_binary"))
             try:
-                file_in = open(uri.get_local_path(), "w")
+                file_in = open(uri.get_local_path(), "wb" if binary else "w")
                 # TODO: fill in "comment" with "meta_data"
                 # TODO: call a specific exporter
-                model.model.export(unit=self.core.get("unit")).write(file_in)
+                model.model.export(unit=self.core.get("unit"),
+                        binary=binary).write(file_in)
                 file_in.close()
                 removal_list.append(index)
             except IOError, err_msg:
@@ -22,7 +22,8 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 
 import pycam.Plugins
 import pycam.Gui.OpenGLTools
-from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_ARC, \
+        get_arc_points
 
 
 class OpenGLViewToolpath(pycam.Plugins.PluginBase):
@@ -131,7 +132,16 @@ class OpenGLViewToolpath(pycam.Plugins.PluginBase):
         last_rapid = None
         GL.glBegin(GL.GL_LINE_STRIP)
         for move_type, position in moves:
-            if not move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+            if move_type == MOVE_ARC:
+                # draw the arc as a sequence of straight lines
+                if last_position is None:
+                    points = [position[0]]
+                else:
+                    points = get_arc_points(last_position, position)
+                move_type = MOVE_STRAIGHT
+            elif move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+                points = [position]
+            else:
                 continue
             rapid = move_type == MOVE_STRAIGHT_RAPID
             if last_rapid != rapid:
@@ -148,8 +158,9 @@ class OpenGLViewToolpath(pycam.Plugins.PluginBase):
                 if not last_position is None:
                     GL.glVertex3f(*last_position)
                 last_rapid = rapid
-            GL.glVertex3f(*position)
-            last_position = position
+            for point in points:
+                GL.glVertex3f(*point)
+            last_position = points[-1]
         GL.glEnd()
         if show_directions:
             for index in range(len(moves) - 1):
@@ -55,6 +55,10 @@ class ParallelProcessing(pycam.Plugins.PluginBase):
                     self.toggle_process_pool_window, False))
             self.gui.get_object("ProcessPoolRefreshInterval").set_value(3)
             self.process_pool_model = self.gui.get_object("ProcessPoolStatisticsModel")
+            self._task_statistics = {}
+            self._gtk_handlers.append((
+                    self.gui.get_object("ProcessPoolPlot"), "expose-event",
+                    self.draw_process_pool_plot))
             # show/hide controls
             self.enable_parallel_processes = self.gui.get_object(
                     "EnableParallelProcesses")
@@ -154,9 +158,24 @@ class ParallelProcessing(pycam.Plugins.PluginBase):
         self.gui.get_object("ProcessPoolConnectedWorkersValue").set_text(
                 str(len(stats)))
         details = pycam.Utils.threading.get_task_statistics()
-        detail_text = os.linesep.join(["%s: %s" % (key, value)
-                for (key, value) in details.iteritems()])
-        self.gui.get_object("ProcessPoolDetails").set_text(detail_text)
+        self._task_statistics = details
+        detail_lines = []
+        for key in ("tasks", "results", "pending"):
+            if key in details:
+                detail_lines.append("%s: %s" % (key, details[key]))
+        for key in ("cache", "worker_cache"):
+            if key in details:
+                detail_lines.append("%s: %d kB (hit ratio: %d%%, %d evictions)" \
+                        % (key, details[key]["size"] / 1024,
+                            100 * details[key]["hit_ratio"],
+                            details[key]["evictions"]))
+        for name, metrics in details.get("functions", {}).iteritems():
+            detail_lines.append(("%s: %d tasks, %d kB transferred") % (name,
+                    metrics["tasks"],
+                    (metrics["bytes_in"] + metrics["bytes_out"]) / 1024))
+        self.gui.get_object("ProcessPoolDetails").set_text(
+                os.linesep.join(detail_lines))
+        self.gui.get_object("ProcessPoolPlot").queue_draw()
         current_interval = int(max(1, self.gui.get_object(
                 "ProcessPoolRefreshInterval").get_value()))
         if original_interval != current_interval:
@@ -169,6 +188,53 @@ class ParallelProcessing(pycam.Plugins.PluginBase):
             # don't repeat, if the window is hidden
             return self.gui.get_object("ToggleProcessPoolWindow").get_active()
 
+    def draw_process_pool_plot(self, widget, event):
+        """ draw the queue depth (left) and the histogram of processing times
+        of all task functions (right)
+        """
+        context = widget.window.cairo_create()
+        width, height = widget.window.get_size()
+        half_width = width / 2.0
+        margin = 4
+        context.set_source_rgb(1, 1, 1)
+        context.paint()
+        context.set_line_width(1)
+        # queue depth over time
+        samples = self._task_statistics.get("queue_depth", [])
+        if len(samples) > 1:
+            start_time = samples[0][0]
+            duration = max(samples[-1][0] - start_time, 1)
+            max_depth = max([depth for timestamp, depth in samples] + [1])
+            get_x = lambda timestamp: margin + (half_width - 2 * margin) * \
+                    (timestamp - start_time) / duration
+            get_y = lambda depth: height - margin - (height - 2 * margin) * \
+                    float(depth) / max_depth
+            context.set_source_rgb(0.2, 0.2, 0.8)
+            context.move_to(get_x(samples[0][0]), get_y(samples[0][1]))
+            for timestamp, depth in samples[1:]:
+                context.line_to(get_x(timestamp), get_y(depth))
+            context.stroke()
+        # histogram of processing times
+        counts = None
+        for metrics in self._task_statistics.get("functions", {}).values():
+            bucket_counts = [count
+                    for limit, count in metrics["latency_histogram"]]
+            if counts is None:
+                counts = bucket_counts
+            else:
+                counts = [a + b for a, b in zip(counts, bucket_counts)]
+        if counts:
+            bar_width = (half_width - 2 * margin) / len(counts)
+            max_count = max(max(counts), 1)
+            context.set_source_rgb(0.2, 0.6, 0.2)
+            for index, count in enumerate(counts):
+                bar_height = (height - 2 * margin) * float(count) / max_count
+                context.rectangle(half_width + margin + index * bar_width,
+                        height - margin - bar_height, bar_width - 1,
+                        bar_height)
+            context.fill()
+        return True
+
     def generate_random_server_password(self, widget=None):
         all_characters = string.letters + string.digits
         random_pw = "".join([random.choice(all_characters) for i in range(12)])
@@ -27,7 +27,9 @@ from pycam.Geometry.PointUtils import *
 import pycam.Exporters.GCode.LinuxCNC
 
 
-FILTER_GCODE = (("GCode files", ("*.ngc", "*.nc", "*.gc", "*.gcode")),)
+FILTER_GCODE = (("GCode files", ("*.ngc", "*.nc", "*.gc", "*.gcode")),
+        ("Compressed GCode files", ("*.ngc.gz", "*.nc.gz", "*.gc.gz",
+                "*.gcode.gz")))
 
 
 class ToolpathExport(pycam.Plugins.PluginBase):
@@ -111,7 +113,8 @@ class ToolpathExport(pycam.Plugins.PluginBase):
         if not filename:
             return
         try:
-            destination = open(filename, "w")
+            # the output is compressed for filenames ending with ".gz"
+            destination = pycam.Exporters.GCode.open_destination(filename)
             # TODO: implement "get_meta_data()"
             #meta_data = self.get_meta_data()
             meta_data = ""
@@ -169,7 +172,8 @@ class ToolpathExport(pycam.Plugins.PluginBase):
                 generator.add_moves(toolpath.path, toolpath.filters)
             generator.finish()
             destination.close()
-            self.log.info("GCode file successfully written: %s" % str(filename))
+            self.log.info("GCode file successfully written: %s (%d bytes)" \
+                    % (str(filename), os.path.getsize(filename)))
         except IOError, err_msg:
             self.log.error("Failed to save toolpath file: %s" % err_msg)
         else:
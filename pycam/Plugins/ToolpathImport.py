@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import pycam.Plugins
+import pycam.Importers.GCodeImporter
+from pycam.Plugins.ToolpathExport import FILTER_GCODE
+
+
+class ToolpathImport(pycam.Plugins.PluginBase):
+
+    UI_FILE = "toolpath_import.ui"
+    DEPENDS = ["Toolpaths", "FilenameDialog"]
+    CATEGORIES = ["Toolpath", "Import"]
+
+    def setup(self):
+        self._last_toolpath_file = None
+        if self.gui:
+            self._frame = self.gui.get_object("ToolpathImportFrame")
+            self._frame.unparent()
+            self.core.register_ui("toolpath_handling", "Import",
+                    self._frame, -90)
+            self._gtk_handlers = ((self.gui.get_object("ImportGCode"),
+                    "clicked", self.import_gcode), )
+            self.register_gtk_handlers(self._gtk_handlers)
+        return True
+
+    def teardown(self):
+        if self.gui:
+            self.core.unregister_ui("toolpath_handling", self._frame)
+            self.unregister_gtk_handlers(self._gtk_handlers)
+
+    def import_gcode(self, widget=None, filename=None):
+        """ add the moves of an existing GCode file as a new toolpath (e.g.
+        for estimating its machine time or for the simulation)
+        """
+        if not filename:
+            filename = self.core.get("get_filename_func")(
+                    "Load toolpath from ...", mode_load=True,
+                    type_filter=FILTER_GCODE,
+                    filename_templates=(self._last_toolpath_file, ))
+        if not filename:
+            return
+        self._last_toolpath_file = filename
+        progress = self.core.get("progress")
+        progress.update(text="Loading GCode ...")
+        toolpath = pycam.Importers.GCodeImporter.import_toolpath(filename,
+                callback=progress.update)
+        progress.finish()
+        if toolpath:
+            self.core.get("toolpaths").add_new(toolpath)
@@ -214,7 +214,8 @@ def _get_processor_filters(core, parameters):
 class ToolpathProcessorMilling(pycam.Plugins.PluginBase):
 
     DEPENDS = ["Toolpaths", "GCodeSafetyHeight", "GCodeFilenameExtension",
-            "GCodeStepWidth", "GCodeSpindle", "GCodeCornerStyle"]
+            "GCodeStepWidth", "GCodeSimplification", "GCodeArcFitting",
+            "GCodeSegmentOrder", "GCodeSpindle", "GCodeCornerStyle"]
     CATEGORIES = ["Toolpath"]
 
     def setup(self):
@@ -223,6 +224,9 @@ class ToolpathProcessorMilling(pycam.Plugins.PluginBase):
                 "step_width_x": 0.0001,
                 "step_width_y": 0.0001,
                 "step_width_z": 0.0001,
+                "simplify_tolerance": 0.0,
+                "arc_tolerance": 0.0,
+                "optimize_segment_order": False,
                 "path_mode": CORNER_STYLE_EXACT_PATH,
                 "motion_tolerance": 0.0,
                 "naive_tolerance": 0.0,
@@ -246,6 +250,7 @@ class ToolpathProcessorMilling(pycam.Plugins.PluginBase):
 class ToolpathProcessorLaser(pycam.Plugins.PluginBase):
 
     DEPENDS = ["Toolpaths", "GCodeFilenameExtension", "GCodeStepWidth",
+            "GCodeSimplification", "GCodeArcFitting", "GCodeSegmentOrder",
             "GCodeCornerStyle"]
     CATEGORIES = ["Toolpath"]
 
@@ -254,6 +259,9 @@ class ToolpathProcessorLaser(pycam.Plugins.PluginBase):
                 "step_width_x": 0.0001,
                 "step_width_y": 0.0001,
                 "step_width_z": 0.0001,
+                "simplify_tolerance": 0.0,
+                "arc_tolerance": 0.0,
+                "optimize_segment_order": False,
                 "path_mode": CORNER_STYLE_EXACT_PATH,
                 "motion_tolerance": 0.0,
                 "naive_tolerance": 0.0,
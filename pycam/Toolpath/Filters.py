@@ -21,10 +21,14 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-import decimal
+import math
+import time
+
+import numpy
 
 from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_SAFETY, \
-        MOVES_LIST, MACHINE_SETTING
+        MOVE_ARC, MOVES_LIST, MACHINE_SETTING
+from pycam.Toolpath.MoveStore import MoveStore
 from pycam.Geometry.PointUtils import padd, psub, pmul, pdist, pnear, \
         ptransform_by_matrix
 from pycam.Geometry.Line import Line
@@ -33,6 +37,10 @@ import pycam.Utils.log
 
 
 MAX_DIGITS = 12
+# an arc needs to replace at least this number of straight moves
+ARC_MIN_SEGMENTS = 3
+# avoid ambiguous (almost) full circles
+ARC_MAX_SWEEP = 1.5 * math.pi
 
 _log = pycam.Utils.log.get_logger()
 
@@ -44,6 +52,15 @@ Each action is described by a tuple of (TYPE, ARGUMENTS).
 TYPE is usually one of MOVE_STRAIGHT, MOVE_RAPID and MOVE_SAFETY.
 The other possible types describe machine settings and so on.
 ARGUMENTS (in case of moves) is a tuple of x/y/z for the move's destination.
+
+Filters implement either "filter_toolpath" (operating on a list of moves) or
+"iter_filter" (a generator stage consuming any iterable of moves). The latter
+allows to chain filters without copying the toolpath for every step (see
+"iter_filtered_moves").
+
+Filters may implement "filter_move_store" additionally. This method is used
+for toolpaths stored in a compact pycam.Toolpath.MoveStore. It operates on the
+columns directly and returns a new MoveStore.
 """
 
 
@@ -73,15 +90,33 @@ def toolpath_filter(our_category, key):
     return toolpath_filter_inner
 
 
-def get_filtered_moves(moves, filters):
+def iter_filtered_moves(moves, filters):
+    """ compose the given filters lazily
+
+    The moves are processed one by one while the result is consumed. Thus a
+    toolpath can be exported with constant memory (except for filters that
+    need to see the complete toolpath).
+    Leading filters are applied to a compact MoveStore directly, if possible.
+    """
     filters = list(filters)
-    moves = list(moves)
     filters.sort()
+    if isinstance(moves, MoveStore):
+        while filters and hasattr(filters[0], "filter_move_store"):
+            moves = filters.pop(0).filter_move_store(moves)
     for one_filter in filters:
-        moves |= one_filter
+        _log.debug("Applying toolpath filter: %s" % one_filter.__class__)
+        moves = one_filter.iter_filter(moves)
     return moves
 
 
+def get_filtered_moves(moves, filters):
+    moves = iter_filtered_moves(moves, filters)
+    if isinstance(moves, MoveStore):
+        return moves
+    else:
+        return list(moves)
+
+
 class BaseFilter(object):
 
     PARAMS = []
@@ -110,9 +145,11 @@ class BaseFilter(object):
         # allow to use pycam.Toolpath.Toolpath instances (instead of a list)
         if hasattr(toolpath, "path") and hasattr(toolpath, "filters"):
             toolpath = toolpath.path
-        # use a copy of the list -> changes will be permitted
         _log.debug("Applying toolpath filter: %s" % self.__class__)
-        return self.filter_toolpath(list(toolpath))
+        if isinstance(toolpath, MoveStore) and \
+                hasattr(self, "filter_move_store"):
+            return self.filter_move_store(toolpath)
+        return list(self.iter_filter(toolpath))
 
     def __repr__(self):
         class_name = str(self.__class__).split("'")[1].split(".")[-1]
@@ -131,8 +168,20 @@ class BaseFilter(object):
                 for key in self.settings])
 
     def filter_toolpath(self, toolpath):
-        raise NotImplementedError("The filter class %s failed to " + \
-                "implement the 'filter_toolpath' method" % str(type(self)))
+        if self.__class__.iter_filter.im_func is BaseFilter.iter_filter.im_func:
+            raise NotImplementedError(("The filter class %s failed to " + \
+                    "implement the 'filter_toolpath' or 'iter_filter' " + \
+                    "method") % str(type(self)))
+        return list(self.iter_filter(toolpath))
+
+    def iter_filter(self, moves):
+        """ generator stage: yield the filtered moves one by one
+
+        This default implementation collects all moves for "filter_toolpath".
+        """
+        # use a copy of the list -> changes will be permitted
+        for item in self.filter_toolpath(list(moves)):
+            yield item
 
 
 class SafetyHeightFilter(BaseFilter):
@@ -140,14 +189,13 @@ class SafetyHeightFilter(BaseFilter):
     PARAMS = ("safety_height", )
     WEIGHT = 80
 
-    def filter_toolpath(self, toolpath):
+    def iter_filter(self, moves):
         last_pos = None
         max_height = None
-        new_path = []
         safety_pending = False
         get_safe = lambda pos: tuple((pos[0], pos[1],
                 self.settings["safety_height"]))
-        for move_type, args in toolpath:
+        for move_type, args in moves:
             if move_type == MOVE_SAFETY:
                 safety_pending = True
             elif move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
@@ -156,7 +204,7 @@ class SafetyHeightFilter(BaseFilter):
                 if not last_pos:
                     # there was a safety move (or no move at all) before
                     # -> move sideways
-                    new_path.append((MOVE_STRAIGHT_RAPID, get_safe(new_pos)))
+                    yield (MOVE_STRAIGHT_RAPID, get_safe(new_pos))
                 elif safety_pending:
                     safety_pending = False
                     if pnear(last_pos, new_pos, axes=(0, 1)):
@@ -164,25 +212,22 @@ class SafetyHeightFilter(BaseFilter):
                         pass
                     else:
                         # go up, sideways and down
-                        new_path.append((MOVE_STRAIGHT_RAPID,
-                                get_safe(last_pos)))
-                        new_path.append((MOVE_STRAIGHT_RAPID,
-                                get_safe(new_pos)))
+                        yield (MOVE_STRAIGHT_RAPID, get_safe(last_pos))
+                        yield (MOVE_STRAIGHT_RAPID, get_safe(new_pos))
                 else:
                     # we are in the middle of usual moves -> keep going
                     pass
-                new_path.append((move_type, new_pos))
+                yield (move_type, new_pos)
                 last_pos = new_pos
             else:
                 # unknown move -> keep it
-                new_path.append((move_type, args))
+                yield (move_type, args)
         # process pending safety moves
         if safety_pending and last_pos:
-            new_path.append((MOVE_STRAIGHT_RAPID, get_safe(last_pos)))
+            yield (MOVE_STRAIGHT_RAPID, get_safe(last_pos))
         if max_height > self.settings["safety_height"]:
             _log.warn("Toolpath exceeds safety height: %f => %f" % \
                     (max_height, self.settings["safety_height"]))
-        return new_path
 
 
 class MachineSetting(BaseFilter):
@@ -190,15 +235,23 @@ class MachineSetting(BaseFilter):
     PARAMS = ("key", "value")
     WEIGHT = 20
 
-    def filter_toolpath(self, toolpath):
-        result = []
+    def iter_filter(self, moves):
+        moves = iter(moves)
+        first_other = None
         # move all previous machine settings
-        while toolpath and toolpath[0][0] == MACHINE_SETTING:
-            result.append(toolpath.pop(0))
+        for item in moves:
+            if item[0] == MACHINE_SETTING:
+                yield item
+            else:
+                first_other = item
+                break
         # add the new setting
         for setting in self._get_settings():
-            result.append((MACHINE_SETTING, setting))
-        return result + toolpath
+            yield (MACHINE_SETTING, setting)
+        if not first_other is None:
+            yield first_other
+        for item in moves:
+            yield item
 
     def _get_settings(self):
         return [(self.settings["key"], self.settings["value"])]
@@ -218,7 +271,7 @@ class PathMode(MachineSetting):
                     self.settings["naive_tolerance"]))]
 
     def _render_settings(self):
-        return "%d / %d / %d" % (self.settings["path_mode"],
+        return "%d / %s / %s" % (self.settings["path_mode"],
                 self.settings["motion_tolerance"],
                 self.settings["naive_tolerance"])
 
@@ -228,15 +281,19 @@ class SelectTool(BaseFilter):
     PARAMS = ("tool_id", )
     WEIGHT = 35
 
-    def filter_toolpath(self, toolpath):
-        index = 0
+    def iter_filter(self, moves):
+        moves = iter(moves)
         # skip all non-moves
-        while (index < len(toolpath)) and \
-                (not toolpath[0][0] in MOVES_LIST):
-            index += 1
-        toolpath.insert(index, (MACHINE_SETTING,
-                ("select_tool", self.settings["tool_id"])))
-        return toolpath
+        for move_type, args in moves:
+            if move_type in MOVES_LIST:
+                yield (MACHINE_SETTING,
+                        ("select_tool", self.settings["tool_id"]))
+                yield (move_type, args)
+                break
+            else:
+                yield (move_type, args)
+        for item in moves:
+            yield item
 
 
 class TriggerSpindle(BaseFilter):
@@ -244,33 +301,147 @@ class TriggerSpindle(BaseFilter):
     PARAMS = ("delay", )
     WEIGHT = 40
 
-    def filter_toolpath(self, toolpath):
-        def enable_spindle(path, index):
-            path.insert(index, (MACHINE_SETTING, ("spindle_enabled", True)))
-            if self.settings["delay"]:
-                path.insert(index + 1,
+    def iter_filter(self, moves):
+        enable_spindle = [(MACHINE_SETTING, ("spindle_enabled", True))]
+        if self.settings["delay"]:
+            enable_spindle.append(
                     (MACHINE_SETTING, ("delay", self.settings["delay"])))
-        def disable_spindle(path, index):
-            path.insert(index, (MACHINE_SETTING, ("spindle_enabled", False)))
-        # find all positions of "select_tool"
-        tool_changes = [index for index, (move, args) in enumerate(toolpath)
-                if (move == MACHINE_SETTING) and (args[0] == "select_tool")]
-        if tool_changes:
-            tool_changes.reverse()
-            for index in tool_changes:
-                enable_spindle(toolpath, index + 1)
+        spindle_enabled = False
+        any_move = False
+        # "stop spindle" is added just after the last move - thus we need to
+        # hold back all items following the latest move
+        pending = []
+        for item in moves:
+            move_type, args = item
+            if move_type in MOVES_LIST:
+                for pending_item in pending:
+                    yield pending_item
+                pending = []
+                if not spindle_enabled:
+                    # no tool change before the first move
+                    for setting in enable_spindle:
+                        yield setting
+                    spindle_enabled = True
+                yield item
+                any_move = True
+            else:
+                if (move_type == MACHINE_SETTING) and \
+                        (args[0] == "select_tool"):
+                    # start the spindle after every tool change
+                    new_items = [item] + enable_spindle
+                    spindle_enabled = True
+                else:
+                    new_items = [item]
+                if any_move:
+                    pending.extend(new_items)
+                else:
+                    for new_item in new_items:
+                        yield new_item
+        if any_move:
+            yield (MACHINE_SETTING, ("spindle_enabled", False))
+        for item in pending:
+            yield item
+
+
+def _is_separated(a1, a2, b1, b2):
+    """ check if the points b1 and b2 are clearly on the same side of the line
+    through a1 and a2 (xy plane)
+    """
+    dx, dy = a2[0] - a1[0], a2[1] - a1[1]
+    tolerance = epsilon * (abs(dx) + abs(dy) + 1)
+    side1 = dx * (b1[1] - a1[1]) - dy * (b1[0] - a1[0])
+    side2 = dx * (b2[1] - a1[1]) - dy * (b2[0] - a1[0])
+    return ((side1 > tolerance) and (side2 > tolerance)) or \
+            ((side1 < -tolerance) and (side2 < -tolerance))
+
+
+class _PolygonCropIndex(object):
+    """ uniform grid of the edges of a polygon within the xy plane
+
+    Lines that do not come close to any edge are classified (inside or
+    outside) with a single lookup. Only lines crossing the outline (or
+    polygons that are not parallel to the xy plane) are split via
+    Polygon.split_line.
+    """
+
+    def __init__(self, polygon):
+        self.polygon = polygon
+        self.cells = None
+        normal = polygon.plane.n
+        if not polygon.is_closed or (abs(normal[0]) > epsilon) or \
+                (abs(normal[1]) > epsilon):
+            return
+        self.edges = [((line.p1[0], line.p1[1]), (line.p2[0], line.p2[1]))
+                for line in polygon.get_lines()]
+        points = polygon.get_points()
+        self.minx = min([p[0] for p in points])
+        self.maxx = max([p[0] for p in points])
+        self.miny = min([p[1] for p in points])
+        self.maxy = max([p[1] for p in points])
+        self.z = polygon.plane.p[2]
+        cells_per_axis = max(1, int(math.sqrt(len(self.edges))))
+        self.cell_size = max(self.maxx - self.minx, self.maxy - self.miny) \
+                / cells_per_axis
+        if self.cell_size < epsilon:
+            return
+        self.cells = {}
+        # the inside/outside state of cells without edges
+        self.cell_states = {}
+        for index, (p1, p2) in enumerate(self.edges):
+            for key in self._get_cell_keys(p1, p2):
+                self.cells.setdefault(key, []).append(index)
+
+    def _get_cell_key(self, x, y):
+        return (int(math.floor((x - self.minx) / self.cell_size)),
+                int(math.floor((y - self.miny) / self.cell_size)))
+
+    def _get_cell_keys(self, p1, p2):
+        low = self._get_cell_key(min(p1[0], p2[0]) - epsilon,
+                min(p1[1], p2[1]) - epsilon)
+        high = self._get_cell_key(max(p1[0], p2[0]) + epsilon,
+                max(p1[1], p2[1]) + epsilon)
+        return [(x, y) for x in range(low[0], high[0] + 1)
+                for y in range(low[1], high[1] + 1)]
+
+    def _is_point_inside(self, x, y):
+        key = self._get_cell_key(x, y)
+        if key in self.cells:
+            return self.polygon.is_point_inside((x, y, self.z))
+        if not key in self.cell_states:
+            # the complete cell is on one side of the outline
+            self.cell_states[key] = self.polygon.is_point_inside(
+                    (self.minx + (key[0] + 0.5) * self.cell_size,
+                        self.miny + (key[1] + 0.5) * self.cell_size, self.z))
+        return self.cell_states[key]
+
+    def get_inner_lines(self, line):
+        """ return the same result as the "inner" part of Polygon.split_line
+        """
+        if self.cells is None:
+            return self.polygon.split_line(line)[0]
+        p1, p2 = line.p1, line.p2
+        if (p1[0] == p2[0]) and (p1[1] == p2[1]):
+            # the projection of the line is a point
+            return []
+        if (max(p1[0], p2[0]) < self.minx - epsilon) or \
+                (min(p1[0], p2[0]) > self.maxx + epsilon) or \
+                (max(p1[1], p2[1]) < self.miny - epsilon) or \
+                (min(p1[1], p2[1]) > self.maxy + epsilon):
+            # outside of the bounding box
+            return []
+        candidates = set()
+        for key in self._get_cell_keys(p1, p2):
+            candidates.update(self.cells.get(key, ()))
+        for index in candidates:
+            e1, e2 = self.edges[index]
+            if not (_is_separated(e1, e2, p1, p2) or \
+                    _is_separated(p1, p2, e1, e2)):
+                # the line (probably) crosses the outline
+                return self.polygon.split_line(line)[0]
+        if self._is_point_inside(0.5 * (p1[0] + p2[0]), 0.5 * (p1[1] + p2[1])):
+            return [line]
         else:
-            for index, (move_type, args) in enumerate(toolpath):
-                if move_type in MOVES_LIST:
-                    enable_spindle(toolpath, index)
-                    break
-        # add "stop spindle" just after the last move
-        index = len(toolpath) - 1
-        while (not toolpath[index][0] in MOVES_LIST) and (index > 0):
-            index -= 1
-        if toolpath[index][0] in MOVES_LIST:
-            disable_spindle(toolpath, index + 1)
-        return toolpath
+            return []
 
 
 class Crop(BaseFilter):
@@ -278,29 +449,30 @@ class Crop(BaseFilter):
     PARAMS = ("polygons", )
     WEIGHT = 90
 
-    def filter_toolpath(self, toolpath):
-        new_path = []
+    def iter_filter(self, moves):
         last_pos = None
         optional_moves = []
-        for move_type, args in toolpath:
+        indexes = [_PolygonCropIndex(polygon)
+                for polygon in self.settings["polygons"]]
+        for move_type, args in moves:
             if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
                 if last_pos:
                     # find all remaining pieces of this line
                     inner_lines = []
-                    for polygon in self.settings["polygons"]:
-                        inner, outer = polygon.split_line(Line(last_pos, args))
-                        inner_lines.extend(inner)
+                    line = Line(last_pos, args)
+                    for index in indexes:
+                        inner_lines.extend(index.get_inner_lines(line))
                     # turn these lines into moves
                     for line in inner_lines:
                         if pdist(line.p1, last_pos) > epsilon:
-                            new_path.append((MOVE_SAFETY, None))
-                            new_path.append((move_type, line.p1))
+                            yield (MOVE_SAFETY, None)
+                            yield (move_type, line.p1)
                         else:
                             # we continue were we left
-                            if optional_moves:
-                                new_path.extend(optional_moves)
-                                optional_moves = []
-                        new_path.append((move_type, line.p2))
+                            for item in optional_moves:
+                                yield item
+                            optional_moves = []
+                        yield (move_type, line.p2)
                         last_pos = line.p2
                     optional_moves = []
                     # finish the line by moving to its end (if necessary)
@@ -311,8 +483,7 @@ class Crop(BaseFilter):
             elif move_type == MOVE_SAFETY:
                 optional_moves = []
             else:
-                new_path.append((move_type, args))
-        return new_path
+                yield (move_type, args)
 
 
 class TransformPosition(BaseFilter):
@@ -322,15 +493,22 @@ class TransformPosition(BaseFilter):
     PARAMS = ("matrix", )
     WEIGHT = 85
 
-    def filter_toolpath(self, toolpath):
-        new_path = []
-        for move_type, args in toolpath:
+    def iter_filter(self, moves):
+        matrix = self.settings["matrix"]
+        for move_type, args in moves:
             if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
-                new_pos = ptransform_by_matrix(args, self.settings["matrix"])
-                new_path.append((move_type, new_pos))
+                yield (move_type, ptransform_by_matrix(args, matrix))
             else:
-                new_path.append((move_type, args))
-        return new_path
+                yield (move_type, args)
+
+    def filter_move_store(self, store):
+        mask = store.get_position_mask()
+        # accept 3x3 matrices as well as 3x4 matrices
+        matrix = numpy.array([list(row[:4]) + [0] * (4 - len(row))
+                for row in self.settings["matrix"]], dtype=numpy.float64)
+        positions = store.get_positions(mask)
+        new_positions = numpy.dot(positions, matrix[:, :3].T) + matrix[:, 3]
+        return store.replace_positions(new_positions, mask)
 
 
 class TimeLimit(BaseFilter):
@@ -341,13 +519,12 @@ class TimeLimit(BaseFilter):
     PARAMS = ("timelimit", )
     WEIGHT = 100
 
-    def filter_toolpath(self, toolpath):
+    def iter_filter(self, moves):
         feedrate = min_feedrate = 1
-        new_path = []
         last_pos = None
         limit = self.settings["timelimit"]
         duration = 0
-        for move_type, args in toolpath:
+        for move_type, args in moves:
             if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
                 if last_pos:
                     new_distance = pdist(args, last_pos)
@@ -361,13 +538,12 @@ class TimeLimit(BaseFilter):
                         duration += new_duration
                 else:
                     destination = args
-                new_path.append((move_type, destination))
+                yield (move_type, destination)
                 last_pos = args
             if (move_type == MACHINE_SETTING) and (args[0] == "feedrate"):
                 feedrate = args[1]
             if duration >= limit:
                 break
-        return new_path
 
 
 class MovesOnly(BaseFilter):
@@ -377,16 +553,548 @@ class MovesOnly(BaseFilter):
 
     WEIGHT = 95
 
-    def filter_toolpath(self, toolpath):
-        return [item for item in toolpath
-                if item[0] in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID)]
+    def iter_filter(self, moves):
+        for item in moves:
+            if item[0] in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+                yield item
+
+    def filter_move_store(self, store):
+        move_types = store.get_move_types()
+        return store.select(store.get_position_mask() & \
+                ((move_types == MOVE_STRAIGHT) \
+                    | (move_types == MOVE_STRAIGHT_RAPID)))
 
 class Copy(BaseFilter):
 
     WEIGHT = 100
 
-    def filter_toolpath(self, toolpath):
-        return toolpath
+    def iter_filter(self, moves):
+        for item in moves:
+            yield item
+
+
+def _get_simplified_indices(points, tolerance):
+    """ Douglas-Peucker simplification of a polyline
+
+    @value points: the points of the polyline
+    @type points: list of x/y/z tuples
+    @value tolerance: the maximum allowed deviation of a removed point from
+        the simplified polyline
+    @type tolerance: float
+    @returns: the (ascending) indices of the remaining points
+    @rtype: list of int
+    """
+    count = len(points)
+    if count < 3:
+        return range(count)
+    points = numpy.array(points, dtype=numpy.float64)
+    keep = numpy.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    # use a stack instead of recursion (long paths would exceed the limit)
+    pending = [(0, count - 1)]
+    while pending:
+        start, end = pending.pop()
+        if end - start < 2:
+            continue
+        inner = points[start + 1:end] - points[start]
+        direction = points[end] - points[start]
+        length_square = numpy.dot(direction, direction)
+        if length_square > epsilon ** 2:
+            # Use the distance to the segment (not to the infinite line).
+            # Otherwise reversals along a line (zigzag) would be removed.
+            factors = numpy.clip(numpy.dot(inner, direction) / length_square,
+                    0, 1)
+            inner -= factors[:, numpy.newaxis] * direction
+        distances = numpy.sqrt((inner * inner).sum(axis=1))
+        index = distances.argmax()
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            pending.append((start, split))
+            pending.append((split, end))
+    return numpy.nonzero(keep)[0].tolist()
+
+
+class SimplifyToolpath(BaseFilter):
+    """ remove points from sequences of straight moves as long as the
+    simplified path deviates less than the given tolerance from the original
+    path (Douglas-Peucker algorithm)
+    """
+
+    PARAMS = ("tolerance", )
+    WEIGHT = 55
+
+    def iter_filter(self, moves):
+        tolerance = self.settings["tolerance"]
+        run_type = None
+        run = []
+        for move_type, args in moves:
+            if (move_type == run_type):
+                run.append(args)
+                continue
+            # a sequence of moves of the same type ends here
+            for index in _get_simplified_indices(run, tolerance):
+                yield (run_type, run[index])
+            if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+                run_type = move_type
+                run = [args]
+            else:
+                run_type = None
+                run = []
+                yield (move_type, args)
+        for index in _get_simplified_indices(run, tolerance):
+            yield (run_type, run[index])
+
+
+def _fit_arc(points, start, end, tolerance):
+    """ check if the points between "start" and "end" describe an arc
+
+    The circle is defined by the first, the middle and the last point. All
+    points need to be located on this circle (within the tolerance). The
+    same applies to the straight lines between the points (sagitta).
+    @returns: None (no arc) or the center (x/y) and the direction (clockwise)
+    @rtype: None | tuple
+    """
+    p1, p2, p3 = points[start], points[(start + end) // 2], points[end]
+    # arcs are only located in the xy plane
+    for point in points[start + 1:end + 1]:
+        if abs(point[2] - p1[2]) > epsilon:
+            return None
+    # the center of the circle through p1, p2 and p3
+    divisor = 2 * (p1[0] * (p2[1] - p3[1]) + p2[0] * (p3[1] - p1[1]) \
+            + p3[0] * (p1[1] - p2[1]))
+    if abs(divisor) < epsilon:
+        return None
+    square1 = p1[0] ** 2 + p1[1] ** 2
+    square2 = p2[0] ** 2 + p2[1] ** 2
+    square3 = p3[0] ** 2 + p3[1] ** 2
+    center_x = (square1 * (p2[1] - p3[1]) + square2 * (p3[1] - p1[1]) \
+            + square3 * (p1[1] - p2[1])) / divisor
+    center_y = (square1 * (p3[0] - p2[0]) + square2 * (p1[0] - p3[0]) \
+            + square3 * (p2[0] - p1[0])) / divisor
+    radius = math.hypot(p1[0] - center_x, p1[1] - center_y)
+    # points on a straight line should stay straight moves
+    chord_x, chord_y = p3[0] - p1[0], p3[1] - p1[1]
+    chord_length = math.hypot(chord_x, chord_y)
+    if chord_length > epsilon:
+        max_deviation = max([abs((point[0] - p1[0]) * chord_y \
+                    - (point[1] - p1[1]) * chord_x) / chord_length
+                for point in points[start + 1:end]])
+        if max_deviation <= tolerance:
+            return None
+    sweep = 0
+    previous = (p1[0] - center_x, p1[1] - center_y)
+    for point in points[start + 1:end + 1]:
+        current = (point[0] - center_x, point[1] - center_y)
+        if abs(math.hypot(current[0], current[1]) - radius) > tolerance:
+            return None
+        half_chord = min(radius, 0.5 * math.hypot(current[0] - previous[0],
+                current[1] - previous[1]))
+        if radius - math.sqrt(radius ** 2 - half_chord ** 2) > tolerance:
+            return None
+        angle = math.atan2(previous[0] * current[1] - previous[1] * current[0],
+                previous[0] * current[0] + previous[1] * current[1])
+        if angle * sweep < 0:
+            # the direction changed
+            return None
+        sweep += angle
+        previous = current
+    if not (epsilon < abs(sweep) < ARC_MAX_SWEEP):
+        return None
+    return (center_x, center_y), sweep < 0
+
+
+def _find_arc(points, start, tolerance):
+    """ find the longest arc starting at "start"
+
+    The number of points is increased exponentially until the fit fails.
+    Then a binary search determines the final end of the arc.
+    @returns: None or the index of the arc's destination point and the result
+        of "_fit_arc"
+    """
+    good = start + ARC_MIN_SEGMENTS
+    if good >= len(points):
+        return None
+    arc = _fit_arc(points, start, good, tolerance)
+    if arc is None:
+        return None
+    bad = None
+    step = ARC_MIN_SEGMENTS
+    while good < len(points) - 1:
+        candidate = min(good + step, len(points) - 1)
+        candidate_arc = _fit_arc(points, start, candidate, tolerance)
+        if candidate_arc is None:
+            bad = candidate
+            break
+        good, arc = candidate, candidate_arc
+        step *= 2
+    while (not bad is None) and (bad - good > 1):
+        middle = (good + bad) // 2
+        middle_arc = _fit_arc(points, start, middle, tolerance)
+        if middle_arc is None:
+            bad = middle
+        else:
+            good, arc = middle, middle_arc
+    return good, arc
+
+
+class FitArcs(BaseFilter):
+    """ replace sequences of short straight moves approximating a circle with
+    arc moves (MOVE_ARC) within the xy plane
+
+    This reduces the size of the GCode and relieves the look-ahead buffer of
+    the machine controller. The arguments of an arc move are the destination,
+    the center (x/y) and the direction (clockwise).
+    """
+
+    PARAMS = ("tolerance", )
+    WEIGHT = 92
+
+    def iter_filter(self, moves):
+        tolerance = self.settings["tolerance"]
+        # [number of replaced straight moves, number of arcs]
+        stats = [0, 0]
+        last_pos = None
+        anchor = None
+        run = []
+        for move_type, args in moves:
+            if move_type == MOVE_STRAIGHT:
+                if not run:
+                    anchor = last_pos
+                run.append(tuple(args))
+                last_pos = run[-1]
+                continue
+            for item in self._fit_run(anchor, run, tolerance, stats):
+                yield item
+            run = []
+            if move_type == MOVE_STRAIGHT_RAPID:
+                last_pos = tuple(args)
+            elif move_type == MOVE_ARC:
+                last_pos = tuple(args[0])
+            elif move_type == MOVE_SAFETY:
+                last_pos = None
+            yield (move_type, args)
+        for item in self._fit_run(anchor, run, tolerance, stats):
+            yield item
+        if stats[1] > 0:
+            _log.info("Arc fitting: replaced %d straight moves with %d arcs" \
+                    % tuple(stats))
+
+    def _fit_run(self, anchor, run, tolerance, stats):
+        if not run:
+            return
+        if anchor is None:
+            # we don't know where the first move starts
+            yield (MOVE_STRAIGHT, run[0])
+            points = run
+        else:
+            points = [anchor] + run
+        index = 0
+        while index < len(points) - 1:
+            result = _find_arc(points, index, tolerance)
+            if result is None:
+                yield (MOVE_STRAIGHT, points[index + 1])
+                index += 1
+            else:
+                end, (center, clockwise) = result
+                yield (MOVE_ARC, (points[end], center, clockwise))
+                stats[0] += end - index
+                stats[1] += 1
+                index = end
+
+
+class _PointIndex(object):
+    """ uniform grid of points (xy plane) supporting removal and a nearest
+    neighbour search
+    """
+
+    def __init__(self, points):
+        self.minx = min([p[0] for p in points])
+        self.miny = min([p[1] for p in points])
+        width = max([p[0] for p in points]) - self.minx
+        height = max([p[1] for p in points]) - self.miny
+        # about one point per cell
+        self.cell_size = max(math.sqrt(width * height / len(points)),
+                width / len(points), height / len(points), epsilon)
+        self.max_key = self._get_key((self.minx + width, self.miny + height))
+        self.cells = {}
+        self.count = 0
+
+    def _get_key(self, point):
+        return (int(math.floor((point[0] - self.minx) / self.cell_size)),
+                int(math.floor((point[1] - self.miny) / self.cell_size)))
+
+    def add(self, item, point):
+        self.cells.setdefault(self._get_key(point), []).append((item, point))
+        self.count += 1
+
+    def _iter_ring(self, center, radius):
+        """ return the keys of all cells within the grid with the given
+        (chebyshev) distance from the center cell
+        """
+        low_x = max(0, center[0] - radius)
+        high_x = min(self.max_key[0], center[0] + radius)
+        low_y = max(0, center[1] - radius)
+        high_y = min(self.max_key[1], center[1] + radius)
+        # the upper and lower row
+        for y in (center[1] - radius, center[1] + radius):
+            if low_y <= y <= high_y:
+                for x in range(low_x, high_x + 1):
+                    yield (x, y)
+            if radius == 0:
+                return
+        # the left and right column (without the corners)
+        for x in (center[0] - radius, center[0] + radius):
+            if low_x <= x <= high_x:
+                for y in range(max(low_y, center[1] - radius + 1),
+                        min(high_y, center[1] + radius - 1) + 1):
+                    yield (x, y)
+
+    def pop_nearest(self, point):
+        if self.count == 0:
+            return None
+        center = self._get_key(point)
+        # the rings closer to the center do not touch the grid
+        min_radius = max(-center[0], center[0] - self.max_key[0],
+                -center[1], center[1] - self.max_key[1], 0)
+        max_radius = max(abs(center[0]), abs(center[1]),
+                abs(self.max_key[0] - center[0]),
+                abs(self.max_key[1] - center[1]))
+        best = None
+        for radius in range(min_radius, max_radius + 1):
+            for key in self._iter_ring(center, radius):
+                for entry in self.cells.get(key, ()):
+                    distance = math.hypot(entry[1][0] - point[0],
+                            entry[1][1] - point[1])
+                    if (best is None) or (distance < best[0]):
+                        best = (distance, key, entry)
+            # points outside of the visited cells are farther away
+            if (not best is None) and (best[0] <= radius * self.cell_size):
+                break
+        self.cells[best[1]].remove(best[2])
+        self.count -= 1
+        return best[2][0]
+
+
+def _is_loop_inside(outer, inner):
+    """ check if the closed loop "inner" is located within the closed loop
+    "outer" (xy plane)
+    """
+    x, y = inner[0][0], inner[0][1]
+    crossings = 0
+    for index in range(len(outer) - 1):
+        p1, p2 = outer[index], outer[index + 1]
+        if (p1[1] < y) != (p2[1] < y):
+            if p1[0] + (y - p1[1]) / (p2[1] - p1[1]) * (p2[0] - p1[0]) < x:
+                crossings += 1
+    return crossings % 2 == 1
+
+
+class SortSegments(BaseFilter):
+    """ reorder the independent segments of a toolpath layer in order to
+    reduce the distance of the moves at safety height
+
+    Segments are the sequences of moves between safety moves. Only
+    neighbouring segments located at the same height (layer) and containing
+    only straight moves are reordered. Closed segments surrounding other
+    closed segments of the same layer are processed after these (inner
+    contours first - see pycam.Geometry.Polygon.PolygonSorter).
+    The order is determined by a nearest neighbour search. Afterwards single
+    segments are moved to better positions until the given "improvement_time"
+    (seconds) is over.
+    """
+
+    PARAMS = ("improvement_time", )
+    WEIGHT = 70
+
+    def iter_filter(self, moves):
+        # the segments of the current layer
+        layer = []
+        layer_height = None
+        # the position before the current layer
+        last_pos = None
+        safety_pending = False
+        for segment in self._iter_segments(moves):
+            if segment is None:
+                safety_pending = True
+                continue
+            height = self._get_layer_height(segment)
+            if layer and (not height is None) and (height == layer_height):
+                layer.append(segment)
+                safety_pending = False
+                continue
+            # the current layer is complete
+            for item in self._get_sorted_layer(layer, last_pos):
+                yield item
+            if layer:
+                last_pos = self._get_last_position(layer[-1], last_pos)
+                layer = []
+            if safety_pending:
+                yield (MOVE_SAFETY, None)
+                safety_pending = False
+            if height is None:
+                # keep this segment as it is
+                for item in segment:
+                    yield item
+                last_pos = self._get_last_position(segment, last_pos)
+            else:
+                layer = [segment]
+                layer_height = height
+        for item in self._get_sorted_layer(layer, last_pos):
+            yield item
+        if safety_pending:
+            yield (MOVE_SAFETY, None)
+
+    def _iter_segments(self, moves):
+        """ yield the sequences of moves between safety moves (lists) and
+        None for every safety move
+        """
+        segment = []
+        for item in moves:
+            if item[0] == MOVE_SAFETY:
+                if segment:
+                    yield segment
+                    segment = []
+                yield None
+            else:
+                segment.append(item)
+        if segment:
+            yield segment
+
+    def _get_layer_height(self, segment):
+        """ return the common height of all moves of a segment - or None, if
+        the segment may not be reordered
+        """
+        height = None
+        for move_type, args in segment:
+            if not move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+                return None
+            if height is None:
+                height = args[2]
+            elif abs(args[2] - height) > epsilon:
+                return None
+        return height
+
+    def _get_last_position(self, segment, default):
+        for move_type, args in reversed(segment):
+            if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+                return args
+        return default
+
+    def _get_sorted_layer(self, layer, last_pos):
+        """ yield the moves of all segments (separated by safety moves) """
+        if len(layer) > 2:
+            order = self._get_order(layer, last_pos)
+            layer[:] = [layer[index] for index in order]
+        for index, segment in enumerate(layer):
+            if index > 0:
+                yield (MOVE_SAFETY, None)
+            for item in segment:
+                yield item
+
+    def _get_order(self, layer, last_pos):
+        starts = [segment[0][1] for segment in layer]
+        ends = [segment[-1][1] for segment in layer]
+        # inner closed segments need to be processed before outer ones
+        parents = [[] for segment in layer]
+        pending_children = [0] * len(layer)
+        loops = [index for index, segment in enumerate(layer)
+                if (len(segment) > 2) and pnear(starts[index], ends[index])]
+        points = dict([(index, [args for move_type, args in layer[index]])
+                for index in loops])
+        for outer in loops:
+            for inner in loops:
+                if (inner != outer) and \
+                        _is_loop_inside(points[outer], points[inner]) and \
+                        not _is_loop_inside(points[inner], points[outer]):
+                    parents[inner].append(outer)
+                    pending_children[outer] += 1
+        index = _PointIndex(starts)
+        for segment_index in range(len(layer)):
+            if pending_children[segment_index] == 0:
+                index.add(segment_index, starts[segment_index])
+        order = []
+        position = last_pos or starts[0]
+        while index.count > 0:
+            current = index.pop_nearest(position)
+            order.append(current)
+            position = ends[current]
+            for parent in parents[current]:
+                pending_children[parent] -= 1
+                if pending_children[parent] == 0:
+                    index.add(parent, starts[parent])
+        if len(order) < len(layer):
+            # cyclic containment (e.g. overlapping loops) - keep the order
+            return range(len(layer))
+        if self.settings["improvement_time"] > 0:
+            self._improve_order(order, starts, ends, parents, last_pos)
+        return order
+
+    def _improve_order(self, order, starts, ends, parents, last_pos):
+        """ move single segments to a better position within the order
+
+        The segments keep their direction (milling style). Thus the usual
+        2-opt (reversing partial sequences) is not applicable.
+        """
+        get_distance = lambda p1, p2: math.hypot(p1[0] - p2[0], p1[1] - p2[1])
+        def get_cost(previous, segment, following):
+            cost = 0
+            if not previous is None:
+                cost += get_distance(ends[previous], starts[segment])
+            elif not last_pos is None:
+                cost += get_distance(last_pos, starts[segment])
+            if not following is None:
+                cost += get_distance(ends[segment], starts[following])
+            return cost
+        def get_gap(previous, following):
+            if following is None:
+                return 0
+            elif not previous is None:
+                return get_distance(ends[previous], starts[following])
+            elif not last_pos is None:
+                return get_distance(last_pos, starts[following])
+            else:
+                return 0
+        children = [[] for item in order]
+        for child, child_parents in enumerate(parents):
+            for parent in child_parents:
+                children[parent].append(child)
+        finish_time = time.time() + self.settings["improvement_time"]
+        improved = True
+        while improved and (time.time() < finish_time):
+            improved = False
+            for position in range(len(order)):
+                if time.time() >= finish_time:
+                    break
+                segment = order[position]
+                previous = order[position - 1] if position > 0 else None
+                following = order[position + 1] \
+                        if position + 1 < len(order) else None
+                gain = get_cost(previous, segment, following) \
+                        - get_gap(previous, following)
+                remaining = order[:position] + order[position + 1:]
+                positions = dict([(item, index)
+                        for index, item in enumerate(remaining)])
+                # the new position needs to respect the inner-first rule
+                lowest = max([positions[child] + 1
+                        for child in children[segment]] + [0])
+                highest = min([positions[parent]
+                        for parent in parents[segment]] + [len(remaining)])
+                best = None
+                for new_position in range(lowest, highest + 1):
+                    before = remaining[new_position - 1] \
+                            if new_position > 0 else None
+                    after = remaining[new_position] \
+                            if new_position < len(remaining) else None
+                    cost = get_cost(before, segment, after) \
+                            - get_gap(before, after)
+                    if cost < gain - epsilon and \
+                            ((best is None) or (cost < best[0])):
+                        best = (cost, new_position)
+                if not best is None:
+                    remaining.insert(best[1], segment)
+                    order[:] = remaining
+                    improved = True
 
 
 def _get_num_of_significant_digits(number):
@@ -409,50 +1117,85 @@ def _get_num_of_significant_digits(number):
             return MAX_DIGITS
 
 
-def _get_num_converter(step_width):
-    """ Return a float-to-decimal conversion function with a prevision suitable
-    for the given step width.
+def get_number_format(step_width):
+    """ Return a format string with a precision suitable for the given step
+    width. This is used by the GCode generators for rendering coordinates.
     """
-    digits = _get_num_of_significant_digits(step_width)
-    format_string = "%%.%df" % digits
-    conv_func = lambda number: decimal.Decimal(format_string % number)
-    return conv_func, format_string
-    
+    return "%%.%df" % _get_num_of_significant_digits(step_width)
+
+
+def _get_step_quantizer(step_width):
+    """ Return a function mapping a coordinate to its integer number of step
+    units. Coordinates mapped to the same value are indistinguishable for the
+    machine.
+    Halves are always rounded up - exactly like in "filter_move_store".
+    """
+    if step_width > 0:
+        return lambda value: math.floor(value / step_width + 0.5)
+    else:
+        # no quantization at all
+        return lambda value: value
+
 
 class StepWidth(BaseFilter):
+    """ Remove moves that are too short for the resolution of the machine.
+
+    All positions are quantized to integer multiples of the step width of each
+    axis. A move is skipped, if its quantized destination is identical to the
+    destination of the previous move. The positions are not changed - the
+    generator renders them with a suitable precision (see the machine setting
+    "step_width" emitted by this filter).
+    """
 
     PARAMS = ("step_width_x", "step_width_y", "step_width_z")
     NUM_OF_AXES = 3
     WEIGHT = 60
 
-    def filter_toolpath(self, toolpath):
-        minimum_steps = []
-        conv = []
-        for key in "xyz":
-            minimum_steps.append(self.settings["step_width_%s" % key])
-        for step_width in minimum_steps:
-            conv.append(_get_num_converter(step_width)[0])
-        last_pos = None
-        path = []
-        for move_type, args in toolpath:
+    def _get_step_widths(self):
+        return tuple([self.settings["step_width_%s" % key] for key in "xyz"])
+
+    def iter_filter(self, moves):
+        step_widths = self._get_step_widths()
+        quantizers = [_get_step_quantizer(step) for step in step_widths]
+        quant_x, quant_y, quant_z = quantizers
+        yield (MACHINE_SETTING, ("step_width", step_widths))
+        last_key = None
+        for move_type, args in moves:
             if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
-                if last_pos:
-                    diff = [(abs(conv[i](last_pos[i]) - conv[i](args[i])))
-                            for i in range(3)]
-                    if all([d < lim for d, lim in zip(diff, minimum_steps)]):
-                        # too close: ignore this move
-                        continue
-                # TODO: this would also change the GCode output - we want
-                # this, but it sadly breaks other code pieces that rely on
-                # floats instead of decimals at this point. The output
-                # conversion needs to move into the GCode output hook.
-                #destination = [conv[i](args[i]) for i in range(3)]
-                destination = args
-                path.append((move_type, destination))
-                last_pos = args
+                key = (quant_x(args[0]), quant_y(args[1]), quant_z(args[2]))
+                if key == last_key:
+                    # too close: ignore this move
+                    continue
+                yield (move_type, args)
+                last_key = key
             else:
-                # forget "last_pos" - we don't know what happened in between
-                last_pos = None
-                path.append((move_type, args))
-        return path
-
+                # forget "last_key" - we don't know what happened in between
+                last_key = None
+                yield (move_type, args)
+
+    def filter_move_store(self, store):
+        step_widths = self._get_step_widths()
+        move_types = store.get_move_types()
+        positions = store.get_positions()
+        position_mask = store.get_position_mask()
+        steps = numpy.array(step_widths, dtype=numpy.float64)
+        keys = positions.copy()
+        use_steps = steps > 0
+        # same rounding as "_get_step_quantizer" (not "rint": half to even)
+        keys[:, use_steps] = numpy.floor(positions[:, use_steps]
+                / steps[use_steps] + 0.5)
+        # Equality is transitive - thus comparing with the previous move is
+        # the same as comparing with the last non-skipped move.
+        keep = numpy.ones(len(store), dtype=bool)
+        if len(store) > 1:
+            unchanged = (keys[1:] == keys[:-1]).all(axis=1)
+            keep[1:] = ~(unchanged & position_mask[1:] & position_mask[:-1])
+        # prepend the machine setting for the generator
+        payloads = list(store.get_payloads())
+        payload_indices = store.get_payload_indices()[keep]
+        return MoveStore.from_columns(
+                numpy.concatenate(([MACHINE_SETTING], move_types[keep])),
+                numpy.concatenate(([(0.0, 0.0, 0.0)], positions[keep])),
+                payloads=payloads + [("step_width", step_widths)],
+                payload_indices=numpy.concatenate(([len(payloads)],
+                        payload_indices)))
@@ -23,7 +23,6 @@ along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
 from pycam.PathGenerators import DropCutter, PushCutter, EngraveCutter, \
         ContourFollow
 from pycam.Geometry.utils import number
-from pycam.PathProcessors import PolygonCutter, ContourCutter
 from pycam.Cutters.CylindricalCutter import CylindricalCutter
 import pycam.Cutters
 import pycam.Toolpath.SupportGrid
@@ -32,6 +31,7 @@ import pycam.Toolpath
 import pycam.Geometry.Model
 from pycam.Utils import ProgressCounter
 import pycam.Utils.log
+import itertools
 
 log = pycam.Utils.log.get_logger()
 
@@ -44,7 +44,8 @@ PATH_POSTPROCESSORS = frozenset(("ContourCutter", "PathAccumulator",
 CALCULATION_BACKENDS = frozenset((None, "ODE"))
 
 
-def generate_toolpath_from_settings(model, tp_settings, callback=None):
+def generate_toolpath_from_settings(model, tp_settings, callback=None,
+        lazy=False):
     process = tp_settings.get_process_settings()
     support_model = tp_settings.get_support_model()
     backend = tp_settings.get_calculation_backend()
@@ -54,14 +55,15 @@ def generate_toolpath_from_settings(model, tp_settings, callback=None):
             process["material_allowance"], process["overlap_percent"],
             process["step_down"], process["engrave_offset"],
             process["milling_style"], process["pocketing_type"],
-            support_model, backend, callback)
+            support_model, backend, callback, lazy=lazy)
 
 def generate_toolpath(model, tool_settings=None,
         bounds=None, direction="x",
         path_generator="DropCutter", path_postprocessor="ZigZagCutter",
         material_allowance=0, overlap_percent=0, step_down=0, engrave_offset=0,
         milling_style="ignore", pocketing_type="none",
-        support_model=None, calculation_backend=None, callback=None):
+        support_model=None, calculation_backend=None, callback=None,
+        lazy=False):
     """ abstract interface for generating a toolpath
 
     @type model: pycam.Geometry.Model.Model
@@ -95,8 +97,12 @@ def generate_toolpath(model, tool_settings=None,
     @type calculation_backend: str | None
     @value calculation_backend: any member of the CALCULATION_BACKENDS set
         The default is the triangular collision detection.
-    @rtype: pycam.Toolpath.Toolpath | str
-    @return: the resulting toolpath object or an error string in case of invalid
+    @type lazy: bool
+    @value lazy: return an iterator of moves instead of a list. The moves are
+        calculated while the iterator is consumed (only for DropCutter and
+        PushCutter - other strategies return a list).
+    @rtype: list | iterator | str
+    @return: the resulting moves or an error string in case of invalid
         arguments
     """
     log.debug("Starting toolpath generation")
@@ -263,11 +269,14 @@ def generate_toolpath(model, tool_settings=None,
                 (bounds_low, bounds_high), layer_distance, line_stepping,
                 step_width=step_width, grid_direction=direction_dict[direction],
                 milling_style=milling_style_grid[milling_style])
-        if path_generator == "DropCutter":
-            toolpath = generator.GenerateToolPath(motion_grid, minz, maxz,
-                    callback)
+        if lazy:
+            # the moves of each grid line are passed on as soon as possible
+            toolpath = itertools.chain.from_iterable(generator.iter_toolpath(
+                    cutter, trimesh_models, motion_grid, minz=minz,
+                    maxz=maxz, draw_callback=callback))
         else:
-            toolpath = generator.GenerateToolPath(motion_grid, callback)
+            toolpath = generator.GenerateToolPath(cutter, trimesh_models,
+                    motion_grid, minz=minz, maxz=maxz, draw_callback=callback)
     elif path_generator == "EngraveCutter":
         if step_down > 0:
             dz = step_down
@@ -295,33 +304,19 @@ def _get_pathgenerator_instance(trimesh_models, contour_model, cutter,
         return ("The only available toolpath strategy for 2D contour models " \
                 + "is 'Engraving'.")
     if pathgenerator == "DropCutter":
-        if pathprocessor == "ZigZagCutter":
-            processor = PathAccumulator.PathAccumulator(zigzag=True)
-        elif pathprocessor == "PathAccumulator":
-            processor = PathAccumulator.PathAccumulator()
-        else:
+        # the zigzag style is part of the motion grid
+        if not pathprocessor in ("ZigZagCutter", "PathAccumulator"):
             return ("Invalid postprocessor (%s) for 'DropCutter': only " \
                     + "'ZigZagCutter' or 'PathAccumulator' are allowed") \
                     % str(pathprocessor)
-        return DropCutter.DropCutter(cutter, trimesh_models, processor,
-                physics=physics)
+        return DropCutter.DropCutter(physics=physics)
     elif pathgenerator == "PushCutter":
-        if pathprocessor == "PathAccumulator":
-            processor = PathAccumulator.PathAccumulator()
-        elif pathprocessor == "SimpleCutter":
-            processor = SimpleCutter.SimpleCutter()
-        elif pathprocessor == "ZigZagCutter":
-            processor = ZigZagCutter.ZigZagCutter()
-        elif pathprocessor == "PolygonCutter":
-            processor = PolygonCutter.PolygonCutter()
-        elif pathprocessor == "ContourCutter":
-            processor = ContourCutter.ContourCutter()
-        else:
+        if not pathprocessor in PATH_POSTPROCESSORS:
             return ("Invalid postprocessor (%s) for 'PushCutter' - it " + \
                     "should be one of these: %s") % \
                     (pathprocessor, PATH_POSTPROCESSORS)
-        return PushCutter.PushCutter(cutter, trimesh_models, processor,
-                physics=physics)
+        return PushCutter.PushCutter(
+                waterlines=(pathprocessor == "ContourCutter"), physics=physics)
     elif pathgenerator == "EngraveCutter":
         clockwise = (milling_style == "climb")
         if pathprocessor == "SimpleCutter":
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+""" Compact storage of toolpath moves
+
+A usual toolpath is a tuple of (move_type, args) tuples. Every position is
+another tuple of three floats. This costs more than 150 bytes for each move.
+The MoveStore keeps the same information in a numpy structured array (29 bytes
+per move). All non-positional arguments (machine settings, comments, ...) are
+kept in a separate side table.
+
+The MoveStore behaves like a read-only sequence of (move_type, args) tuples.
+Thus it can be used wherever a list of moves is expected. Filters and
+exporters may use the columns directly (see "get_positions").
+"""
+
+import array
+
+import numpy
+
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID
+
+
+MOVE_DTYPE = numpy.dtype([("move_type", numpy.int8), ("x", numpy.float64),
+        ("y", numpy.float64), ("z", numpy.float64),
+        ("payload", numpy.int32)])
+POSITION_MOVES = (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID)
+# the number of moves converted to python objects at once during iteration
+ITERATION_CHUNK_SIZE = 4096
+
+
+class MoveStore(object):
+
+    def __init__(self, moves=None, _data=None, _payloads=None):
+        """ create a compact representation of a list of moves
+
+        @value moves: any iterable of (move_type, args) tuples (or another
+            MoveStore instance)
+        @type moves: iterable
+        """
+        if not _data is None:
+            self._data = _data
+            self._payloads = _payloads
+        elif isinstance(moves, MoveStore):
+            # share the (read-only) data
+            self._data = moves._data
+            self._payloads = moves._payloads
+        else:
+            self._data, self._payloads = self._pack(moves or [])
+        self._data.flags.writeable = False
+
+    @staticmethod
+    def _pack(moves):
+        # The "array" module allows to collect the columns without the
+        # overhead of a python object per value.
+        move_types = array.array("b")
+        coords = array.array("d")
+        payload_indices = array.array("i")
+        payloads = []
+        no_position = (0.0, 0.0, 0.0)
+        for move_type, args in moves:
+            move_types.append(move_type)
+            if (move_type in POSITION_MOVES) and (len(args) == 3):
+                coords.extend(args)
+                payload_indices.append(-1)
+            else:
+                coords.extend(no_position)
+                payload_indices.append(len(payloads))
+                payloads.append(args)
+        data = numpy.empty(len(move_types), dtype=MOVE_DTYPE)
+        if len(move_types) > 0:
+            data["move_type"] = numpy.frombuffer(move_types, dtype=numpy.int8)
+            positions = numpy.frombuffer(coords,
+                    dtype=numpy.float64).reshape(-1, 3)
+            data["x"] = positions[:, 0]
+            data["y"] = positions[:, 1]
+            data["z"] = positions[:, 2]
+            data["payload"] = numpy.frombuffer(payload_indices,
+                    dtype=numpy.int32)
+        return data, payloads
+
+    @classmethod
+    def from_columns(cls, move_types, positions, payloads=None,
+            payload_indices=None):
+        """ create a MoveStore based on columns (e.g. calculated by a filter)
+
+        @value move_types: the type of each move
+        @type move_types: numpy array of ints
+        @value positions: the x/y/z positions of all moves (ignored for
+            non-positional moves)
+        @type positions: numpy array of shape (N, 3)
+        @value payloads: the side table of non-positional arguments
+        @type payloads: list
+        @value payload_indices: the index of each move within "payloads" (-1
+            for positional moves)
+        @type payload_indices: numpy array of ints
+        """
+        data = numpy.empty(len(move_types), dtype=MOVE_DTYPE)
+        data["move_type"] = move_types
+        if len(move_types) > 0:
+            data["x"] = positions[:, 0]
+            data["y"] = positions[:, 1]
+            data["z"] = positions[:, 2]
+        if payload_indices is None:
+            data["payload"] = -1
+        else:
+            data["payload"] = payload_indices
+        return cls(_data=data, _payloads=list(payloads or []))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __nonzero__(self):
+        return len(self._data) > 0
+
+    def __iter__(self):
+        payloads = self._payloads
+        for start in xrange(0, len(self._data), ITERATION_CHUNK_SIZE):
+            chunk = self._data[start:start + ITERATION_CHUNK_SIZE]
+            # "tolist" is much faster than accessing single numpy scalars
+            for move_type, x, y, z, payload in zip(
+                    chunk["move_type"].tolist(), chunk["x"].tolist(),
+                    chunk["y"].tolist(), chunk["z"].tolist(),
+                    chunk["payload"].tolist()):
+                if payload < 0:
+                    yield (move_type, (x, y, z))
+                else:
+                    yield (move_type, payloads[payload])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # the payload indices remain valid - the side table is shared
+            return MoveStore(_data=self._data[index], _payloads=self._payloads)
+        move_type, x, y, z, payload = self._data[index].item()
+        if payload < 0:
+            return (move_type, (x, y, z))
+        else:
+            return (move_type, self._payloads[payload])
+
+    def __repr__(self):
+        return "MoveStore(%d moves)" % len(self)
+
+    @property
+    def nbytes(self):
+        """ the size of the move table (excluding the side table) """
+        return self._data.nbytes
+
+    def get_move_types(self):
+        return self._data["move_type"]
+
+    def get_payload_indices(self):
+        return self._data["payload"]
+
+    def get_payloads(self):
+        return self._payloads
+
+    def get_position_mask(self):
+        """ return a boolean array marking all moves with a position """
+        return self._data["payload"] < 0
+
+    def get_positions(self, mask=None):
+        """ return the x/y/z columns as a (N, 3) array
+
+        @value mask: optional boolean array for selecting specific moves
+        @type mask: numpy array
+        """
+        data = self._data if mask is None else self._data[mask]
+        positions = numpy.empty((len(data), 3), dtype=numpy.float64)
+        positions[:, 0] = data["x"]
+        positions[:, 1] = data["y"]
+        positions[:, 2] = data["z"]
+        return positions
+
+    def get_limits(self):
+        """ return the lower and upper corner of all positional moves
+
+        @returns: a tuple of two x/y/z tuples - or (None, None) for a toolpath
+            without positional moves
+        """
+        return self.get_statistics()[:2]
+
+    def get_statistics(self):
+        """ return the limits of all positional moves (see "get_limits")
+        along with their number and their accumulated length
+        """
+        positions = self.get_positions(self.get_position_mask())
+        if len(positions) == 0:
+            return None, None, 0, 0
+        steps = numpy.diff(positions, axis=0)
+        length = float(numpy.sqrt((steps * steps).sum(axis=1)).sum())
+        return (tuple(positions.min(axis=0).tolist()),
+                tuple(positions.max(axis=0).tolist()), len(positions), length)
+
+    def replace_positions(self, positions, mask=None):
+        """ return a new MoveStore with changed positions
+
+        The move types and the side table are shared with the original.
+        @value positions: the new positions of all moves (or of all moves
+            selected by "mask")
+        @type positions: numpy array of shape (N, 3)
+        """
+        data = self._data.copy()
+        if mask is None:
+            data["x"] = positions[:, 0]
+            data["y"] = positions[:, 1]
+            data["z"] = positions[:, 2]
+        else:
+            data["x"][mask] = positions[:, 0]
+            data["y"][mask] = positions[:, 1]
+            data["z"][mask] = positions[:, 2]
+        return MoveStore(_data=data, _payloads=self._payloads)
+
+    def select(self, mask):
+        """ return a new MoveStore containing only the selected moves """
+        return MoveStore(_data=self._data[mask], _payloads=self._payloads)
+
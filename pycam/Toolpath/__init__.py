@@ -35,6 +35,7 @@ import pycam.Utils.log
 import random
 import os
 
+import bisect
 import math
 from itertools import groupby
 
@@ -46,6 +47,10 @@ MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_ARC, MOVE_SAFETY, MACHINE_SETTING, \
 MOVES_LIST = (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_ARC, MOVE_SAFETY)
 CORNER_STYLE_EXACT_PATH, CORNER_STYLE_EXACT_STOP, CORNER_STYLE_OPTIMIZE_SPEED, \
         CORNER_STYLE_OPTIMIZE_TOLERANCE = range(4)
+# maximum number of moves kept in the intermediate results of filter chains
+FILTER_CHAIN_CACHE_MAX_MOVES = 4 * 10 ** 6
+# angle covered by each straight line approximating an arc move (visualization)
+ARC_MAX_ANGLE_STEP = math.pi / 36
 
 
 def _check_colinearity(p1, p2, p3):
@@ -55,6 +60,42 @@ def _check_colinearity(p1, p2, p3):
     return v1 == v2
 
 
+def get_arc_points(start, arc_args, max_angle_step=ARC_MAX_ANGLE_STEP):
+    """ approximate an arc move by a sequence of points
+
+    Arc moves (MOVE_ARC) are located in the xy plane. Their arguments are
+    the destination (x/y/z), the center of the circle (x/y) and the direction
+    (clockwise: True/False). The height changes linearly.
+    @value start: the position before the arc move
+    @type start: tuple of float
+    @value arc_args: the arguments of the MOVE_ARC item
+    @type arc_args: tuple
+    @returns: the points along the arc (excluding "start")
+    @rtype: list of tuples
+    """
+    end, center, clockwise = arc_args
+    radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    start_angle = math.atan2(start[1] - center[1], start[0] - center[0])
+    end_angle = math.atan2(end[1] - center[1], end[0] - center[0])
+    sweep = end_angle - start_angle
+    if clockwise:
+        while sweep >= 0:
+            sweep -= 2 * math.pi
+    else:
+        while sweep <= 0:
+            sweep += 2 * math.pi
+    steps = max(1, int(math.ceil(abs(sweep) / max_angle_step)))
+    points = []
+    for step in range(1, steps):
+        fraction = float(step) / steps
+        angle = start_angle + sweep * fraction
+        points.append((center[0] + radius * math.cos(angle),
+                center[1] + radius * math.sin(angle),
+                start[2] + (end[2] - start[2]) * fraction))
+    points.append(tuple(end))
+    return points
+
+
 def simplify_toolpath(path):
     """ remove multiple points in a line from a toolpath
 
@@ -65,26 +106,37 @@ def simplify_toolpath(path):
     @value path: a single separate segment of a toolpath
     @type path: list of points
     """
-    index = 1
     # stay compatible with pycam.Geometry.Path objects
     if hasattr(path, "points"):
         path = path.points
-    while index < len(path) - 1:
-        if _check_colinearity(path[index-1], path[index], path[index+1]):
-            path.pop(index)
-            # don't increase the counter - otherwise we skip one point
-        else:
-            index += 1
+    if len(path) < 3:
+        return
+    # collect the remaining points instead of removing single items (quadratic)
+    result = [path[0]]
+    for index in range(1, len(path) - 1):
+        if not _check_colinearity(result[-1], path[index], path[index + 1]):
+            result.append(path[index])
+    result.append(path[-1])
+    path[:] = result
 
 
 class Toolpath(object):
 
-    def __init__(self, toolpath_path=None, toolpath_filters=None, **kwargs):
+    def __init__(self, toolpath_path=None, toolpath_filters=None,
+            compact=False, **kwargs):
+        """ create a new toolpath
+
+        @value compact: store the moves in a pycam.Toolpath.MoveStore instead
+            of a tuple (reduces the memory consumption of large toolpaths).
+            MoveStore instances given as "toolpath_path" are always kept.
+        @type compact: bool
+        """
         super(Toolpath, self).__init__(**kwargs)
         if toolpath_path is None:
             toolpath_path = []
         if toolpath_filters is None:
             toolpath_filters = []
+        self.compact = compact
         self.filters = toolpath_filters
         self.path = toolpath_path
         self.clear_cache()
@@ -93,9 +145,15 @@ class Toolpath(object):
         return self.__path
 
     def __set_path(self, new_path):
-        # use a read-only tuple instead of a list
-        # (otherwise we can't detect changes)
-        self.__path = tuple(new_path)
+        # late import due to dependency cycle
+        from pycam.Toolpath.MoveStore import MoveStore
+        if self.compact or isinstance(new_path, MoveStore):
+            # the MoveStore is read-only, as well
+            self.__path = MoveStore(new_path)
+        else:
+            # use a read-only tuple instead of a list
+            # (otherwise we can't detect changes)
+            self.__path = tuple(new_path)
         self.clear_cache()
         
     def __get_filters(self):
@@ -116,53 +174,83 @@ class Toolpath(object):
         self._cache_basic_moves = None
         self._cache_visual_filters_string = None
         self._cache_visual_filters = None
-        self._minx = None
-        self._maxx = None
-        self._miny = None
-        self._maxy = None
-        self._minz = None
-        self._maxz = None
-
-    def _get_limit_generic(self, idx, func):
-        values = [p[idx] for move_type, p in self.path
-                  if move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID)]
-        return func(values)
+        self._cache_filter_chain = {}
+        self._cache_filter_chain_counter = 0
+        self._cache_time_index = None
+        self._cache_bounds = None
+
+    def _get_bounds(self):
+        """ calculate the limits of all positional moves along with their
+        number and their accumulated length in a single pass (cached)
+
+        @returns: lower limits, upper limits, number of moves, length
+        @rtype: tuple
+        """
+        if self._cache_bounds is None:
+            # late import due to dependency cycle
+            from pycam.Toolpath.MoveStore import MoveStore
+            if isinstance(self.path, MoveStore):
+                low, high, count, length = self.path.get_statistics()
+            else:
+                low = high = None
+                count = 0
+                length = 0
+                last_position = None
+                for move_type, position in self.path:
+                    if not move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
+                        continue
+                    if last_position is None:
+                        low = list(position[:3])
+                        high = list(position[:3])
+                    else:
+                        for index in range(3):
+                            if position[index] < low[index]:
+                                low[index] = position[index]
+                            elif position[index] > high[index]:
+                                high[index] = position[index]
+                        length += pdist(position, last_position)
+                    count += 1
+                    last_position = position
+            if low is None:
+                low = high = (None, None, None)
+            self._cache_bounds = (tuple(low), tuple(high), count, length)
+        return self._cache_bounds
 
     @property
     def minx(self):
-        if self._minx == None:
-            self._minx = self._get_limit_generic(0, min)
-        return self._minx
+        return self._get_bounds()[0][0]
 
     @property
     def maxx(self):
-        if self._maxx == None:
-            self._maxx = self._get_limit_generic(0, max)
-        return self._maxx
+        return self._get_bounds()[1][0]
 
     @property
     def miny(self):
-        if self._miny == None:
-            self._miny = self._get_limit_generic(1, min)
-        return self._miny
+        return self._get_bounds()[0][1]
 
     @property
     def maxy(self):
-        if self._maxy == None:
-            self._maxy = self._get_limit_generic(1, max)
-        return self._maxy
+        return self._get_bounds()[1][1]
 
     @property
     def minz(self):
-        if self._minz == None:
-            self._minz = self._get_limit_generic(2, min)
-        return self._minz
+        return self._get_bounds()[0][2]
 
     @property
     def maxz(self):
-        if self._maxz == None:
-            self._maxz = self._get_limit_generic(2, max)
-        return self._maxz
+        return self._get_bounds()[1][2]
+
+    @property
+    def move_count(self):
+        """ the number of straight and rapid moves of the (unfiltered) path """
+        return self._get_bounds()[2]
+
+    @property
+    def length(self):
+        """ the length of all straight and rapid moves of the (unfiltered)
+        path
+        """
+        return self._get_bounds()[3]
 
     def get_meta_data(self):
         meta = self.toolpath_settings.get_string()
@@ -174,10 +262,67 @@ class Toolpath(object):
         moves = self.get_basic_moves()
         if max_time is None:
             return moves
-        else:
-            # late import due to dependency cycle
-            import pycam.Toolpath.Filters
-            return moves | pycam.Toolpath.Filters.TimeLimit(max_time)
+        # The result equals "moves | TimeLimit(max_time)" (arc moves are
+        # split into straight moves). But the
+        # cumulative time index allows to use a binary search instead.
+        positional_moves, times, distances = self._get_time_index()
+        if max_time <= 0:
+            return []
+        end_index = bisect.bisect_left(times, max_time)
+        if end_index >= len(times):
+            return list(positional_moves)
+        result = positional_moves[:end_index]
+        move_type, destination = positional_moves[end_index]
+        if (end_index > 0) and (times[end_index] > max_time):
+            # the last move is only partially finished
+            start_time = times[end_index - 1]
+            partial = (max_time - start_time) / \
+                    (times[end_index] - start_time)
+            start = positional_moves[end_index - 1][1]
+            destination = padd(start, pmul(psub(destination, start), partial))
+        result.append((move_type, destination))
+        return result
+
+    def _get_time_index(self):
+        """ return the positional basic moves along with their cumulative
+        machine time (in minutes) and their cumulative distance
+
+        The index is calculated only once for the current basic moves.
+        """
+        moves = self.get_basic_moves()
+        if self._cache_time_index and (self._cache_time_index[0] is moves):
+            return self._cache_time_index[1:]
+        min_feedrate = 1
+        feedrate = min_feedrate
+        duration = 0
+        length = 0
+        last_position = None
+        positional_moves = []
+        times = []
+        distances = []
+        for move_type, args in moves:
+            if (move_type == MACHINE_SETTING) and (args[0] == "feedrate"):
+                feedrate = args[1]
+            elif move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_ARC):
+                if (move_type == MOVE_ARC) and (last_position is None):
+                    # no start position -> move straight to the destination
+                    steps = [(MOVE_STRAIGHT, tuple(args[0]))]
+                elif move_type == MOVE_ARC:
+                    steps = [(MOVE_STRAIGHT, point)
+                            for point in get_arc_points(last_position, args)]
+                else:
+                    steps = [(move_type, args)]
+                for step_type, position in steps:
+                    if not last_position is None:
+                        distance = pdist(position, last_position)
+                        duration += distance / max(feedrate, min_feedrate)
+                        length += distance
+                    positional_moves.append((step_type, position))
+                    times.append(duration)
+                    distances.append(length)
+                    last_position = position
+        self._cache_time_index = (moves, positional_moves, times, distances)
+        return self._cache_time_index[1:]
 
     def _rotate_point(self, rp, sp, v, angle):
         vx = v[0]
@@ -314,35 +459,23 @@ class Toolpath(object):
         return self.get_machine_move_distance_and_time()[1]
 
     def get_machine_move_distance_and_time(self):
-        min_feedrate = 1
-        length = 0
-        duration = 0
-        feed_rate = min_feedrate
-        current_position = None
-        # go through all points of the path
-        for move_type, args in self.get_basic_moves():
-            if (move_type == MACHINE_SETTING) and (args[0] == "feedrate"):
-                feedrate = args[1]
-            elif move_type in (MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID):
-                if not current_position is None:
-                    distance = pdist(args, current_position)
-                    duration += distance / max(feedrate, min_feedrate)
-                    length += distance
-                current_position = args
-        return length, duration
+        positional_moves, times, distances = self._get_time_index()
+        if times:
+            return distances[-1], times[-1]
+        else:
+            return 0, 0
 
     def get_basic_moves(self, filters=None, reset_cache=False):
         if filters is None:
             # implicitly assume that we use the default (latest) filters if nothing is given
             filters = self._cache_visual_filters or []
+        if reset_cache:
+            self._cache_filter_chain = {}
         if reset_cache or not self._cache_basic_moves or \
                 (str(filters) != self._cache_visual_filters_string):
-            # late import due to dependency cycle
-            import pycam.Toolpath.Filters as Filters
-            all_filters = tuple(self.filters) + tuple(filters)
-            self._cache_basic_moves = \
-                    pycam.Toolpath.Filters.get_filtered_moves(self.path,
-                            all_filters)
+            all_filters = list(self.filters) + list(filters)
+            all_filters.sort()
+            self._cache_basic_moves = self._get_filter_chain_result(all_filters)
             self._cache_visual_filters_string = str(filters)
             self._cache_visual_filters = filters
             _log.debug("Applying toolpath filters: %s" % \
@@ -351,6 +484,56 @@ class Toolpath(object):
                     (len(self.path), len(self._cache_basic_moves)))
         return self._cache_basic_moves
 
+    def _get_filter_chain_result(self, filters):
+        """ apply a sorted list of filters to the path
+
+        The intermediate result after each filter is cached (keyed by the
+        classes and settings of the filters up to this point). Only the
+        filters following the longest cached prefix of the chain need to be
+        applied.
+        """
+        # late import due to dependency cycle
+        import pycam.Toolpath.Filters as Filters
+        keys = []
+        prefix = ()
+        for one_filter in filters:
+            # the display representation may be lossy (e.g. rounded numbers)
+            settings = repr(sorted(one_filter.settings.items()))
+            prefix += ((one_filter.__class__, settings), )
+            keys.append(prefix)
+        moves = None
+        start = 0
+        for index in range(len(keys) - 1, -1, -1):
+            if keys[index] in self._cache_filter_chain:
+                self._cache_filter_chain_counter += 1
+                item = self._cache_filter_chain[keys[index]]
+                item[1] = self._cache_filter_chain_counter
+                moves = item[0]
+                start = index + 1
+                break
+        if moves is None:
+            moves = Filters.get_filtered_moves(self.path, [])
+        for index in range(start, len(filters)):
+            moves = Filters.get_filtered_moves(moves, [filters[index]])
+            self._store_filter_chain_result(keys[index], moves)
+        if start > 0:
+            _log.debug("Re-used %d of %d toolpath filter results" % \
+                    (start, len(filters)))
+        return moves
+
+    def _store_filter_chain_result(self, key, moves):
+        self._cache_filter_chain_counter += 1
+        cache = self._cache_filter_chain
+        cache[key] = [moves, self._cache_filter_chain_counter]
+        cached_moves = sum([len(item[0]) for item in cache.values()])
+        # remove the least recently used results (except for the new one)
+        while (cached_moves > FILTER_CHAIN_CACHE_MAX_MOVES) and \
+                (len(cache) > 1):
+            oldest = min([(item[1], other_key)
+                    for other_key, item in cache.items()
+                    if other_key != key])[1]
+            cached_moves -= len(cache.pop(oldest)[0])
+
 
 class Bounds(object):
 
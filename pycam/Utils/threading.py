@@ -25,6 +25,11 @@ import pycam.Utils
 # multiprocessing is imported later
 #import multiprocessing
 import Queue
+import cPickle
+import array
+import bisect
+import itertools
+import zlib
 import signal
 import socket
 import platform
@@ -56,6 +61,22 @@ else:
                 pass
 
 DEFAULT_PORT = 1250
+# The "thread" backend avoids pickling and forking. But it is only useful for
+# tasks that release the GIL most of the time (e.g. numpy based calculations).
+BACKEND_PROCESS, BACKEND_THREAD, BACKEND_SERIAL = "process", "thread", "serial"
+BACKENDS = (BACKEND_PROCESS, BACKEND_THREAD, BACKEND_SERIAL)
+# size limits (in bytes) of the shared cache and of the cache of each worker
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+DEFAULT_WORKER_CACHE_SIZE = 256 * 1024 * 1024
+# task payloads (arguments and results) above this size are compressed
+PAYLOAD_COMPRESSION_THRESHOLD = 64 * 1024
+PAYLOAD_COMPRESSION_LEVEL = 1
+PAYLOAD_PICKLE, PAYLOAD_POINTS = range(2)
+# upper limits (in seconds) of the buckets of latency histograms
+LATENCY_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 100)
+# number of queue depth samples (one per second) and of finished jobs to keep
+MAX_QUEUE_DEPTH_SAMPLES = 600
+MAX_JOB_STATISTICS = 30
 
 
 #TODO: create one or two classes for these functions (to get rid of the globals)
@@ -69,10 +90,14 @@ __multiprocessing = None
 # needs to be initialized, if multiprocessing is enabled
 __num_of_processes = None
 
+# the executor used for local parallel processing (one of BACKENDS)
+__backend = BACKEND_PROCESS
+
 __manager = None
 __closing = None
 __task_source_uuid = None
 __finished_jobs = []
+__job_statistics = []
 __issued_warnings = []
 
 
@@ -116,6 +141,12 @@ def is_multiprocessing_available():
 def is_multiprocessing_enabled():
     return bool(__multiprocessing)
 
+def get_backend():
+    if __multiprocessing:
+        return __backend
+    else:
+        return BACKEND_SERIAL
+
 def is_server_mode_available():
     # the following definition should be kept in sync with the wiki:
     # http://sf.net/apps/mediawiki/pycam/?title=Parallel_Processing_on_different_Platforms
@@ -141,9 +172,38 @@ def get_pool_statistics():
     else:
         return __manager.statistics().get_worker_statistics()
 
-def get_task_statistics():
+def get_queue_statistics():
     global __manager
+    if __manager is None:
+        return []
+    else:
+        return __manager.statistics().get_queue_statistics()
+
+def get_task_statistics():
+    """ collect the statistics of the parallel processing
+
+    The result is a dictionary containing only basic types (suitable for JSON).
+    The following items are always available:
+      "jobs": list of the most recent jobs of this process (dicts with "id",
+          "function", "mode", "tasks", "duration", "queueing_time" and a
+          "latency_histogram")
+    The following items are only available in server mode:
+      "tasks", "results", "pending": current number of items in the queues
+      "cache", "worker_cache": dicts with "size", "hits", "misses",
+          "evictions" and the "hit_ratio" of the shared cache and of all
+          workers (accumulated)
+      "functions": dict with a dict for each task function ("tasks",
+          "process_time", "transfer_time", "bytes_in", "bytes_out" and the
+          "latency_histogram" of the processing time)
+      "workers": list of dicts for each worker ("name", "tasks",
+          "process_time", "transfer_time", "utilization")
+      "queue_depth": list of (timestamp, number of queued tasks) samples
+    Histograms are lists of (upper limit, count) tuples. The upper limit of
+    the last bucket is None.
+    """
+    global __manager, __job_statistics
     result = {}
+    result["jobs"] = [job.get_statistics() for job in __job_statistics]
     if not __manager is None:
         try:
             result["tasks"] = __manager.tasks().qsize()
@@ -152,9 +212,84 @@ def get_task_statistics():
             # this can happen on MacOS (see multiprocessing doc)
             pass
         result["pending"] = __manager.pending_tasks().length()
-        result["cache"] = __manager.cache().length()
+        stats = __manager.statistics()
+        for key, cache_stats in (("cache", __manager.cache().get_statistics()),
+                ("worker_cache", stats.get_cache_statistics())):
+            requests = cache_stats["hits"] + cache_stats["misses"]
+            cache_stats["hit_ratio"] = cache_stats["hits"] / float(
+                    max(1, requests))
+            result[key] = cache_stats
+        result["functions"] = stats.get_function_statistics()
+        result["workers"] = stats.get_utilization_statistics()
+        result["queue_depth"] = stats.get_queue_depth_samples()
     return result
 
+def get_data_size(value):
+    """ estimate the memory consumption of an object via its pickled size """
+    try:
+        return len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+    except (cPickle.PicklingError, TypeError):
+        return 0
+
+class Histogram(object):
+    """ count values in buckets with fixed upper limits """
+
+    def __init__(self, limits=LATENCY_BUCKETS):
+        self.limits = tuple(limits)
+        # the last bucket collects all values above the highest limit
+        self.counts = [0] * (len(self.limits) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.limits, value)] += 1
+
+    def get_buckets(self):
+        return zip(self.limits + (None, ), self.counts)
+
+
+class JobStatistics(object):
+    """ metrics of one call of "run_in_parallel" (collected by the caller)
+
+    The latency of a task is the time between its submission and the arrival
+    of its result (server mode). The local modes can only measure the time
+    between two results.
+    """
+
+    def __init__(self, job_id, func, mode):
+        self.job_id = job_id
+        self.function = _get_function_name(func)
+        self.mode = mode
+        self.start_time = time.time()
+        self.end_time = None
+        self.tasks = 0
+        self.queueing_time = 0
+        self.latency = Histogram()
+
+    def add_result(self, latency):
+        self.tasks += 1
+        self.latency.add(latency)
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def get_statistics(self):
+        end_time = self.end_time or time.time()
+        return {"id": self.job_id, "function": self.function,
+                "mode": self.mode, "tasks": self.tasks,
+                "duration": end_time - self.start_time,
+                "queueing_time": self.queueing_time,
+                "latency_histogram": self.latency.get_buckets()}
+
+
+def _get_function_name(func):
+    return getattr(func, "__name__", str(func))
+
+def _add_job_statistics(job):
+    global __job_statistics
+    __job_statistics.append(job)
+    while len(__job_statistics) > MAX_JOB_STATISTICS:
+        __job_statistics.pop(0)
+
+
 class ManagerInfo(object):
     """ this separate class allows proper pickling for "multiprocesssing"
     """
@@ -175,10 +310,87 @@ class ManagerInfo(object):
     def get_pending_tasks(self):
         return self.pending_tasks
 
+def _get_points_array(data):
+    """ convert a list of points (tuples of floats or None) into flat arrays
+
+    Only exact floats are accepted - other numbers (int, bool, ...) would not
+    survive the conversion unchanged.
+    @returns: a tuple of the mask of valid points (one byte per point: 1 for
+        a tuple, 0 for None), the coordinates (zero for None) and the
+        dimension of the points - or None if the data is not a uniform list
+        of points
+    """
+    if not isinstance(data, list) or not data:
+        return None
+    dimension = None
+    for point in data:
+        if point is None:
+            continue
+        if type(point) is not tuple:
+            return None
+        if dimension is None:
+            dimension = len(point)
+        elif len(point) != dimension:
+            return None
+        for value in point:
+            if type(value) is not float:
+                return None
+    if not dimension:
+        return None
+    empty_point = (0.0, ) * dimension
+    mask = array.array("B", [0 if point is None else 1 for point in data])
+    values = array.array("d", itertools.chain.from_iterable(
+            [empty_point if point is None else point for point in data]))
+    return mask, values, dimension
+
+def pack_payload(data, compression_threshold=PAYLOAD_COMPRESSION_THRESHOLD):
+    """ serialize the arguments or the result of a task for remote processing
+
+    Lists of points (tuples of floats or None) are stored as packed arrays.
+    Everything else is pickled with the highest available protocol. Big
+    payloads are compressed.
+    The result is a tuple of simple types - thus it is cheap to transfer via
+    the task manager.
+    """
+    points = _get_points_array(data)
+    if points is None:
+        payload_type = PAYLOAD_PICKLE
+        dimension = None
+        raw = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+    else:
+        payload_type = PAYLOAD_POINTS
+        mask, values, dimension = points
+        raw = mask.tostring() + values.tostring()
+    if len(raw) > compression_threshold:
+        raw = zlib.compress(raw, PAYLOAD_COMPRESSION_LEVEL)
+        compressed = True
+    else:
+        compressed = False
+    return (payload_type, dimension, compressed, raw)
+
+def unpack_payload(payload):
+    """ restore the data that was serialized via "pack_payload" """
+    payload_type, dimension, compressed, raw = payload
+    if compressed:
+        raw = zlib.decompress(raw)
+    if payload_type == PAYLOAD_PICKLE:
+        return cPickle.loads(raw)
+    # the mask (one byte per point) is followed by the coordinates
+    count = len(raw) // (1 + dimension * array.array("d").itemsize)
+    mask = array.array("B")
+    mask.fromstring(raw[:count])
+    values = array.array("d")
+    values.fromstring(raw[count:])
+    # group the flat list of values into tuples
+    points = zip(*([iter(values)] * dimension))
+    return [point if valid else None for valid, point in zip(mask, points)]
+
 def init_threading(number_of_processes=None, enable_server=False, remote=None,
-        run_server=False, server_credentials="", local_port=DEFAULT_PORT):
+        run_server=False, server_credentials="", local_port=DEFAULT_PORT,
+        cache_size=DEFAULT_CACHE_SIZE,
+        worker_cache_size=DEFAULT_WORKER_CACHE_SIZE, backend=None):
     global __multiprocessing, __num_of_processes, __manager, __closing, \
-            __task_source_uuid
+            __task_source_uuid, __backend
     if __multiprocessing:
         # kill the manager and clean everything up for a re-initialization
         cleanup()
@@ -206,7 +418,33 @@ def init_threading(number_of_processes=None, enable_server=False, remote=None,
         remote = None
         run_server = None
         server_credentials = ""
-    if not is_multiprocessing_available():
+    if backend is None:
+        backend = BACKEND_PROCESS
+    elif not backend in BACKENDS:
+        raise ValueError("Invalid parallel processing backend: %s (expected " \
+                % str(backend) + "one of %s)" % ", ".join(BACKENDS))
+    if (backend != BACKEND_PROCESS) and (enable_server or run_server):
+        log.warn("The '%s' backend is not available in server mode - " \
+                % backend + "using processes instead.")
+        backend = BACKEND_PROCESS
+    __backend = backend
+    if backend == BACKEND_SERIAL:
+        __multiprocessing = False
+    elif backend == BACKEND_THREAD:
+        try:
+            import multiprocessing.dummy
+        except ImportError:
+            log.info("Python's multiprocessing module is missing: " + \
+                    "disabling parallel processing")
+            multiprocessing = None
+        if number_of_processes is None:
+            number_of_processes = get_number_of_cores() or 1
+        if multiprocessing and (number_of_processes > 0):
+            __multiprocessing = multiprocessing.dummy
+            __num_of_processes = number_of_processes
+        else:
+            __multiprocessing = False
+    elif not is_multiprocessing_available():
         __multiprocessing = False
         # Maybe a multiprocessing feature was explicitely requested?
         # Issue some warnings if necessary.
@@ -236,7 +474,7 @@ def init_threading(number_of_processes=None, enable_server=False, remote=None,
             else:
                 __multiprocessing = False
         elif (number_of_processes < 1) and (remote is None) and \
-                (enable_server is None):
+                not enable_server:
             # Zero processes are allowed if we use a remote server or offer a
             # server.
             __multiprocessing = False
@@ -249,7 +487,11 @@ def init_threading(number_of_processes=None, enable_server=False, remote=None,
         log.info("Disabled parallel processing")
     elif not enable_server and not run_server:
         __manager = None
-        log.info("Enabled %d parallel local processes" % __num_of_processes)
+        if backend == BACKEND_THREAD:
+            log.info("Enabled %d parallel local threads" % __num_of_processes)
+        else:
+            log.info("Enabled %d parallel local processes" \
+                    % __num_of_processes)
     else:
         # with multiprocessing
         log.info("Enabled %d parallel local processes" % __num_of_processes)
@@ -291,7 +533,7 @@ def init_threading(number_of_processes=None, enable_server=False, remote=None,
             tasks_queue = multiprocessing.Queue()
             results_queue = multiprocessing.Queue()
             statistics = ProcessStatistics()
-            cache = ProcessDataCache()
+            cache = ProcessDataCache(max_size=cache_size)
             pending_tasks = PendingTasks()
             info = ManagerInfo(tasks_queue, results_queue, statistics, cache,
                     pending_tasks)
@@ -328,7 +570,7 @@ def init_threading(number_of_processes=None, enable_server=False, remote=None,
             # only start the spawner, if we want to use local workers
             spawner = __multiprocessing.Process(name="spawn",
                     target=_spawn_daemon, args=(__manager, __num_of_processes,
-                    worker_uuid_list))
+                    worker_uuid_list, worker_cache_size))
             spawner.start()
         else:
             spawner = None
@@ -362,7 +604,8 @@ def cleanup():
     __closing = None
     __multiprocessing = None
 
-def _spawn_daemon(manager, number_of_processes, worker_uuid_list):
+def _spawn_daemon(manager, number_of_processes, worker_uuid_list,
+        worker_cache_size=None):
     """ wait for items in the 'tasks' queue to appear and then spawn workers
     """
     global __multiprocessing, __closing
@@ -390,7 +633,8 @@ def _spawn_daemon(manager, number_of_processes, worker_uuid_list):
                     worker = __multiprocessing.Process(
                             name=task_name, target=_handle_tasks,
                             args=(tasks, results, stats, cache,
-                                    pending_tasks, __closing))
+                                    pending_tasks, __closing,
+                                    worker_cache_size))
                     worker.start()
                     workers.append(worker)
                 # wait until all workers are finished
@@ -409,10 +653,21 @@ def _spawn_daemon(manager, number_of_processes, worker_uuid_list):
         # the connection was closed
         log.info("Spawner daemon lost connection to server")
 
-def _handle_tasks(tasks, results, stats, cache, pending_tasks, closing):
+def _get_cached_value(item, local_cache, cache, stats, name):
+    try:
+        return local_cache.get(item)
+    except KeyError:
+        # TODO: we will break hard, if the item is expired
+        value = cache.get(item)
+        local_cache.add(item, value, size=cache.get_size(item))
+        stats.update_cache_statistics(name, local_cache.get_statistics())
+        return value
+
+def _handle_tasks(tasks, results, stats, cache, pending_tasks, closing,
+        cache_size=None):
     global __multiprocessing
     name = __multiprocessing.current_process().name
-    local_cache = ProcessDataCache()
+    local_cache = ProcessDataCache(max_size=cache_size)
     timeout_limit = 60
     timeout_counter = 0
     last_worker_notification = 0
@@ -421,6 +676,8 @@ def _handle_tasks(tasks, results, stats, cache, pending_tasks, closing):
         while (timeout_counter < timeout_limit) and not closing.get():
             if last_worker_notification + 30 < time.time():
                 stats.worker_notification(name)
+                stats.update_cache_statistics(name,
+                        local_cache.get_statistics())
                 last_worker_notification = time.time()
             start_time = time.time()
             try:
@@ -433,41 +690,37 @@ def _handle_tasks(tasks, results, stats, cache, pending_tasks, closing):
             # "pending_tasks.add", the task is lost. We should better use some
             # backup.
             pending_tasks.add(job_id, task_id, (func, args))
+            bytes_in = len(args[3])
             log.debug("Worker %s processes %s / %s" % (name, job_id, task_id))
             # reset the timeout counter, if we found another item in the queue
             timeout_counter = 0
             real_args = []
-            for arg in args:
+            for arg in unpack_payload(args):
                 if isinstance(arg, ProcessDataCacheItemID):
-                    try:
-                        value = local_cache.get(arg)
-                    except KeyError:
-                        # TODO: we will break hard, if the item is expired
-                        value = cache.get(arg)
-                        local_cache.add(arg, value)
-                    real_args.append(value)
+                    real_args.append(_get_cached_value(arg, local_cache,
+                            cache, stats, name))
                 elif isinstance(arg, list) and [True for item in arg \
                         if isinstance(item, ProcessDataCacheItemID)]:
                     # check if any item in the list is cacheable
                     args_list = []
                     for item in arg:
                         if isinstance(item, ProcessDataCacheItemID):
-                            try:
-                                value = local_cache.get(item)
-                            except KeyError:
-                                value = cache.get(item)
-                                local_cache.add(item, value)
-                            args_list.append(value)
+                            args_list.append(_get_cached_value(item,
+                                    local_cache, cache, stats, name))
                         else:
                             args_list.append(item)
                     real_args.append(args_list)
                 else:
                     real_args.append(arg)
-            stats.add_transfer_time(name, time.time() - start_time)
+            transfer_time = time.time() - start_time
             start_time = time.time()
-            results.put((job_id, task_id, func(real_args)))
+            result = pack_payload(func(real_args))
+            results.put((job_id, task_id, result))
             pending_tasks.remove(job_id, task_id)
-            stats.add_process_time(name, time.time() - start_time)
+            stats.add_task_metrics(name, _get_function_name(func),
+                    transfer_time, time.time() - start_time, bytes_in,
+                    len(result[3]))
+        stats.update_cache_statistics(name, local_cache.get_statistics())
     except KeyboardInterrupt:
         pass
     log.debug("Worker thread finished after %d seconds of inactivity: %s" \
@@ -488,20 +741,24 @@ def run_in_parallel_remote(func, args_list, unordered=False,
         remote_cache = __manager.cache()
         stats = __manager.statistics()
         pending_tasks = __manager.pending_tasks()
+        job = JobStatistics(job_id, func, "server")
+        _add_job_statistics(job)
+        submit_times = {}
         # add all tasks of this job to the queue
         for index, args in enumerate(args_list):
             if callback:
                 callback()
             start_time = time.time()
+            submit_times[index] = start_time
             result_args = []
             for arg in args:
                 # add the argument to the cache if possible
                 if hasattr(arg, "uuid"):
                     data_uuid = ProcessDataCacheItemID(arg.uuid)
-                    if not remote_cache.contains(data_uuid):
+                    if not remote_cache.contains(data_uuid, lock_id=job_id):
                         log.debug("Adding cache item for job %s: %s - %s" % \
                                 (job_id, arg.uuid, arg.__class__))
-                        remote_cache.add(data_uuid, arg)
+                        remote_cache.add(data_uuid, arg, lock_id=job_id)
                     result_args.append(data_uuid)
                 elif isinstance(arg, (list, set, tuple)):
                     # a list with - maybe containing cacheable items
@@ -513,28 +770,38 @@ def run_in_parallel_remote(func, args_list, unordered=False,
                             # non-cacheable item
                             new_arg_list.append(item)
                             continue
-                        if not remote_cache.contains(data_uuid):
+                        if not remote_cache.contains(data_uuid,
+                                lock_id=job_id):
                             log.debug("Adding cache item from list for " \
                                     + "job %s: %s - %s" \
                                     % (job_id, item.uuid, item.__class__))
-                            remote_cache.add(data_uuid, item)
+                            remote_cache.add(data_uuid, item, lock_id=job_id)
                         new_arg_list.append(data_uuid)
                     result_args.append(new_arg_list)
                 else:
                     result_args.append(arg)
-            tasks_queue.put((job_id, index, func, result_args))
-            stats.add_queueing_time(__task_source_uuid,
-                    time.time() - start_time)
+            tasks_queue.put((job_id, index, func, pack_payload(result_args)))
+            queueing_time = time.time() - start_time
+            job.queueing_time += queueing_time
+            stats.add_queueing_time(__task_source_uuid, queueing_time)
         log.debug("Added %d tasks for job %s" % (len(args_list), job_id))
         result_buffer = {}
         index = 0
         cancelled = False
+        last_queue_sample = 0
         # wait for all results of this job
         while (index < len(args_list)) and not cancelled:
             if callback and callback():
                 # cancel requested
                 cancelled = True
                 break
+            if last_queue_sample + 1 < time.time():
+                try:
+                    stats.add_queue_depth_sample(tasks_queue.qsize())
+                except NotImplementedError:
+                    # this can happen on MacOS (see multiprocessing doc)
+                    pass
+                last_queue_sample = time.time()
             # re-inject stale tasks if necessary
             stale_task = pending_tasks.get_stale_task()
             if stale_task:
@@ -563,6 +830,9 @@ def run_in_parallel_remote(func, args_list, unordered=False,
             if result_job_id == job_id:
                 log.debug("Received the result of a task: %s / %s" % \
                         (job_id, task_id))
+                result = unpack_payload(result)
+                job.add_result(time.time() - submit_times.get(task_id,
+                        job.start_time))
                 try:
                     if unordered:
                         # just return the values in any order
@@ -583,8 +853,9 @@ def run_in_parallel_remote(func, args_list, unordered=False,
                     # This exception is triggered when the caller stops
                     # requesting more items from the generator.
                     log.debug("Parallel processing cancelled: %s" % job_id)
+                    job.finish()
                     _cleanup_job(job_id, tasks_queue, pending_tasks,
-                            __finished_jobs)
+                            remote_cache, __finished_jobs)
                     # re-raise the GeneratorExit exception to finish destruction
                     raise
             elif result_job_id in __finished_jobs:
@@ -598,7 +869,9 @@ def run_in_parallel_remote(func, args_list, unordered=False,
                 results_queue.put((result_job_id, task_id, result))
                 # wait a little bit to get some idle CPU cycles
                 time.sleep(0.2)
-        _cleanup_job(job_id, tasks_queue, pending_tasks, __finished_jobs)
+        job.finish()
+        _cleanup_job(job_id, tasks_queue, pending_tasks, remote_cache,
+                __finished_jobs)
         if cancelled:
             log.debug("Parallel processing cancelled: %s" % job_id)
         else:
@@ -607,7 +880,7 @@ def run_in_parallel_remote(func, args_list, unordered=False,
         for args in args_list:
             yield func(args)
 
-def _cleanup_job(job_id, tasks_queue, pending_tasks, finished_jobs):
+def _cleanup_job(job_id, tasks_queue, pending_tasks, cache, finished_jobs):
     # flush the task queue
     try:
         queue_len = tasks_queue.qsize()
@@ -631,6 +904,8 @@ def _cleanup_job(job_id, tasks_queue, pending_tasks, finished_jobs):
                 job_id))
     # remove all stale tasks
     pending_tasks.remove(job_id)
+    # the cached items of this job may be removed now
+    cache.release(job_id)
     # limit the number of stored finished jobs
     finished_jobs.append(job_id)
     while len(finished_jobs) > 30:
@@ -639,11 +914,13 @@ def _cleanup_job(job_id, tasks_queue, pending_tasks, finished_jobs):
 
 def run_in_parallel_local(func, args, unordered=False,
         disable_multiprocessing=False, callback=None):
-    global __multiprocessing, __num_of_processes
+    global __multiprocessing, __num_of_processes, __backend
     if __multiprocessing is None:
         # threading was not configured before
         init_threading()
     if __multiprocessing and not disable_multiprocessing:
+        job = JobStatistics(str(uuid.uuid1()), func, __backend)
+        _add_job_statistics(job)
         # use the number of CPUs as the default number of worker threads
         pool = __multiprocessing.Pool(__num_of_processes)
         if unordered:
@@ -656,25 +933,38 @@ def run_in_parallel_local(func, args, unordered=False,
             # Beware: we may not return "pool.imap" or "pool.imap_unordered"
             # directly. It would somehow loose the focus and just hang infinitely.
             # Thus we wrap our own generator around it.
+            last_result = time.time()
             for result in imap_func(func, args):
+                job.add_result(time.time() - last_result)
                 if callback and callback():
                     # cancel requested
                     break
                 yield result
+                last_result = time.time()
         finally:
+            job.finish()
             pool.terminate()
     else:
-        for arg in args:
-            if callback and callback():
-                # cancel requested
-                break
-            yield func(arg)
+        job = JobStatistics(str(uuid.uuid1()), func, "serial")
+        _add_job_statistics(job)
+        try:
+            for arg in args:
+                if callback and callback():
+                    # cancel requested
+                    break
+                start_time = time.time()
+                result = func(arg)
+                job.add_result(time.time() - start_time)
+                yield result
+        finally:
+            job.finish()
 
 
 class OneProcess(object):
     def __init__(self, name, is_queue=False):
         self.is_queue = is_queue
         self.name = name
+        self.first_seen = time.time()
         self.transfer_time = 0
         self.transfer_count = 0
         self.process_time = 0
@@ -706,6 +996,9 @@ class ProcessStatistics(object):
         self.processes = {}
         self.queues = {}
         self.workers = {}
+        self.caches = {}
+        self.functions = {}
+        self.queue_depth = []
         self.timeout = timeout
 
     def __str__(self):
@@ -744,6 +1037,53 @@ class ProcessStatistics(object):
         self.queues[name].transfer_count += 1
         self.queues[name].transfer_time += amount
 
+    def add_task_metrics(self, name, function, transfer_time, process_time,
+            bytes_in, bytes_out):
+        """ store the metrics of a finished task (called by the workers) """
+        self.add_transfer_time(name, transfer_time)
+        self.add_process_time(name, process_time)
+        if not function in self.functions:
+            self.functions[function] = {"tasks": 0, "process_time": 0,
+                    "transfer_time": 0, "bytes_in": 0, "bytes_out": 0,
+                    "latency": Histogram()}
+        metrics = self.functions[function]
+        metrics["tasks"] += 1
+        metrics["process_time"] += process_time
+        metrics["transfer_time"] += transfer_time
+        metrics["bytes_in"] += bytes_in
+        metrics["bytes_out"] += bytes_out
+        metrics["latency"].add(process_time)
+
+    def add_queue_depth_sample(self, depth):
+        self.queue_depth.append((time.time(), depth))
+        if len(self.queue_depth) > MAX_QUEUE_DEPTH_SAMPLES:
+            self.queue_depth.pop(0)
+
+    def get_queue_depth_samples(self):
+        return list(self.queue_depth)
+
+    def get_function_statistics(self):
+        result = {}
+        for function, metrics in self.functions.items():
+            result[function] = dict(metrics)
+            result[function]["latency_histogram"] = \
+                    result[function].pop("latency").get_buckets()
+        return result
+
+    def get_utilization_statistics(self):
+        """ return the ratio of processing time and lifetime of each worker """
+        now = time.time()
+        result = []
+        for one_process in self.processes.values():
+            lifetime = max(now - one_process.first_seen, 0.001)
+            result.append({"name": one_process.name,
+                    "tasks": one_process.process_count,
+                    "process_time": one_process.process_time,
+                    "transfer_time": one_process.transfer_time,
+                    "utilization": min(1.0,
+                        one_process.process_time / lifetime)})
+        return result
+
     def worker_notification(self, name):
         timestamp = time.time()
         self.workers[name] = timestamp
@@ -772,6 +1112,33 @@ class ProcessStatistics(object):
                 pass
         return result
 
+    def update_cache_statistics(self, name, statistics):
+        self.caches[name] = statistics
+
+    def get_cache_statistics(self):
+        """ accumulate the cache statistics of all workers """
+        result = {"size": 0, "hits": 0, "misses": 0, "evictions": 0}
+        for statistics in self.caches.values():
+            for key in result:
+                result[key] += statistics[key]
+        return result
+
+    def get_queue_statistics(self):
+        result = []
+        # see "get_worker_statistics" for the reason of this copy
+        all_keys = self.queues.keys()
+        for key in all_keys:
+            try:
+                one_queue = self.queues[key]
+                num_of_tasks = one_queue.transfer_count
+                queueing_time = one_queue.transfer_time
+                avg_queueing_time = queueing_time / max(1, num_of_tasks)
+                result.append((key, num_of_tasks, queueing_time,
+                        avg_queueing_time))
+            except KeyError:
+                pass
+        return result
+
 
 class PendingTasks(object):
 
@@ -827,10 +1194,27 @@ class PendingTasks(object):
 
 
 class ProcessDataCache(object):
+    """ cache for big objects (e.g. models) that are shared between tasks
+
+    The cache is limited by the age of its items and (optionally) by the
+    accumulated (pickled) size of its items. The least recently used items are
+    removed first, if the size limit is exceeded.
+    Items can be locked by a job (see "lock_id" of "add" and "contains"). They
+    are not removed until the job releases them - otherwise the workers would
+    fail to retrieve the items of the tasks that are still queued.
+    A lock expires if the job did not use it for "timeout" seconds (e.g. the
+    client disconnected without finishing its job).
+    """
 
-    def __init__(self, timeout=600):
+    def __init__(self, timeout=600, max_size=None):
         self.cache = {}
         self.timeout = timeout
+        self.max_size = max_size
+        self.locks = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def _update_timestamp(self, name):
         if isinstance(name, ProcessDataCacheItemID):
@@ -842,40 +1226,119 @@ class ProcessDataCache(object):
             # the item was deleted meanwhile
             pass
 
+    def _remove(self, name):
+        try:
+            self.size -= self.cache.pop(name)[2]
+        except KeyError:
+            # ignore removed items
+            pass
+
+    def _lock(self, name, lock_id):
+        if not lock_id is None:
+            # the timestamp is refreshed whenever the job uses the item
+            self.locks.setdefault(name, {})[lock_id] = time.time()
+
+    def release(self, lock_id):
+        """ remove all locks of a job """
+        for key in self.locks.keys():
+            locks = self.locks.get(key, {})
+            locks.pop(lock_id, None)
+            if not locks:
+                self.locks.pop(key, None)
+        # the size limit may be exceeded due to previously locked items
+        self._evict_cache_items()
+
+    def _expire_locks(self, expired):
+        """ remove the locks of jobs that did not use them for a long time """
+        for key in self.locks.keys():
+            locks = self.locks.get(key, {})
+            for lock_id, timestamp in locks.items():
+                if timestamp < expired:
+                    log.info("Removing stale lock of job %s from cache " \
+                            "item %s" % (lock_id, key))
+                    locks.pop(lock_id, None)
+            if not locks:
+                self.locks.pop(key, None)
+
     def expire_cache_items(self):
         expired = time.time() - self.timeout
+        self._expire_locks(expired)
         for key in self.cache.keys():
             try:
-                if self.cache[key][1] < expired:
-                    del self.cache[key]
+                if (self.cache[key][1] < expired) and \
+                        not key in self.locks:
+                    self._remove(key)
             except KeyError:
                 # ignore removed items
                 pass
 
-    def contains(self, name):
+    def _evict_cache_items(self, keep=None):
+        """ remove the least recently used items until the size limit is met
+
+        The item "keep" (usually the one that was added just now) is never
+        removed.
+        """
+        if self.max_size is None:
+            return
+        while self.size > self.max_size:
+            candidates = [(timestamp, key)
+                    for key, (value, timestamp, size) in self.cache.items()
+                    if (key != keep) and not key in self.locks]
+            if not candidates:
+                break
+            self._remove(min(candidates)[1])
+            self.evictions += 1
+
+    def contains(self, name, lock_id=None):
         if isinstance(name, ProcessDataCacheItemID):
             name = name.value
         self._update_timestamp(name)
         self.expire_cache_items()
-        return name in self.cache.keys()
+        if name in self.cache:
+            self._lock(name, lock_id)
+            return True
+        else:
+            return False
 
-    def add(self, name, value):
+    def add(self, name, value, size=None, lock_id=None):
         now = time.time()
         if isinstance(name, ProcessDataCacheItemID):
             name = name.value
+        if size is None:
+            size = get_data_size(value)
         self.expire_cache_items()
-        self.cache[name] = [value, now]
+        self._remove(name)
+        self.cache[name] = [value, now, size]
+        self.size += size
+        self._lock(name, lock_id)
+        self._evict_cache_items(keep=name)
 
     def get(self, name):
         if isinstance(name, ProcessDataCacheItemID):
             name = name.value
         self._update_timestamp(name)
         self.expire_cache_items()
-        return self.cache[name][0]
+        try:
+            value = self.cache[name][0]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
+
+    def get_size(self, name):
+        if isinstance(name, ProcessDataCacheItemID):
+            name = name.value
+        return self.cache[name][2]
 
     def length(self):
         return len(self.cache)
 
+    def get_statistics(self):
+        return {"items": len(self.cache), "size": self.size,
+                "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
 
 class ProcessDataCacheItemID(object):
 
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+""" Benchmark the throughput of the DXF importer.
+
+A large synthetic DXF file (a grid of squares made of LINE entities, each
+followed by an ARC) is generated unless a DXF file is given. Its import is
+measured in the following steps:
+  tokenize: reading all key/value pairs
+  parse: reading the entities (without ordering the lines)
+  order: chaining and ordering the lines (see "optimize_line_order")
+The results (duration, key/value pairs and lines per second) are written as
+JSON.
+"""
+
+import sys
+import os
+BASE_DIR = os.path.realpath(os.path.join(os.path.dirname(
+        os.path.realpath(__file__)), os.pardir))
+sys.path.insert(0, BASE_DIR)
+
+from optparse import OptionParser
+import json
+import random
+import tempfile
+import time
+
+from pycam.Importers.DXFImporter import DXFParser
+
+
+def write_dxf(destination, number_of_squares):
+    """ write a grid of squares (in random order) and arcs """
+    squares = range(number_of_squares)
+    # the lines should not be in their final order
+    random.seed(0)
+    random.shuffle(squares)
+    columns = max(1, int(number_of_squares ** 0.5))
+    destination.write("0\nSECTION\n2\nENTITIES\n")
+    for index in squares:
+        x = 4.0 * (index % columns)
+        y = 4.0 * (index // columns)
+        corners = ((x, y), (x + 1, y), (x + 1, y + 1), (x, y + 1))
+        for corner_index in range(len(corners)):
+            p1 = corners[corner_index]
+            p2 = corners[(corner_index + 1) % len(corners)]
+            destination.write("0\nLINE\n8\n0\n10\n%f\n20\n%f\n30\n0.0\n"
+                    "11\n%f\n21\n%f\n31\n0.0\n" % (p1 + p2))
+        destination.write("0\nARC\n8\n0\n10\n%f\n20\n%f\n30\n0.0\n"
+                "40\n1.0\n50\n0.0\n51\n270.0\n" % (x + 0.5, y + 0.5))
+    destination.write("0\nENDSEC\n0\nEOF\n")
+
+
+class TokenizingParser(DXFParser):
+    """ read all key/value pairs without handling them """
+
+    def parse_content(self):
+        self.pairs = 0
+        while self._read_key_value()[0] is not None:
+            self.pairs += 1
+
+    def optimize_line_order(self):
+        pass
+
+
+class UnorderedParser(DXFParser):
+
+    def optimize_line_order(self):
+        pass
+
+
+def measure(func):
+    start_time = time.time()
+    result = func()
+    return result, time.time() - start_time
+
+def run_benchmark(filename):
+    result = {"file": filename, "bytes": os.path.getsize(filename)}
+    parser, duration = measure(lambda: TokenizingParser(open(filename)))
+    result["tokenize"] = {"duration": duration, "pairs": parser.pairs,
+            "pairs_per_second": parser.pairs / max(duration, 0.001)}
+    parser, duration = measure(lambda: UnorderedParser(open(filename)))
+    num_of_lines = len(parser.lines)
+    result["parse"] = {"duration": duration, "lines": num_of_lines,
+            "lines_per_second": num_of_lines / max(duration, 0.001)}
+    dummy, duration = measure(
+            lambda: DXFParser.optimize_line_order(parser))
+    result["order"] = {"duration": duration, "lines": num_of_lines,
+            "lines_per_second": num_of_lines / max(duration, 0.001)}
+    return result
+
+def main():
+    parser = OptionParser(prog="benchmark_dxf.py",
+            usage="usage: %prog [options] [DXF_FILE]\n\n" \
+                    + "Measure the throughput of the DXF importer.")
+    parser.add_option("", "--number-of-squares", dest="number_of_squares",
+            default=25000, type="int", action="store",
+            help="size of the generated DXF file (default: 25000)")
+    parser.add_option("-o", "--output", dest="output", default="-",
+            action="store", help="write the JSON report to this file " \
+                    + "(default: stdout)")
+    (opts, args) = parser.parse_args()
+    if args:
+        filename = args[0]
+        temp_filename = None
+    else:
+        handle, temp_filename = tempfile.mkstemp(prefix="benchmark-",
+                suffix=".dxf")
+        temp_file = os.fdopen(handle, "w")
+        write_dxf(temp_file, opts.number_of_squares)
+        temp_file.close()
+        filename = temp_filename
+    try:
+        report = run_benchmark(filename)
+    finally:
+        if temp_filename:
+            os.remove(temp_filename)
+    if opts.output == "-":
+        handler = sys.stdout
+    else:
+        handler = open(os.path.expanduser(opts.output), "w")
+    json.dump(report, handler, indent=2, sort_keys=True)
+    handler.write(os.linesep)
+    if handler is not sys.stdout:
+        handler.close()
+
+
+if __name__ == "__main__":
+    main()
+
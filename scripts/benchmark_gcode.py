@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+""" Benchmark the throughput of the GCode generator.
+
+A synthetic surfacing toolpath (zigzag lines with a varying height) is written
+with the LinuxCNC generator. The toolpath is stored in one of the following
+ways:
+  list: a list of (move_type, args) tuples
+  store: a compact pycam.Toolpath.MoveStore
+The GCode may be formatted in parallel ("--parallel") and it is compressed if
+the name of the output file ends with ".gz".
+The results (moves per second and bytes per second) are written as JSON.
+"""
+
+import sys
+import os
+BASE_DIR = os.path.realpath(os.path.join(os.path.dirname(
+        os.path.realpath(__file__)), os.pardir))
+sys.path.insert(0, BASE_DIR)
+
+from optparse import OptionParser
+import json
+import math
+import time
+
+from pycam.Toolpath import MOVE_STRAIGHT, MOVE_STRAIGHT_RAPID, MOVE_SAFETY
+from pycam.Toolpath.MoveStore import MoveStore
+import pycam.Exporters.GCode.LinuxCNC
+import pycam.Utils.threading
+import pycam.Toolpath.Filters as Filters
+
+
+MODES = ("list", "store")
+MOVES_PER_LINE = 1000
+
+
+def get_moves(number_of_moves):
+    """ return a zigzag toolpath with the given number of moves """
+    moves = []
+    line = 0
+    while len(moves) < number_of_moves:
+        moves.append((MOVE_SAFETY, None))
+        y = 0.5 * line
+        xs = [0.1 * index for index in range(MOVES_PER_LINE)]
+        if line % 2:
+            xs.reverse()
+        moves.append((MOVE_STRAIGHT_RAPID, (xs[0], y, 5.0)))
+        for x in xs:
+            moves.append((MOVE_STRAIGHT, (x, y, math.sin(x) + math.cos(y))))
+        line += 1
+    return moves[:number_of_moves]
+
+def get_filters(safety_height, step_width):
+    return [Filters.SafetyHeightFilter(safety_height),
+            Filters.StepWidth(step_width, step_width, step_width)]
+
+def run_mode(mode, moves, filters, destination, parallel):
+    result = {"mode": mode, "moves": len(moves), "parallel": parallel}
+    if mode == "store":
+        moves = MoveStore(moves)
+    handler = pycam.Exporters.GCode.open_destination(destination)
+    start_time = time.time()
+    generator = pycam.Exporters.GCode.LinuxCNC.LinuxCNC(handler,
+            parallel=parallel)
+    generator.add_filters(filters)
+    generator.add_moves(moves)
+    generator.finish()
+    handler.close()
+    duration = time.time() - start_time
+    result["duration"] = duration
+    result["moves_per_second"] = len(moves) / max(duration, 0.001)
+    if destination != os.devnull:
+        size = os.path.getsize(destination)
+        result["bytes"] = size
+        result["bytes_per_second"] = size / max(duration, 0.001)
+    return result
+
+def main():
+    parser = OptionParser(prog="benchmark_gcode.py",
+            usage="usage: %prog [options]\n\n" \
+                    + "Measure the throughput of the GCode generator.")
+    parser.add_option("", "--mode", dest="modes", default=[],
+            action="append", type="choice", choices=MODES,
+            help="benchmark the given mode (may be given multiple times): " \
+                    + ", ".join(MODES) + " (default: all)")
+    parser.add_option("", "--number-of-moves", dest="number_of_moves",
+            default=10 ** 6, type="int", action="store",
+            help="size of the toolpath (default: 1000000)")
+    parser.add_option("", "--step-width", dest="step_width", default=0.0001,
+            type="float", action="store",
+            help="minimum step width of all axes (default: 0.0001)")
+    parser.add_option("", "--gcode-output", dest="gcode_output",
+            default=os.devnull, action="store",
+            help="write the GCode to this file (default: discard)")
+    parser.add_option("", "--parallel", dest="parallel", default=False,
+            action="store_true", help="format the GCode in parallel")
+    parser.add_option("", "--number-of-processes", dest="parallel_processes",
+            default=None, type="int", action="store",
+            help="number of worker processes (default: number of CPU cores)")
+    parser.add_option("-o", "--output", dest="output", default="-",
+            action="store", help="write the JSON report to this file " \
+                    + "(default: stdout)")
+    (opts, args) = parser.parse_args()
+    if opts.parallel:
+        pycam.Utils.threading.init_threading(opts.parallel_processes)
+    moves = get_moves(opts.number_of_moves)
+    filters = get_filters(10.0, opts.step_width)
+    report = {"step_width": opts.step_width,
+            "runs": []}
+    for mode in (opts.modes or MODES):
+        report["runs"].append(run_mode(mode, moves, filters,
+                os.path.expanduser(opts.gcode_output), opts.parallel))
+    pycam.Utils.threading.cleanup()
+    if opts.output == "-":
+        handler = sys.stdout
+    else:
+        handler = open(os.path.expanduser(opts.output), "w")
+    json.dump(report, handler, indent=2, sort_keys=True)
+    handler.write(os.linesep)
+    if handler is not sys.stdout:
+        handler.close()
+
+
+if __name__ == "__main__":
+    main()
+
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+$Id$
+
+Copyright 2012 Lars Kruse <devel@sumpfralle.de>
+
+This file is part of PyCAM.
+
+PyCAM is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+PyCAM is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with PyCAM.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+""" Benchmark the parallel processing backends of PyCAM on localhost.
+
+A fixed DropCutter and PushCutter workload (based on one of the sample models)
+is calculated with each of the requested modes:
+  serial: no parallel processing at all
+  local: a local process pool
+  thread: a local thread pool (only useful for GIL-releasing workloads)
+  server: a local task server with local workers
+  remote: a separate task server process with its workers - this process
+      connects to it without offering own workers
+The results (throughput, queueing and transfer times based on
+pycam.Utils.threading.ProcessStatistics) are written as JSON.
+"""
+
+import sys
+import os
+BASE_DIR = os.path.realpath(os.path.join(os.path.dirname(
+        os.path.realpath(__file__)), os.pardir))
+sys.path.insert(0, BASE_DIR)
+
+from optparse import OptionParser
+import multiprocessing
+import random
+import signal
+import string
+import json
+import time
+
+from pycam.Cutters.CylindricalCutter import CylindricalCutter
+from pycam.Importers.STLImporter import ImportModel
+from pycam.PathGenerators.DropCutter import DropCutter
+from pycam.PathGenerators.PushCutter import PushCutter
+from pycam.Toolpath.MotionGrid import get_fixed_grid
+from pycam.Toolpath import MOVE_STRAIGHT
+import pycam.Utils.threading
+import pycam.Utils.log
+
+
+log = pycam.Utils.log.get_logger()
+
+MODES = ("serial", "local", "thread", "server", "remote")
+DEFAULT_MODEL = os.path.join(BASE_DIR, "samples", "pycam-textbox.stl")
+# the remote task server needs some time for starting up
+CONNECT_TIMEOUT = 15
+
+
+def get_workloads(model, tool_radius):
+    """ return a list of (name, path generator, motion grid) tuples
+
+    The motion grids are calculated in advance (as lists) - otherwise their
+    generation would be part of the measured time.
+    """
+    margin = 2 * tool_radius
+    low = (model.minx - margin, model.miny - margin, model.minz)
+    high = (model.maxx + margin, model.maxy + margin, model.maxz)
+    line_distance = 2 * tool_radius * (1.0 - 0.6)
+    dropcutter_grid = [[list(line) for line in layer]
+            for layer in get_fixed_grid((low, high), None,
+                    line_distance=line_distance, step_width=tool_radius / 4.0)]
+    layer_distance = max(1.0, (high[2] - low[2]) / 4.0)
+    pushcutter_grid = [[list(line) for line in layer]
+            for layer in get_fixed_grid((low, high), layer_distance,
+                    line_distance=2 * tool_radius * (1.0 - 0.1))]
+    return [("DropCutter", DropCutter(), dropcutter_grid, low, high),
+            ("PushCutter", PushCutter(waterlines=False), pushcutter_grid,
+                low, high)]
+
+def run_workload(cutter, model, (name, generator, grid, low, high)):
+    # every grid line is handled as a separate task
+    num_of_tasks = sum([len(layer) for layer in grid])
+    start_time = time.time()
+    moves = generator.GenerateToolPath(cutter, [model], grid, minz=low[2],
+            maxz=high[2])
+    duration = time.time() - start_time
+    num_of_moves = len([True for move_type, args in moves
+            if move_type == MOVE_STRAIGHT])
+    return {"workload": name,
+            "tasks": num_of_tasks,
+            "moves": num_of_moves,
+            "duration": duration,
+            "tasks_per_second": num_of_tasks / max(duration, 0.001),
+            "moves_per_second": num_of_moves / max(duration, 0.001)}
+
+def get_statistics():
+    """ collect the statistics of the task server (if available) """
+    workers = []
+    for (name, last_notification, num_of_tasks, process_time,
+            avg_process_time, avg_transfer_time) \
+            in pycam.Utils.threading.get_pool_statistics():
+        workers.append({"name": name,
+                "tasks": num_of_tasks,
+                "process_time": process_time,
+                "avg_process_time": avg_process_time,
+                "avg_transfer_time": avg_transfer_time})
+    queues = []
+    for (name, num_of_tasks, queueing_time, avg_queueing_time) \
+            in pycam.Utils.threading.get_queue_statistics():
+        queues.append({"name": name,
+                "tasks": num_of_tasks,
+                "queueing_time": queueing_time,
+                "avg_queueing_time": avg_queueing_time})
+    return {"workers": workers, "queues": queues,
+            "telemetry": pycam.Utils.threading.get_task_statistics()}
+
+def _run_remote_server(number_of_processes, port, auth_key):
+    """ run a task server (in a separate process) until SIGTERM arrives """
+    def handle_termination(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, handle_termination)
+    try:
+        pycam.Utils.threading.init_threading(number_of_processes,
+                run_server=True, server_credentials=auth_key,
+                local_port=port)
+    except KeyboardInterrupt:
+        pass
+    # stop the spawner and the workers
+    pycam.Utils.threading.cleanup()
+
+def _connect_remote_server(port, auth_key):
+    remote = "127.0.0.1:%d" % port
+    timeout = time.time() + CONNECT_TIMEOUT
+    while True:
+        error = pycam.Utils.threading.init_threading(0, enable_server=True,
+                remote=remote, server_credentials=auth_key)
+        if not error:
+            return None
+        elif time.time() > timeout:
+            return error
+        else:
+            time.sleep(0.5)
+
+def run_mode(mode, number_of_processes, port, cutter, model, workloads):
+    auth_key = "".join([random.choice(string.letters + string.digits)
+            for i in range(12)])
+    server_process = None
+    error = None
+    if mode == "serial":
+        pycam.Utils.threading.init_threading(0)
+    elif mode == "local":
+        pycam.Utils.threading.init_threading(number_of_processes)
+    elif mode == "thread":
+        pycam.Utils.threading.init_threading(number_of_processes,
+                backend=pycam.Utils.threading.BACKEND_THREAD)
+    elif mode == "server":
+        error = pycam.Utils.threading.init_threading(number_of_processes,
+                enable_server=True, server_credentials=auth_key,
+                local_port=port)
+    elif mode == "remote":
+        server_process = multiprocessing.Process(name="benchmark-server",
+                target=_run_remote_server,
+                args=(number_of_processes, port, auth_key))
+        server_process.start()
+        error = _connect_remote_server(port, auth_key)
+    else:
+        raise ValueError("Invalid benchmark mode: %s" % str(mode))
+    result = {"mode": mode, "processes": number_of_processes}
+    if error:
+        log.error("Failed to initialize mode '%s': %s" % (mode, error))
+        result["error"] = str(error)
+    else:
+        result["results"] = [run_workload(cutter, model, workload)
+                for workload in workloads]
+        # the workers submit their statistics after delivering the result
+        time.sleep(0.5)
+        result["statistics"] = get_statistics()
+    pycam.Utils.threading.cleanup()
+    if server_process:
+        server_process.terminate()
+        server_process.join(CONNECT_TIMEOUT)
+    return result
+
+def main():
+    parser = OptionParser(prog="benchmark_parallel.py",
+            usage="usage: %prog [options] [MODEL_FILE]\n\n" \
+                    + "Compare the throughput of PyCAM's parallel " \
+                    + "processing modes.")
+    parser.add_option("", "--mode", dest="modes", default=[],
+            action="append", type="choice", choices=MODES,
+            help="benchmark the given mode (may be given multiple times): " \
+                    + ", ".join(MODES) + " (default: all)")
+    parser.add_option("", "--number-of-processes", dest="parallel_processes",
+            default=None, type="int", action="store",
+            help="number of worker processes (default: number of CPU cores)")
+    parser.add_option("", "--tool-size", dest="tool_diameter", default=2.0,
+            type="float", action="store", help="diameter of the tool")
+    parser.add_option("", "--server-port", dest="server_port",
+            default=pycam.Utils.threading.DEFAULT_PORT + 10, type="int",
+            action="store", help="first local port to be used for the " \
+                    + "task servers")
+    parser.add_option("-o", "--output", dest="output", default="-",
+            action="store", help="write the JSON report to this file " \
+                    + "(default: stdout)")
+    (opts, args) = parser.parse_args()
+    model_filename = args[0] if args else DEFAULT_MODEL
+    model = ImportModel(model_filename)
+    if not model:
+        parser.error("Failed to load the model: %s" % model_filename)
+    number_of_processes = opts.parallel_processes
+    if number_of_processes is None:
+        number_of_processes = pycam.Utils.threading.get_number_of_cores() or 1
+    cutter = CylindricalCutter(opts.tool_diameter / 2.0,
+            height=4 * abs(model.maxz - model.minz))
+    workloads = get_workloads(model, cutter.radius)
+    report = {"model": model_filename,
+            "tool_diameter": opts.tool_diameter,
+            "runs": []}
+    for index, mode in enumerate(opts.modes or MODES):
+        # use a separate port for each server (avoid TIME_WAIT conflicts)
+        report["runs"].append(run_mode(mode, number_of_processes,
+                opts.server_port + index, cutter, model, workloads))
+    if opts.output == "-":
+        handler = sys.stdout
+    else:
+        handler = open(os.path.expanduser(opts.output), "w")
+    json.dump(report, handler, indent=2, sort_keys=True)
+    handler.write(os.linesep)
+    if handler is not sys.stdout:
+        handler.close()
+
+
+if __name__ == "__main__":
+    if hasattr(multiprocessing, "freeze_support"):
+        multiprocessing.freeze_support()
+    main()
+